@@ -1,12 +1,73 @@
-from flask import Flask, request, jsonify
-import folium
-from folium.plugins import MarkerCluster, MeasureControl, MiniMap, Fullscreen, HeatMap
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from itertools import islice
+import hashlib
+import hmac
+import json
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import time
+from types import MappingProxyType
+
+from flask import (
+    Flask, Response, g, has_app_context, request, jsonify, redirect, render_template, send_file,
+    send_from_directory, url_for,
+)
+from jinja2 import FileSystemBytecodeCache
+import numpy as np
 import math
 
+from city_search import CitySearchIndex
+from clustering import ClusterIndex
+from data_store import DataStore, SnapshotView, StaticSource, location_columns, open_source
+from export_stream import encode_csv, encode_ndjson, gzip_stream, iter_potential_chunks
+from heat_tiles import EMPTY_TILE, HEAT_MAX_ZOOM, HeatTileRenderer, TileDiskCache
+from insolation_grid import InsolationGrid, annual_mean, build_grid_from_stations
+from orientation import optimize_locations
+from portfolio_jobs import INPUT_FORMATS, PortfolioJobs, pq
+from pv_simulation import PVSystem, SolarResource, location_inputs
+from metrics import SIZE_BUCKETS, Metrics
+from profiler import SamplingProfiler
+from render_cache import BoundedCache, CompressedAsset, VersionedValue
+from spatial_index import SpatialIndex
+from tile_math import is_valid_tile, tile_range_bounds
+from work_pool import Overloaded, WorkPool
+from zones import ZOOM_LEVELS, ZoneGeometries
+from solar_calc import (
+    CO2_FACTOR,
+    DEFAULT_EFFICIENCY,
+    DEFAULT_LOSSES,
+    DEFAULT_PANEL_AREA,
+    ELECTRICITY_TARIFF,
+    calculate_solar_potential,
+    calculate_solar_potential_batch,
+)
+
 app = Flask(__name__)
+# Скомпилированные шаблоны переживают перезапуск процесса
+app.jinja_options = {
+    **app.jinja_options,
+    'bytecode_cache': FileSystemBytecodeCache(os.environ.get('SOLAR_JINJA_CACHE_DIR')),
+}
+# Файлы портфелей площадок могут быть большими, но не безгранично
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('SOLAR_MAX_UPLOAD_BYTES', 512 * 1024 * 1024))
+
+# Метрики процесса для /metrics: время запросов и этапов, размеры ответов
+METRICS = Metrics()
+METRICS.describe('solar_request_seconds', 'histogram', 'Время обработки запроса по маршруту, секунды')
+METRICS.describe('solar_response_bytes', 'histogram', 'Размер тела ответа по маршруту, байты')
+METRICS.describe('solar_stage_seconds', 'histogram', 'Время этапов рендера и расчета, секунды')
+
 
-# Добавляем данные по солнечной инсоляции для регионов России (кВтч/м²/день)
-SOLAR_INSOLATION = {
+def stage(name):
+    """Таймер этапа для solar_stage_seconds; работает и как декоратор"""
+    return METRICS.timer('solar_stage_seconds', (('stage', name),))
+
+# Встроенные данные по солнечной инсоляции для регионов России (кВтч/м²/день)
+DEFAULT_INSOLATION = {
     'Москва': {'coords': [55.7558, 37.6176], 'insolation': 2.5, 'color': '#FF6B6B'},
     'Санкт-Петербург': {'coords': [59.9390, 30.3158], 'insolation': 2.0, 'color': '#4ECDC4'},
     'Новосибирск': {'coords': [55.0302, 82.9204], 'insolation': 3.0, 'color': '#FFEAA7'},
@@ -29,34 +90,209 @@ SOLAR_INSOLATION = {
     'Уфа': {'coords': [54.7351, 55.9587], 'insolation': 2.7, 'color': '#FF00FF'},
 }
 
-# Зоны солнечной эффективности
-SOLAR_ZONES = [
+# Встроенные зоны солнечной эффективности
+DEFAULT_ZONES = [
     {'name': 'Высокая эффективность', 'color': '#FFD700', 'min': 3.0, 'max': 4.0},
     {'name': 'Средняя эффективность', 'color': '#FFA500', 'min': 2.5, 'max': 3.0},
     {'name': 'Умеренная эффективность', 'color': '#87CEEB', 'min': 2.0, 'max': 2.5},
     {'name': 'Низкая эффективность', 'color': '#B0C4DE', 'min': 1.5, 'max': 2.0},
 ]
 
+# Источник данных: файл JSON или SQLite из SOLAR_DATA_SOURCE, иначе встроенные данные.
+# Изменения файла подхватываются без перезапуска
+DATA_SOURCE_PATH = os.environ.get('SOLAR_DATA_SOURCE')
+DATA_STORE = DataStore(
+    open_source(DATA_SOURCE_PATH) if DATA_SOURCE_PATH else StaticSource(DEFAULT_INSOLATION, DEFAULT_ZONES),
+    float(os.environ.get('SOLAR_DATA_CHECK_INTERVAL', 2.0)),
+)
+
+
+def current_data():
+    """Снимок данных, закрепленный за текущим запросом; вне запроса - последний загруженный"""
+    if not has_app_context():
+        return DATA_STORE.current()
+    # Весь запрос видит одну версию данных, даже если источник сменился посреди него
+    snapshot = g.get('data_snapshot')
+    if snapshot is None:
+        snapshot = g.data_snapshot = DATA_STORE.current()
+    return snapshot
+
+
+SOLAR_INSOLATION = SnapshotView(current_data, 'locations')
+SOLAR_ZONES = SnapshotView(current_data, 'zones')
+
+
+def get_dataset_version():
+    """Версия данных, от которой зависят все кэши рендера"""
+    return current_data().version
+
+
+def refresh_dataset_version():
+    """Перечитывает источник данных, не дожидаясь проверки изменений"""
+    return DATA_STORE.reload().version
+
+
+# Сетка инсоляции: файл отображается в память, без него строится грубая сетка по станциям
+INSOLATION_GRID_PATH = os.environ.get(
+    'SOLAR_GRID_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'insolation_grid.npy')
+)
+FALLBACK_GRID_STEP = 0.5
+
+def load_insolation_grid():
+    """Открывает сетку из файла или строит грубую сетку по станциям"""
+    if os.path.exists(INSOLATION_GRID_PATH):
+        return InsolationGrid.open(INSOLATION_GRID_PATH)
+    return build_grid_from_stations(SOLAR_INSOLATION, step=FALLBACK_GRID_STEP)
+
+
+INSOLATION_GRID = VersionedValue(load_insolation_grid, get_dataset_version)
+
+
+# Геометрии зон: заранее посчитанные файлы или расчет по сетке инсоляции
+ZONES_DIR = os.environ.get(
+    'SOLAR_ZONES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'zones')
+)
+ZONES_API_URL = '/api/zones'
+# Ограничение на число тайлов в одном запросе по области просмотра
+MAX_VIEWPORT_TILES = 1024
+
+
+def load_zone_geometries():
+    """Читает геометрии зон из файлов или строит их по сетке"""
+    if all(os.path.exists(os.path.join(ZONES_DIR, f'z{zoom}.geojson')) for zoom in ZOOM_LEVELS):
+        return ZoneGeometries.load(ZONES_DIR)
+    return ZoneGeometries.build(INSOLATION_GRID.get(), SOLAR_ZONES)
+
+
+ZONE_GEOMETRIES = VersionedValue(load_zone_geometries, get_dataset_version)
+
+
+@lru_cache(maxsize=2048)
+def render_zone_tiles(version, z, x0, y0, x1, y1):
+    """GeoJSON зон для прямоугольника тайлов; версия данных входит в ключ кэша"""
+    return TILE_WORK.run(build_zone_tiles, z, x0, y0, x1, y1)
+
 
-def calculate_solar_potential(city_data, panel_area=10, efficiency=0.18):
-    """Рассчитывает потенциал солнечной энергии"""
-    daily_kwh = city_data['insolation'] * panel_area * efficiency
-    monthly_kwh = daily_kwh * 30
-    yearly_kwh = daily_kwh * 365
+@stage('zone_tiles')
+def build_zone_tiles(z, x0, y0, x1, y1):
+    """Строит GeoJSON зон для прямоугольника тайлов"""
+    features = ZONE_GEOMETRIES.get().features(z, tile_range_bounds(z, x0, y0, x1, y1))
+    body = json.dumps({'type': 'FeatureCollection', 'features': features}, ensure_ascii=False)
+    return CompressedAsset(body.encode('utf-8'), 'application/geo+json')
 
+
+# Тайлы тепловой карты: растеризация по сетке и кэш на диске, общий для процессов
+HEAT_TILES_URL = '/tiles/heat/{z}/{x}/{y}.png'
+HEAT_TILE_CACHE = TileDiskCache(
+    os.environ.get('SOLAR_TILE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'solar_heat_tiles')),
+    int(os.environ.get('SOLAR_TILE_CACHE_BYTES', 256 * 1024 * 1024)),
+)
+HEAT_TILES = VersionedValue(lambda: HeatTileRenderer(INSOLATION_GRID.get()), get_dataset_version)
+
+
+def estimate_location(lat, lon):
+    """Оценивает инсоляцию в произвольной точке; None, если точка вне сетки"""
+    monthly = INSOLATION_GRID.get().monthly_at(lat, lon)[:, 0]
+    if any(math.isnan(value) for value in monthly):
+        return None
+    return {
+        'coords': [lat, lon],
+        'insolation': round(float(annual_mean(monthly)), 2),
+        'monthly': [round(float(value), 2) for value in monthly],
+    }
+
+
+# Кластеры городов по уровням зума, выдаются по диапазону тайлов области просмотра
+CLUSTERS_API_URL = '/api/clusters'
+CLUSTER_INDEX = VersionedValue(lambda: ClusterIndex.from_locations(SOLAR_INSOLATION), get_dataset_version)
+
+
+@lru_cache(maxsize=2048)
+def render_cluster_tiles(version, z, x0, y0, x1, y1):
+    """Кластеры и точки для прямоугольника тайлов; версия данных входит в ключ кэша"""
+    return TILE_WORK.run(build_cluster_tiles, version, z, x0, y0, x1, y1)
+
+
+@stage('cluster_tiles')
+def build_cluster_tiles(version, z, x0, y0, x1, y1):
+    """Строит ответ с кластерами и точками для прямоугольника тайлов.
+
+    Номера точек - строки текущего набора данных, поэтому ответ несет его
+    версию: окно города запрашивается с ней и не перепутает город после
+    перезагрузки данных.
+    """
+    clusters, points = CLUSTER_INDEX.get().query(z, *tile_range_bounds(z, x0, y0, x1, y1))
+    names = SOLAR_INSOLATION.names
+    body = json.dumps({
+        'success': True,
+        'zoom': z,
+        'version': version,
+        'clusters': clusters,
+        'points': [city_marker_payload(names[i], i) for i in points],
+    }, ensure_ascii=False)
+    return CompressedAsset(body.encode('utf-8'), 'application/json')
+
+
+def city_marker_payload(city_name, city_id):
+    """Данные маркера города для карты"""
+    city_data = SOLAR_INSOLATION[city_name]
     return {
-        'daily': round(daily_kwh, 2),
-        'monthly': round(monthly_kwh, 2),
-        'yearly': round(yearly_kwh, 2),
-        'savings': round(yearly_kwh * 5.5 / 1000, 2),  # Пример: 5.5 руб за кВтч
-        'co2_reduction': round(yearly_kwh * 0.4 / 1000, 2),  # тонн CO2 в год
+        'id': city_id,
+        'city': city_name,
+        'coords': city_data['coords'],
+        'insolation': city_data['insolation'],
+        'marker_color': insolation_marker_color(city_data['insolation']),
     }
 
 
-def create_solar_map(selected_city=None):
+def insolation_marker_color(insolation):
+    """Цвет маркера в зависимости от инсоляции"""
+    if insolation >= 3.0:
+        return 'red'  # Высокая
+    elif insolation >= 2.5:
+        return 'orange'  # Средняя
+    elif insolation >= 2.0:
+        return 'blue'  # Умеренная
+    return 'gray'  # Низкая
+
+
+@stage('popup_render')
+def render_city_popup(city_name, panel_area=DEFAULT_PANEL_AREA, efficiency=DEFAULT_EFFICIENCY):
+    """HTML всплывающего окна города"""
+    city_data = SOLAR_INSOLATION[city_name]
+    # Шаблон рендерится без url_for, поэтому контекст запроса не нужен
+    return app.jinja_env.get_template('_city_popup.html').render(
+        city_name=city_name,
+        city_data=city_data,
+        solar_potential=calculate_solar_potential(city_data, panel_area, efficiency),
+    )
+
+
+# Всплывающие окна загружаются при открытии, маркеры хранят только номер
+# города; номер действителен только вместе с версией данных (параметр v)
+POPUP_API_URL = '/api/popup/'
+
+
+@lru_cache(maxsize=4096)
+def render_popup_fragment(version, city_id, panel_area, efficiency):
+    """Фрагмент всплывающего окна; версия данных и параметры панелей входят в ключ кэша"""
+    html = TILE_WORK.run(render_city_popup, SOLAR_INSOLATION.names[city_id], panel_area, efficiency)
+    return CompressedAsset(html.encode('utf-8'), 'text/html; charset=utf-8')
+
+
+def create_solar_map(selected_city=None, selected_point=None):
     """Создаем карту солнечной энергии"""
+    # Стек карты (folium, branca, requests) грузится при первом рендере:
+    # процессы, которые отдают только API, и утилиты его не импортируют
+    import folium
+    from folium.plugins import MarkerCluster, MeasureControl, MiniMap, Fullscreen
 
-    if selected_city and selected_city in SOLAR_INSOLATION:
+    from map_elements import ViewportClusterLoader, ViewportZoneLoader
+
+    if selected_point:
+        center_lat, center_lon = selected_point['coords']
+        zoom = 8
+    elif selected_city and selected_city in SOLAR_INSOLATION:
         center_lat, center_lon = SOLAR_INSOLATION[selected_city]['coords']
         zoom = 10
     else:
@@ -75,144 +311,78 @@ def create_solar_map(selected_city=None):
         tiles='CartoDB positron'
     )
 
-    # Добавляем слой тепловой карты солнечной инсоляции
-    heat_data = []
-    for city_name, data in SOLAR_INSOLATION.items():
-        heat_data.append([data['coords'][0], data['coords'][1], data['insolation']])
-
-    HeatMap(
-        heat_data,
+    # Тепловая карта инсоляции рисуется на сервере тайлами по сетке
+    folium.TileLayer(
+        tiles=HEAT_TILES_URL + '?v=' + get_dataset_version(),
         name="Солнечная инсоляция",
-        min_opacity=0.3,
-        max_zoom=12,
-        radius=30,
-        blur=20,
-        max_val=4.0,
-        gradient={0.2: 'blue', 0.4: 'lime', 0.6: 'yellow', 0.8: 'orange', 1: 'red'}
+        attr='Сетка инсоляции',
+        overlay=True,
+        control=True,
+        opacity=0.6,
+        max_native_zoom=HEAT_MAX_ZOOM,
+        max_zoom=15,
     ).add_to(m)
 
     # Добавляем зоны эффективности
-    for zone in SOLAR_ZONES:
-        folium.GeoJson(
-            get_zone_geojson(zone),
-            name=zone['name'],
-            style_function=lambda x, zone_color=zone['color']: {
-                'fillColor': zone_color,
-                'color': zone_color,
-                'weight': 1,
-                'fillOpacity': 0.2
-            }
+    # Геометрия зон подгружается по видимой области, в документ попадают только группы слоев
+    zone_groups = [folium.FeatureGroup(name=zone['name']).add_to(m) for zone in SOLAR_ZONES]
+    zone_styles = [
+        {'fillColor': zone['color'], 'color': zone['color'], 'weight': 1, 'fillOpacity': 0.2}
+        for zone in SOLAR_ZONES
+    ]
+    ViewportZoneLoader(zone_groups, zone_styles, ZONES_API_URL, get_dataset_version()).add_to(m)
+
+    # Города кластеризуются на сервере и подгружаются по видимой области
+    city_cluster = MarkerCluster(
+        name="Города",
+        max_cluster_radius=40,
+        show_coverage_on_hover=False,
+    ).add_to(m)
+    ViewportClusterLoader(
+        city_cluster, CLUSTERS_API_URL, POPUP_API_URL, get_dataset_version(), selected_city
+    ).add_to(m)
+
+    if selected_city in SOLAR_INSOLATION:
+        city_data = SOLAR_INSOLATION[selected_city]
+
+        # Особый маркер для выбранного города
+        folium.Marker(
+            location=city_data['coords'],
+            popup=folium.Popup(render_city_popup(selected_city), max_width=350),
+            tooltip=f"☀️ {selected_city} - {city_data['insolation']} кВтч/м²/день",
+            icon=folium.Icon(
+                color='red',
+                icon='sun',
+                prefix='fa',
+                icon_color='white'
+            )
         ).add_to(m)
 
-    # Добавляем маркеры городов с солнечной информацией
-    for city_name, city_data in SOLAR_INSOLATION.items():
-        is_selected = city_name == selected_city
-        solar_potential = calculate_solar_potential(city_data)
-
-        # Определяем цвет маркера в зависимости от инсоляции
-        marker_color = 'gray'
-        if city_data['insolation'] >= 3.0:
-            marker_color = 'red'  # Высокая
-        elif city_data['insolation'] >= 2.5:
-            marker_color = 'orange'  # Средняя
-        elif city_data['insolation'] >= 2.0:
-            marker_color = 'blue'  # Умеренная
-        else:
-            marker_color = 'gray'  # Низкая
-
-        popup_html = f'''
-        <div style="min-width: 300px; font-family: Arial, sans-serif;">
-            <div style="background: linear-gradient(135deg, {city_data['color']}, #FFFFFF);
-                        padding: 15px; border-radius: 10px 10px 0 0; color: white; text-align: center;">
-                <h3 style="margin: 0; font-size: 20px;">☀️ {city_name}</h3>
-                <p style="margin: 5px 0; font-size: 16px;">Солнечный потенциал</p>
-            </div>
-            <div style="padding: 15px; background: white;">
-                <div style="background: #f8f9fa; padding: 10px; border-radius: 5px; margin-bottom: 10px;">
-                    <p style="margin: 5px 0; font-size: 18px; color: #ff8c00;">
-                        <strong>Инсоляция:</strong> {city_data['insolation']} кВтч/м²/день
-                    </p>
-                </div>
-
-                <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 10px; margin-bottom: 15px;">
-                    <div style="background: #e3f2fd; padding: 8px; border-radius: 5px; text-align: center;">
-                        <div style="font-size: 12px; color: #666;">Дневная выработка</div>
-                        <div style="font-size: 18px; font-weight: bold; color: #2196F3;">
-                            {solar_potential['daily']} кВтч
-                        </div>
-                    </div>
-                    <div style="background: #e8f5e8; padding: 8px; border-radius: 5px; text-align: center;">
-                        <div style="font-size: 12px; color: #666;">Годовая выработка</div>
-                        <div style="font-size: 18px; font-weight: bold; color: #4CAF50;">
-                            {solar_potential['yearly']} кВтч
-                        </div>
-                    </div>
-                </div>
-
-                <div style="background: #fff3cd; padding: 10px; border-radius: 5px; margin-bottom: 10px;">
-                    <p style="margin: 5px 0; color: #856404;">
-                        <strong>💰 Годовая экономия:</strong> {solar_potential['savings']} тыс. руб
-                    </p>
-                    <p style="margin: 5px 0; color: #0c5460;">
-                        <strong>🌿 Сокращение CO2:</strong> {solar_potential['co2_reduction']} тонн
-                    </p>
-                </div>
-
-                <div style="text-align: center; margin-top: 10px;">
-                    <button onclick="window.location.href='/?city={city_name}'" 
-                            style="background: {city_data['color']}; color: white; 
-                                   border: none; padding: 10px 20px; 
-                                   border-radius: 5px; cursor: pointer; font-weight: bold;">
-                        📍 Показать на карте
-                    </button>
-                </div>
-            </div>
-        </div>
-        '''
-
-        if is_selected:
-            # Особый маркер для выбранного города
-            folium.Marker(
-                location=city_data['coords'],
-                popup=folium.Popup(popup_html, max_width=350),
-                tooltip=f"☀️ {city_name} - {city_data['insolation']} кВтч/м²/день",
-                icon=folium.Icon(
-                    color='red',
-                    icon='sun',
-                    prefix='fa',
-                    icon_color='white'
-                )
+        # Солнечные лучи вокруг города
+        for angle in range(0, 360, 30):
+            rad = math.radians(angle)
+            lat_offset = math.sin(rad) * 0.5
+            lon_offset = math.cos(rad) * 0.5
+
+            folium.PolyLine(
+                locations=[
+                    city_data['coords'],
+                    [city_data['coords'][0] + lat_offset, city_data['coords'][1] + lon_offset]
+                ],
+                color='#FFD700',
+                weight=2,
+                opacity=0.6,
+                dash_array='10, 5'
             ).add_to(m)
 
-            # Солнечные лучи вокруг города
-            for angle in range(0, 360, 30):
-                rad = math.radians(angle)
-                lat_offset = math.sin(rad) * 0.5
-                lon_offset = math.cos(rad) * 0.5
-
-                folium.PolyLine(
-                    locations=[
-                        city_data['coords'],
-                        [city_data['coords'][0] + lat_offset, city_data['coords'][1] + lon_offset]
-                    ],
-                    color='#FFD700',
-                    weight=2,
-                    opacity=0.6,
-                    dash_array='10, 5'
-                ).add_to(m)
-        else:
-            # Обычные маркеры
-            folium.CircleMarker(
-                location=city_data['coords'],
-                radius=10 + city_data['insolation'] * 2,  # Размер зависит от инсоляции
-                popup=folium.Popup(popup_html, max_width=350),
-                tooltip=f"{city_name}: {city_data['insolation']} кВтч/м²/день",
-                color=marker_color,
-                fill=True,
-                fill_color=marker_color,
-                fill_opacity=0.7,
-                weight=2
-            ).add_to(m)
+    if selected_point:
+        # Маркер произвольной точки с оценкой по сетке
+        folium.Marker(
+            location=selected_point['coords'],
+            tooltip=(f"📍 {selected_point['coords'][0]:.4f}, {selected_point['coords'][1]:.4f} - "
+                     f"{selected_point['insolation']} кВтч/м²/день"),
+            icon=folium.Icon(color='orange', icon='location-dot', prefix='fa', icon_color='white')
+        ).add_to(m)
 
     # Добавляем легенду
     legend_html = '''
@@ -279,632 +449,1059 @@ def create_solar_map(selected_city=None):
     return m
 
 
-def get_zone_geojson(zone):
-    """Возвращает GeoJSON для зоны"""
-    # Упрощенный GeoJSON для демонстрации
-    return {
-        "type": "FeatureCollection",
-        "features": [
-            {
-                "type": "Feature",
-                "properties": {"name": zone['name']},
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [[
-                        [40, 50], [40, 60], [50, 60], [50, 50], [40, 50]
-                    ]]
-                }
-            }
-        ]
+def stabilize_element_ids(root):
+    """Заменяет случайные id элементов folium на порядковые.
+
+    Одинаковые данные дают побайтно одинаковый документ в любом процессе,
+    поэтому ETag карты совпадает у всех воркеров и в CDN.
+    """
+    from branca.element import Element
+
+    ordered = []
+    stack = [root]
+    seen = set()
+    while stack:
+        element = stack.pop()
+        if id(element) in seen:
+            continue
+        seen.add(id(element))
+        ordered.append(element)
+        # Popup хранит свое содержимое в атрибутах, а не в _children
+        nested = [value for key, value in vars(element).items()
+                  if key != '_parent' and isinstance(value, Element)]
+        stack.extend(reversed(nested + list(element._children.values())))
+
+    renamed = {}
+    for number, element in enumerate(ordered, 1):
+        old_name = element.get_name()
+        element._id = f'{number:032x}'
+        renamed[old_name] = element.get_name()
+
+    # Ключи _children совпадают с именами детей и попадают в JS
+    for element in ordered:
+        element._children = OrderedDict(
+            (renamed.get(key, key) if child.get_name() == renamed.get(key) else key, child)
+            for key, child in element._children.items()
+        )
+
+
+def render_map_document(selected_city=None, selected_point=None):
+    """Строит карту и сериализует ее в отдельный HTML документ"""
+    with stage('map_build'):
+        root = create_solar_map(selected_city, selected_point).get_root()
+    stabilize_element_ids(root)
+    with stage('map_serialize'):
+        body = root.render().encode('utf-8')
+    with stage('map_compress'):
+        return CompressedAsset(body, 'text/html; charset=utf-8')
+
+
+# Тяжелые расчеты на промахах кэшей (карты, моделирование выработки, подбор
+# ориентации) идут через ограниченный пул: под GIL процесса несколько
+# одновременных рендеров только мешают друг другу. Очередь ограничена
+# ожидаемым временем ожидания по среднему времени задач, а не числом мест
+HEAVY_WORK = WorkPool(
+    int(os.environ.get('SOLAR_HEAVY_WORKERS', 1)),
+    int(os.environ.get('SOLAR_HEAVY_QUEUE', 16)),
+    float(os.environ.get('SOLAR_HEAVY_QUEUE_TIMEOUT', 10)),
+)
+# Тайлы и фрагменты карты дешевые (миллисекунды), но первая загрузка карты
+# запрашивает их десятками сразу: у них свой пул с длинной очередью, чтобы
+# они не стояли за тяжелыми расчетами и не получали 503 при холодном кэше
+TILE_WORK = WorkPool(
+    int(os.environ.get('SOLAR_TILE_WORKERS', 1)),
+    int(os.environ.get('SOLAR_TILE_QUEUE', 256)),
+    float(os.environ.get('SOLAR_TILE_QUEUE_TIMEOUT', 5)),
+)
+# Потоковые выгрузки держат место все время отдачи, поэтому у них свой лимит без очереди
+EXPORT_STREAMS = WorkPool(int(os.environ.get('SOLAR_EXPORT_STREAMS', 2)), 0)
+
+# Карта зависит только от выбранного города и версии данных. Документ карты
+# весит сотни килобайт, поэтому в памяти держатся только недавние города
+MAP_CACHE = BoundedCache(get_dataset_version, maxsize=int(os.environ.get('SOLAR_MAP_CACHE', 256)))
+
+
+def render_map_entry(city):
+    """Документ карты для кэша; рендер идет через пул тяжелых расчетов"""
+    return HEAVY_WORK.run(render_map_document, city)
+
+
+# Ссылка на карту с версией данных кэшируется браузером навсегда
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+REVALIDATE_MAX_AGE = 300
+
+
+def send_asset(asset, max_age=REVALIDATE_MAX_AGE, immutable=False):
+    """Отдает заранее сжатый ответ с ETag и заголовками кэширования"""
+    encoding = asset.choose_encoding(request.accept_encodings)
+    response = Response(asset.variants[encoding], content_type=asset.content_type)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # У каждого варианта сжатия свой сильный ETag
+    response.set_etag(asset.etag if encoding == 'identity' else f'{asset.etag}-{encoding}')
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE if immutable else max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+def load_static_assets():
+    """Читает статику и дает файлам имена с отпечатком содержимого"""
+    names = {}
+    assets = {}
+    for filename in sorted(os.listdir(app.static_folder)):
+        path = os.path.join(app.static_folder, filename)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            body = f.read()
+        stem, extension = os.path.splitext(filename)
+        fingerprinted = f'{stem}.{hashlib.sha256(body).hexdigest()[:10]}{extension}'
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type.endswith('javascript'):
+            content_type += '; charset=utf-8'
+        names[filename] = fingerprinted
+        assets[fingerprinted] = CompressedAsset(body, content_type)
+    return names, assets
+
+
+STATIC_NAMES, STATIC_ASSETS = load_static_assets()
+
+
+@app.template_global()
+def asset_url(filename):
+    """Ссылка на статический файл с отпечатком содержимого"""
+    return url_for('get_static_asset', filename=STATIC_NAMES[filename])
+
+
+def build_city_payloads(city_names, panel_area=DEFAULT_PANEL_AREA, efficiency=DEFAULT_EFFICIENCY,
+                        tariff=ELECTRICITY_TARIFF, co2_factor=CO2_FACTOR, losses=DEFAULT_LOSSES):
+    """Считает данные API для списка городов одним векторным проходом"""
+    _, _, _, insolation = location_columns(SOLAR_INSOLATION, city_names)
+    columns = calculate_solar_potential_batch(insolation, panel_area, efficiency, tariff, co2_factor, losses)
+    columns = {key: values.tolist() for key, values in columns.items()}
+    insolation = insolation.tolist()
+
+    return [
+        {
+            'city': name,
+            'insolation': insolation[i],
+            'potential': {key: values[i] for key, values in columns.items()},
+        }
+        for i, name in enumerate(city_names)
+    ]
+
+
+# Ответы с параметрами по умолчанию считаются один раз на версию данных
+DEFAULT_PAYLOADS = VersionedValue(
+    lambda: dict(zip(SOLAR_INSOLATION, build_city_payloads(list(SOLAR_INSOLATION)))),
+    get_dataset_version,
+)
+
+
+def build_city_snapshots():
+    """Готовые ответы /api/solar-data/<город> для параметров по умолчанию.
+
+    Тело и его сжатые варианты собираются один раз на версию данных,
+    запрос только выбирает готовые байты по названию.
+    """
+    return MappingProxyType({
+        # Для сотен тысяч маленьких тел brotli 11 слишком долог, выигрыш от него мизерный
+        name: CompressedAsset(
+            json.dumps({'success': True, **payload}, ensure_ascii=False).encode('utf-8'),
+            'application/json',
+            brotli_quality=5,
+        )
+        for name, payload in DEFAULT_PAYLOADS.get().items()
+    })
+
+
+CITY_SNAPSHOTS = VersionedValue(build_city_snapshots, get_dataset_version)
+
+
+# Сколько городов показывается быстрыми ссылками на главной странице
+QUICK_CITY_COUNT = 5
+
+
+def quick_cities():
+    """Города быстрых ссылок главной страницы; их карты и страницы прогреваются заранее"""
+    return list(islice(SOLAR_INSOLATION, QUICK_CITY_COUNT))
+
+
+def render_index_page(selected_city=None, city=None, selected_point=None):
+    """Рендерит главную страницу; от города зависит только панель данных"""
+    selected = selected_city if selected_city in SOLAR_INSOLATION else None
+    context = {
+        'city': city if city is not None else (selected or ''),
+        'selected': selected,
+        'insolation': SOLAR_INSOLATION[selected]['insolation'] if selected else None,
+        'solar_data': DEFAULT_PAYLOADS.get()[selected]['potential'] if selected else None,
+        'map_url': url_for('get_map_document', city=selected, v=get_dataset_version()),
+        'point': None,
     }
+    if selected_point:
+        lat, lon = selected_point['coords']
+        context.update(
+            selected=f'{lat:.4f}°, {lon:.4f}°',
+            insolation=selected_point['insolation'],
+            solar_data=calculate_solar_potential(selected_point),
+            map_url=url_for('get_map_document', lat=lat, lon=lon, v=get_dataset_version()),
+            point=(lat, lon),
+        )
+    with stage('page_render'):
+        return render_template(
+            'index.html',
+            region_count=len(SOLAR_INSOLATION),
+            quick_cities=quick_cities(),
+            **context,
+        )
+
+
+# Страница для известного города тоже зависит только от города и версии данных
+PAGE_CACHE = BoundedCache(get_dataset_version, maxsize=int(os.environ.get('SOLAR_PAGE_CACHE', 1024)))
+
+
+def render_page_entry(city):
+    """Главная страница для кэша"""
+    return CompressedAsset(render_index_page(city).encode('utf-8'), 'text/html; charset=utf-8')
+
+
+# Индексы координат и названий строятся один раз на версию данных
+SPATIAL_INDEX = VersionedValue(lambda: SpatialIndex.from_locations(SOLAR_INSOLATION), get_dataset_version)
+CITY_SEARCH = VersionedValue(lambda: CitySearchIndex(SOLAR_INSOLATION), get_dataset_version)
+
+# Почасовой ресурс занимает около 0.5 МБ на город, поэтому строится только
+# для запрошенных городов, пачками и в ограниченном кэше
+PV_RESOURCES = BoundedCache(get_dataset_version, maxsize=int(os.environ.get('SOLAR_PV_RESOURCE_CACHE', 128)))
+PV_RESOURCE_BATCH = 64
+# Результаты моделирования по ключу (город, наклон, азимут, система)
+PV_RESULTS = BoundedCache(get_dataset_version, maxsize=4096)
+# Городов в одном запросе моделирования: около 3 мс на город
+MAX_PV_CITIES = int(os.environ.get('SOLAR_MAX_PV_CITIES', 500))
+
+
+def build_city_resources(names):
+    """Почасовой ресурс для списка городов, по объекту на город"""
+    return SolarResource.from_locations({name: SOLAR_INSOLATION[name] for name in names}).split()
+
+
+@stage('pv_simulation')
+def simulate_city_yields(keys):
+    """Моделирует выработку для ключей (город, наклон, азимут, система) векторными проходами"""
+    results = [None] * len(keys)
+    # Ориентации одного города и системы считаются одним проходом
+    groups = {}
+    for i, (name, _, _, system) in enumerate(keys):
+        groups.setdefault((name, system), []).append(i)
+    names = list(dict.fromkeys(name for name, _ in groups))
+    for start in range(0, len(names), PV_RESOURCE_BATCH):
+        batch = names[start:start + PV_RESOURCE_BATCH]
+        resources = dict(zip(batch, PV_RESOURCES.get_many(batch, build_city_resources)))
+        for (name, system), positions in groups.items():
+            if name not in resources:
+                continue
+            simulation = resources[name].simulate(
+                np.array([[keys[i][1] for i in positions]]),
+                np.array([[keys[i][2] for i in positions]]),
+                system,
+            )
+            for position, i in enumerate(positions):
+                results[i] = {field: values[0, position] for field, values in simulation.items()}
+    return results
+
+
+# Выставляется после прогрева; до этого /api/ready отвечает 503
+WARM_UP_DONE = threading.Event()
+
+
+def warm_up_caches(maps=True):
+    """Компилирует шаблоны и прогревает кэши карт, страниц и данных API.
+
+    Заранее рендерятся только общая карта и города быстрых ссылок:
+    остальные документы строятся при первом запросе и живут в LRU-кэше,
+    поэтому прогрев не растет с числом станций. С maps=False карты не
+    рендерятся и стек folium не импортируется: так стартуют процессы,
+    которые отдают только API.
+    """
+    for template_name in ('index.html', '_solar_panel.html', '_city_popup.html'):
+        app.jinja_env.get_template(template_name)
+    DEFAULT_PAYLOADS.get()
+    CITY_SNAPSHOTS.get()
+    SPATIAL_INDEX.get()
+    CITY_SEARCH.get()
+    ZONE_GEOMETRIES.get()
+    CLUSTER_INDEX.get()
+    HEAT_TILES.get()
+    cities = [None, *quick_cities()]
+    if maps:
+        for city in cities:
+            MAP_CACHE.get(city, render_map_entry)
+    # url_for без запроса не работает, поэтому прогреваем в тестовом контексте
+    with app.test_request_context():
+        for city in cities:
+            PAGE_CACHE.get(city, render_page_entry)
+    WARM_UP_DONE.set()
 
 
 @app.route('/')
 def index():
     city = request.args.get('city', '').strip()
 
-    # Создаем карту
-    m = create_solar_map(city if city in SOLAR_INSOLATION else None)
-    map_html = m._repr_html_()
-
-    # Получаем данные для выбранного города
-    solar_data = None
-    if city in SOLAR_INSOLATION:
-        solar_data = calculate_solar_potential(SOLAR_INSOLATION[city])
-
-    # Генерируем HTML
-    html = f'''
-    <!DOCTYPE html>
-    <html lang="ru">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>☀️ Солнечная карта России - Потенциал солнечной энергии</title>
-        <style>
-            * {{
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }}
-
-            body {{
-                font-family: 'Arial', sans-serif;
-                background: linear-gradient(135deg, #1e3c72 0%, #2a5298 100%);
-                min-height: 100vh;
-                color: #333;
-            }}
-
-            .container {{
-                display: flex;
-                flex-direction: column;
-                height: 100vh;
-                background: white;
-                box-shadow: 0 0 30px rgba(0, 0, 0, 0.3);
-            }}
-
-            /* ШАПКА */
-            .header {{
-                background: linear-gradient(90deg, #1a237e, #283593);
-                padding: 15px 25px;
-                color: white;
-                box-shadow: 0 4px 20px rgba(0, 0, 0, 0.2);
-            }}
-
-            .header-top {{
-                display: flex;
-                align-items: center;
-                justify-content: space-between;
-                margin-bottom: 15px;
-            }}
-
-            .logo {{
-                display: flex;
-                align-items: center;
-                gap: 15px;
-            }}
-
-            .logo-icon {{
-                font-size: 40px;
-                animation: pulse 2s infinite;
-                color: #FFD700;
-            }}
-
-            @keyframes pulse {{
-                0% {{ transform: scale(1); }}
-                50% {{ transform: scale(1.1); }}
-                100% {{ transform: scale(1); }}
-            }}
-
-            .logo-text h1 {{
-                font-size: 24px;
-                font-weight: bold;
-                color: white;
-                text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
-            }}
-
-            .logo-text p {{
-                font-size: 14px;
-                opacity: 0.9;
-                color: #bbdefb;
-            }}
-
-            /* ПОИСК */
-            .search-container {{
-                background: rgba(255, 255, 255, 0.1);
-                padding: 20px;
-                border-radius: 15px;
-                backdrop-filter: blur(10px);
-                border: 2px solid rgba(255, 255, 255, 0.2);
-            }}
-
-            .search-title {{
-                font-size: 18px;
-                margin-bottom: 15px;
-                color: white;
-                text-align: center;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                gap: 10px;
-            }}
-
-            .search-box {{
-                display: flex;
-                gap: 10px;
-                margin-bottom: 15px;
-            }}
-
-            #city-input {{
-                flex: 1;
-                padding: 18px 25px;
-                border: none;
-                border-radius: 50px;
-                font-size: 18px;
-                background: white;
-                box-shadow: 0 4px 15px rgba(0, 0, 0, 0.2);
-                transition: all 0.3s;
-            }}
-
-            #city-input:focus {{
-                outline: none;
-                box-shadow: 0 6px 25px rgba(255, 255, 255, 0.3);
-                transform: translateY(-2px);
-            }}
-
-            #search-btn {{
-                padding: 18px 40px;
-                background: linear-gradient(45deg, #FFD700, #FF8C00);
-                color: #333;
-                border: none;
-                border-radius: 50px;
-                font-size: 18px;
-                font-weight: bold;
-                cursor: pointer;
-                display: flex;
-                align-items: center;
-                gap: 12px;
-                box-shadow: 0 6px 20px rgba(255, 215, 0, 0.4);
-                transition: all 0.3s;
-                min-width: 200px;
-                justify-content: center;
-            }}
-
-            #search-btn:hover {{
-                transform: translateY(-3px);
-                box-shadow: 0 10px 25px rgba(255, 140, 0, 0.6);
-            }}
-
-            .quick-search {{
-                display: flex;
-                flex-wrap: wrap;
-                gap: 10px;
-                justify-content: center;
-            }}
-
-            .quick-btn {{
-                padding: 10px 20px;
-                background: rgba(255, 215, 0, 0.2);
-                color: white;
-                border: 1px solid rgba(255, 215, 0, 0.3);
-                border-radius: 25px;
-                cursor: pointer;
-                transition: all 0.3s;
-                font-size: 14px;
-            }}
-
-            .quick-btn:hover {{
-                background: rgba(255, 215, 0, 0.4);
-                transform: translateY(-2px);
-            }}
-
-            /* ОСНОВНОЙ КОНТЕНТ */
-            .main-content {{
-                flex: 1;
-                display: flex;
-                position: relative;
-            }}
-
-            .map-container {{
-                flex: 1;
-                position: relative;
-                background: #e3f2fd;
-            }}
-
-            #map {{
-                width: 100%;
-                height: 100%;
-            }}
-
-            /* ПАНЕЛЬ СОЛНЕЧНЫХ ДАННЫХ */
-            .solar-panel {{
-                position: absolute;
-                top: 20px;
-                left: 20px;
-                width: 350px;
-                background: rgba(255, 255, 255, 0.95);
-                border-radius: 15px;
-                padding: 25px;
-                box-shadow: 0 8px 30px rgba(0, 0, 0, 0.2);
-                backdrop-filter: blur(10px);
-                border: 1px solid rgba(255, 255, 255, 0.3);
-                z-index: 1000;
-            }}
-
-            .city-header {{
-                text-align: center;
-                margin-bottom: 20px;
-            }}
-
-            .city-name {{
-                font-size: 26px;
-                font-weight: bold;
-                color: #1a237e;
-                margin-bottom: 5px;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                gap: 10px;
-            }}
-
-            .solar-stats {{
-                display: grid;
-                grid-template-columns: 1fr 1fr;
-                gap: 15px;
-                margin-bottom: 20px;
-            }}
-
-            .stat-card {{
-                background: white;
-                padding: 15px;
-                border-radius: 10px;
-                box-shadow: 0 4px 10px rgba(0,0,0,0.1);
-                text-align: center;
-                transition: transform 0.3s;
-            }}
-
-            .stat-card:hover {{
-                transform: translateY(-5px);
-            }}
-
-            .stat-value {{
-                font-size: 24px;
-                font-weight: bold;
-                margin: 10px 0;
-            }}
-
-            .stat-label {{
-                font-size: 12px;
-                color: #666;
-                text-transform: uppercase;
-                letter-spacing: 1px;
-            }}
-
-            .insolation {{
-                font-size: 36px;
-                color: #FF8C00;
-                font-weight: bold;
-            }}
-
-            .energy-color {{
-                color: #2196F3;
-            }}
-
-            .money-color {{
-                color: #4CAF50;
-            }}
-
-            .co2-color {{
-                color: #0c5460;
-            }}
-
-            .calculator {{
-                background: #f8f9fa;
-                padding: 20px;
-                border-radius: 10px;
-                margin-bottom: 20px;
-            }}
-
-            .calculator h4 {{
-                margin-bottom: 15px;
-                color: #1a237e;
-            }}
-
-            .input-group {{
-                margin-bottom: 10px;
-            }}
-
-            .input-group label {{
-                display: block;
-                margin-bottom: 5px;
-                color: #666;
-                font-size: 14px;
-            }}
-
-            .input-group input {{
-                width: 100%;
-                padding: 10px;
-                border: 1px solid #ddd;
-                border-radius: 5px;
-                font-size: 16px;
-            }}
-
-            .calculate-btn {{
-                width: 100%;
-                padding: 12px;
-                background: linear-gradient(45deg, #FFD700, #FF8C00);
-                color: #333;
-                border: none;
-                border-radius: 10px;
-                font-size: 16px;
-                font-weight: bold;
-                cursor: pointer;
-                margin-top: 10px;
-            }}
-
-            .controls {{
-                display: flex;
-                flex-direction: column;
-                gap: 10px;
-            }}
-
-            .control-btn {{
-                padding: 12px;
-                background: linear-gradient(135deg, #1a237e, #3949ab);
-                color: white;
-                border: none;
-                border-radius: 10px;
-                cursor: pointer;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                gap: 10px;
-                font-weight: bold;
-                transition: all 0.3s;
-            }}
-
-            .control-btn:hover {{
-                transform: translateY(-2px);
-                box-shadow: 0 5px 15px rgba(26, 35, 126, 0.4);
-            }}
-
-            /* ФУТЕР */
-            .footer {{
-                background: #1a237e;
-                color: white;
-                padding: 15px;
-                text-align: center;
-                font-size: 14px;
-            }}
-
-            @media (max-width: 768px) {{
-                .solar-panel {{
-                    display: none;
-                }}
-
-                .search-box {{
-                    flex-direction: column;
-                }}
-
-                #search-btn {{
-                    width: 100%;
-                }}
-            }}
-        </style>
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-    </head>
-    <body>
-        <div class="container">
-            <!-- ШАПКА -->
-            <div class="header">
-                <div class="header-top">
-                    <div class="logo">
-                        <div class="logo-icon">
-                            <i class="fas fa-solar-panel"></i>
-                        </div>
-                        <div class="logo-text">
-                            <h1>☀️ Солнечная карта России</h1>
-                            <p>Оцените потенциал солнечной энергии в вашем регионе</p>
-                        </div>
-                    </div>
-
-                    <div style="color: #bbdefb; font-size: 14px;">
-                        <i class="fas fa-sun"></i> {len(SOLAR_INSOLATION)} солнечных регионов
-                    </div>
-                </div>
-
-                <div class="search-container">
-                    <div class="search-title">
-                        <i class="fas fa-search-location"></i>
-                        НАЙДИТЕ ВАШ ГОРОД ДЛЯ РАСЧЕТА
-                    </div>
-
-                    <div class="search-box">
-                        <input type="text" 
-                               id="city-input" 
-                               placeholder="Введите ваш город для расчета солнечного потенциала..."
-                               value="{city}"
-                               autocomplete="off">
-
-                        <button id="search-btn" onclick="searchCity()">
-                            <i class="fas fa-sun"></i>
-                            РАССЧИТАТЬ ПОТЕНЦИАЛ
-                        </button>
-                    </div>
-
-                    <div class="quick-search">
-                        {' '.join([f'<div class="quick-btn" onclick="searchCityByName(\'{city_name}\')"><i class="fas fa-city"></i> {city_name}</div>' for city_name in list(SOLAR_INSOLATION.keys())[:5]])}
-                    </div>
-                </div>
-            </div>
-
-            <!-- ОСНОВНОЙ КОНТЕНТ -->
-            <div class="main-content">
-                <div class="map-container">
-                    <div id="map">{map_html}</div>
-
-                    <!-- ПАНЕЛЬ СОЛНЕЧНЫХ ДАННЫХ -->
-                    <div class="solar-panel">
-                        <div class="city-header">
-                            <div class="city-name">
-                                {city if city in SOLAR_INSOLATION else 'Выберите город'}
-                            </div>
-                        </div>
-
-                        {f'''
-                        <div style="background: #fff3e0; padding: 15px; border-radius: 10px; margin-bottom: 20px;">
-                            <p style="font-size: 18px; color: #e65100; text-align: center; margin: 0;">
-                                ☀️ Солнечная инсоляция: 
-                                <span style="font-weight: bold;">{SOLAR_INSOLATION[city]['insolation']} кВтч/м²/день</span>
-                            </p>
-                        </div>
-
-                        <div class="solar-stats">
-                            <div class="stat-card">
-                                <div class="stat-label">ДНЕВНАЯ ВЫРАБОТКА</div>
-                                <div class="stat-value energy-color">{solar_data['daily']} кВтч</div>
-                                <div style="font-size: 12px; color: #666;">Для 10м² панелей</div>
-                            </div>
-                            <div class="stat-card">
-                                <div class="stat-label">ГОДОВАЯ ВЫРАБОТКА</div>
-                                <div class="stat-value energy-color">{solar_data['yearly']} кВтч</div>
-                                <div style="font-size: 12px; color: #666;">Энергии в год</div>
-                            </div>
-                            <div class="stat-card">
-                                <div class="stat-label">ГОДОВАЯ ЭКОНОМИЯ</div>
-                                <div class="stat-value money-color">{solar_data['savings']} тыс.руб</div>
-                                <div style="font-size: 12px; color: #666;">Стоимость энергии</div>
-                            </div>
-                            <div class="stat-card">
-                                <div class="stat-label">СОКРАЩЕНИЕ CO2</div>
-                                <div class="stat-value co2-color">{solar_data['co2_reduction']} тонн</div>
-                                <div style="font-size: 12px; color: #666;">Экология в год</div>
-                            </div>
-                        </div>
-                        ''' if city in SOLAR_INSOLATION else '''
-                        <div style="text-align: center; padding: 30px; color: #666;">
-                            <i class="fas fa-sun" style="font-size: 50px; color: #ffd700; margin-bottom: 20px;"></i>
-                            <p style="font-size: 16px; margin-bottom: 10px;">Выберите город для просмотра</p>
-                            <p style="font-size: 14px;">солнечного потенциала и расчетов</p>
-                        </div>
-                        '''}
-
-                        <div class="calculator">
-                            <h4><i class="fas fa-calculator"></i> Калькулятор солнечных панелей</h4>
-                            <div class="input-group">
-                                <label for="panel-area">Площадь панелей (м²)</label>
-                                <input type="number" id="panel-area" value="10" min="1" max="100">
-                            </div>
-                            <div class="input-group">
-                                <label for="efficiency">КПД панелей (%)</label>
-                                <input type="number" id="efficiency" value="18" min="1" max="30" step="0.1">
-                            </div>
-                            <button class="calculate-btn" onclick="calculateSolar()">
-                                <i class="fas fa-bolt"></i> ПЕРЕСЧИТАТЬ
-                            </button>
-                        </div>
-
-                        <div class="controls">
-                            <button class="control-btn" onclick="zoomIn()">
-                                <i class="fas fa-search-plus"></i> Приблизить карту
-                            </button>
-                            <button class="control-btn" onclick="resetMap()">
-                                <i class="fas fa-globe-europe"></i> Вся Россия
-                            </button>
-                            <button class="control-btn" onclick="showBestRegions()">
-                                <i class="fas fa-star"></i> Лучшие регионы
-                            </button>
-                        </div>
-                    </div>
-                </div>
-            </div>
-
-            <!-- ФУТЕР -->
-            <div class="footer">
-                <div style="display: flex; justify-content: space-between; align-items: center; flex-wrap: wrap; gap: 10px;">
-                    <div>© 2025 Солнечная карта России - Потенциал возобновляемой энергии</div>
-                    <div>🇷🇺 Энергия солнца для будущего России</div>
-                    <div><i class="fas fa-leaf" style="color: #4CAF50;"></i> Чистая энергия для чистого будущего</div>
-                </div>
-            </div>
-        </div>
-
-        <script>
-            // Основные функции
-            function searchCity() {{
-                const input = document.getElementById('city-input');
-                const city = input.value.trim();
-
-                if (city) {{
-                    window.location.href = '/?city=' + encodeURIComponent(city);
-                }}
-            }}
-
-            function searchCityByName(cityName) {{
-                document.getElementById('city-input').value = cityName;
-                searchCity();
-            }}
-
-            function zoomIn() {{
-                const iframe = document.querySelector('#map iframe');
-                if (iframe && iframe.contentWindow && iframe.contentWindow.map) {{
-                    iframe.contentWindow.map.zoomIn();
-                }}
-            }}
-
-            function resetMap() {{
-                window.location.href = '/';
-            }}
-
-            function showBestRegions() {{
-                // Показать регионы с лучшей инсоляцией
-                alert('Лучшие регионы для солнечных панелей: Сочи, Махачкала, Астрахань, Краснодар');
-            }}
-
-            // Калькулятор солнечной энергии
-            function calculateSolar() {{
-                const panelArea = parseFloat(document.getElementById('panel-area').value);
-                const efficiency = parseFloat(document.getElementById('efficiency').value) / 100;
-
-                const city = '{city}';
-                if (city && city in {list(SOLAR_INSOLATION.keys())}) {{
-                    const insolation = {SOLAR_INSOLATION[city]['insolation'] if city in SOLAR_INSOLATION else 2.5};
-
-                    // Расчеты
-                    const daily = insolation * panelArea * efficiency;
-                    const yearly = daily * 365;
-                    const savings = (yearly * 5.5 / 1000).toFixed(2);
-                    const co2 = (yearly * 0.4 / 1000).toFixed(2);
-
-                    // Обновление данных
-                    document.querySelectorAll('.stat-card')[0].querySelector('.stat-value').textContent = 
-                        daily.toFixed(2) + ' кВтч';
-                    document.querySelectorAll('.stat-card')[1].querySelector('.stat-value').textContent = 
-                        yearly.toFixed(0) + ' кВтч';
-                    document.querySelectorAll('.stat-card')[2].querySelector('.stat-value').textContent = 
-                        savings + ' тыс.руб';
-                    document.querySelectorAll('.stat-card')[3].querySelector('.stat-value').textContent = 
-                        co2 + ' тонн';
-
-                    alert('Расчет обновлен для новых параметров!');
-                }} else {{
-                    alert('Сначала выберите город для расчета');
-                }}
-            }}
-
-            // Автоматический фокус на поле ввода
-            window.addEventListener('load', function() {{
-                if (!'{city}') {{
-                    document.getElementById('city-input').focus();
-                }}
-            }});
-
-            // Поиск по Enter
-            document.getElementById('city-input').addEventListener('keypress', function(e) {{
-                if (e.key === 'Enter') {{
-                    searchCity();
-                }}
-            }});
-        </script>
-    </body>
-    </html>
-    '''
+    point = parse_point_args(request.args)
+    if point is not None:
+        # Произвольная точка: панель считается по сетке инсоляции
+        return render_index_page(None, city, selected_point=point)
+    if city and city not in SOLAR_INSOLATION:
+        # "москва", "МОСКВЁ" или "Moskva" ведут на каноничный адрес с кэшированной страницей
+        resolved = CITY_SEARCH.get().resolve(city)
+        if resolved is not None:
+            return redirect(url_for('index', city=resolved))
+        # Неизвестный город рендерим без кэша: в поле поиска остается ввод пользователя
+        return render_index_page(None, city)
+    return send_asset(PAGE_CACHE.get(city or None, render_page_entry), max_age=0)
+
+
+@app.route('/assets/<filename>')
+def get_static_asset(filename):
+    """Отдает статику с отпечатком в имени, кэшируемую навсегда"""
+    asset = STATIC_ASSETS.get(filename)
+    if asset is None:
+        return jsonify({'success': False, 'error': 'Файл не найден'}), 404
+    return send_asset(asset, immutable=True)
+
+
+@app.route('/map')
+def get_map_document():
+    """Отдает карту отдельным кэшируемым документом"""
+    point = parse_point_args(request.args)
+    if point is not None:
+        # Карты произвольных точек не кэшируются: точек слишком много
+        return send_asset(HEAVY_WORK.run(render_map_document, selected_point=point))
 
-    return html
+    city = request.args.get('city', '').strip()
+    if city and city not in SOLAR_INSOLATION:
+        return jsonify({'success': False, 'error': 'Город не найден'}), 404
+
+    asset = MAP_CACHE.get(city or None, render_map_entry)
+    return send_asset(asset, immutable=request.args.get('v') == get_dataset_version())
+
+
+def parse_panel_params(args):
+    """Читает площадь и КПД панелей; None, если значения некорректны"""
+    try:
+        panel_area = float(args.get('panel_area', DEFAULT_PANEL_AREA))
+        efficiency = float(args.get('efficiency', DEFAULT_EFFICIENCY))
+    except ValueError:
+        return None
+    if not (0 < panel_area < float('inf')) or not (0 < efficiency <= 1):
+        return None
+    return panel_area, efficiency
+
+
+# Параметры расчета потенциала. Значения квантуются (площадь до 0.01 м², КПД
+# и потери до 0.01 %, тариф до копейки, выбросы до грамма), чтобы почти
+# одинаковые запросы попадали в один ключ кэша
+CalcParams = namedtuple('CalcParams', ['panel_area', 'efficiency', 'tariff', 'co2_factor', 'losses'])
+DEFAULT_CALC_PARAMS = CalcParams(DEFAULT_PANEL_AREA, DEFAULT_EFFICIENCY, ELECTRICITY_TARIFF, CO2_FACTOR, DEFAULT_LOSSES)
+CALC_PARAM_DIGITS = CalcParams(2, 4, 2, 3, 4)
+
+
+def parse_calc_params(args):
+    """Читает и квантует параметры расчета; None, если значения некорректны"""
+    try:
+        params = CalcParams(*(
+            round(float(args.get(name, default)), digits)
+            for name, default, digits in zip(CalcParams._fields, DEFAULT_CALC_PARAMS, CALC_PARAM_DIGITS)
+        ))
+    except (ValueError, OverflowError):
+        return None
+    if not (0 < params.panel_area < float('inf')) or not (0 < params.efficiency <= 1) \
+            or not (0 <= params.tariff < float('inf')) or not (0 <= params.co2_factor < float('inf')) \
+            or not (0 <= params.losses < 1):
+        return None
+    return params
+
+
+def parse_point_args(args):
+    """Возвращает оценку для точки из параметров lat/lon, если они заданы и есть данные"""
+    if 'lat' not in args or 'lon' not in args:
+        return None
+    coords = parse_float_args(args, ('lat', 'lon'))
+    if coords is None or not -90 <= coords[0] <= 90:
+        return None
+    return estimate_location(*coords)
+
+
+def parse_city_list(args, default_all=True):
+    """Разбирает список городов из параметров city и cities; без них - все города, если default_all"""
+    requested = list(args.getlist('city'))
+    for value in args.getlist('cities'):
+        requested.extend(value.split(','))
+    requested = [name.strip() for name in requested if name.strip()]
+
+    if 'all' in requested or (not requested and default_all):
+        return list(SOLAR_INSOLATION)
+    # Убираем повторы, сохраняя порядок запроса
+    return list(dict.fromkeys(requested))
+
+
+def parse_limited_city_list(args, limit):
+    """Явный список городов не длиннее limit для дорогих расчетов; None, если он пуст или длиннее"""
+    requested = parse_city_list(args, default_all=False)
+    if not requested or len(requested) > limit:
+        return None
+    return requested
+
+
+def city_limit_error(limit):
+    return jsonify({
+        'success': False,
+        'error': f'Укажите от 1 до {limit} городов в параметре city или cities',
+    }), 400
+
+
+# Результаты расчета с пользовательскими параметрами по ключу (город, параметры)
+CALC_RESULTS = BoundedCache(get_dataset_version, maxsize=65536)
+
+
+@stage('potential_sweep')
+def calculate_city_payloads(keys):
+    """Считает данные API для ключей (город, параметры), по векторному проходу на набор параметров"""
+    results = [None] * len(keys)
+    for params in dict.fromkeys(params for _, params in keys):
+        selected = [i for i, key in enumerate(keys) if key[1] == params]
+        for i, payload in zip(selected, build_city_payloads([keys[i][0] for i in selected], *params)):
+            results[i] = payload
+    return results
+
+
+@app.route('/api/solar-data')
+def get_solar_data_bulk():
+    """API для получения данных сразу по нескольким городам"""
+    params = parse_calc_params(request.args)
+    if params is None:
+        return jsonify({'success': False, 'error': 'Некорректные параметры расчета'}), 400
+
+    requested = parse_city_list(request.args)
+    found = [name for name in requested if name in SOLAR_INSOLATION]
+    not_found = [name for name in requested if name not in SOLAR_INSOLATION]
+
+    if params == DEFAULT_CALC_PARAMS:
+        payloads = DEFAULT_PAYLOADS.get()
+        results = [payloads[name] for name in found]
+    else:
+        results = CALC_RESULTS.get_many(
+            [(name, params) for name in found],
+            # Векторный расчет занимает миллисекунды даже для тысяч городов, пул ему не нужен
+            calculate_city_payloads,
+        )
+
+    response = jsonify({
+        'success': True,
+        **params._asdict(),
+        'results': results,
+        'not_found': not_found,
+    })
+    # Повторный опрос с тем же ETag получает 304 без тела
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 @app.route('/api/solar-data/<city_name>')
 def get_solar_data(city_name):
     """API для получения данных по солнечной энергии"""
-    if city_name in SOLAR_INSOLATION:
-        solar_potential = calculate_solar_potential(SOLAR_INSOLATION[city_name])
-        return jsonify({
-            'success': True,
-            'city': city_name,
-            'insolation': SOLAR_INSOLATION[city_name]['insolation'],
-            'potential': solar_potential
+    asset = CITY_SNAPSHOTS.get().get(city_name)
+    if asset is None:
+        return jsonify({'success': False, 'error': 'Город не найден'}), 404
+    return send_asset(asset)
+
+
+def parse_float_args(args, names):
+    """Читает обязательные числовые параметры, возвращает None при ошибке"""
+    try:
+        values = [float(args[name]) for name in names]
+    except (KeyError, ValueError):
+        return None
+    if not all(math.isfinite(value) for value in values):
+        return None
+    return values
+
+
+def location_payload(city_name, **extra):
+    city_data = SOLAR_INSOLATION[city_name]
+    return {
+        'city': city_name,
+        'coords': city_data['coords'],
+        'insolation': city_data['insolation'],
+        **extra,
+    }
+
+
+# Оптимальная ориентация по ключу (город, система)
+ORIENTATION_RESULTS = BoundedCache(get_dataset_version, maxsize=1024)
+# Городов в одном запросе подбора ориентации: около 50 мс на город
+MAX_ORIENTATION_CITIES = int(os.environ.get('SOLAR_MAX_ORIENTATION_CITIES', 50))
+
+
+@stage('orientation_search')
+def optimize_city_orientations(keys):
+    """Ищет лучшие наклон и азимут для ключей (город, система), по проходу на систему"""
+    results = [None] * len(keys)
+    for system in dict.fromkeys(system for _, system in keys):
+        selected = [i for i, key in enumerate(keys) if key[1] == system]
+        lat, lon, monthly_ghi = location_inputs({keys[i][0]: SOLAR_INSOLATION[keys[i][0]] for i in selected})
+        for i, result in zip(selected, optimize_locations(lat, lon, monthly_ghi, system)):
+            results[i] = result
+    return results
+
+
+def job_grid_source():
+    """Сетка для дочернего процесса: путь к файлу или сама сетка, построенная в памяти"""
+    return INSOLATION_GRID_PATH if os.path.exists(INSOLATION_GRID_PATH) else INSOLATION_GRID.get()
+
+
+# Задачи расчета портфелей: каталог общий для всех процессов веб-сервера
+PORTFOLIO_JOBS = PortfolioJobs(
+    os.environ.get('SOLAR_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'solar_jobs')),
+    job_grid_source,
+    int(os.environ.get('SOLAR_JOB_WORKERS', 0)) or None,
+)
+
+
+def parse_pv_params(args):
+    """Читает наклон, азимут и параметры системы; None, если значения некорректны"""
+    params = parse_panel_params(args)
+    try:
+        tilt = args.get('tilt')
+        tilt = None if tilt is None else round(float(tilt), 1)
+        azimuth = round(float(args.get('azimuth', 180)), 1)
+        losses = float(args.get('losses', PVSystem._field_defaults['losses']))
+    except ValueError:
+        return None
+    if params is None or (tilt is not None and not 0 <= tilt <= 90) \
+            or not 0 <= azimuth <= 360 or not 0 <= losses < 1:
+        return None
+    return tilt, azimuth, PVSystem(panel_area=params[0], efficiency=params[1], losses=losses)
+
+
+@app.route('/api/pv-yield')
+def get_pv_yield():
+    """API почасового моделирования выработки за год для городов"""
+    params = parse_pv_params(request.args)
+    if params is None:
+        return jsonify({'success': False, 'error': 'Некорректные параметры расчета'}), 400
+    tilt, azimuth, system = params
+
+    requested = parse_limited_city_list(request.args, MAX_PV_CITIES)
+    if requested is None:
+        return city_limit_error(MAX_PV_CITIES)
+    found = [name for name in requested if name in SOLAR_INSOLATION]
+    not_found = [name for name in requested if name not in SOLAR_INSOLATION]
+    # Без наклона панель ставится под углом, равным широте
+    keys = [
+        (name, tilt if tilt is not None else float(round(SOLAR_INSOLATION[name]['coords'][0])), azimuth, system)
+        for name in found
+    ]
+    simulations = PV_RESULTS.get_many(keys, lambda missing: HEAVY_WORK.run(simulate_city_yields, missing))
+
+    include_hourly = request.args.get('hourly') == '1'
+    results = []
+    for (name, city_tilt, city_azimuth, _), simulation in zip(keys, simulations):
+        result = {
+            'city': name,
+            'tilt': city_tilt,
+            'azimuth': city_azimuth,
+            'monthly': np.round(simulation['monthly'], 2).tolist(),
+            'yearly': round(float(simulation['yearly']), 2),
+            'poa_yearly': round(float(simulation['poa_yearly']), 2),
+            'specific_yield': round(float(simulation['specific_yield']), 2),
+            'performance_ratio': round(float(simulation['performance_ratio']), 4),
+        }
+        if include_hourly:
+            result['hourly'] = np.round(simulation['hourly'], 4).tolist()
+        results.append(result)
+
+    return jsonify({
+        'success': True,
+        'system': system._asdict(),
+        'results': results,
+        'not_found': not_found,
+    })
+
+
+@app.route('/api/optimal-orientation')
+def get_optimal_orientation():
+    """API подбора наклона и азимута панелей с наибольшей годовой выработкой"""
+    params = parse_pv_params(request.args)
+    if params is None:
+        return jsonify({'success': False, 'error': 'Некорректные параметры расчета'}), 400
+    system = params[2]
+
+    requested = parse_limited_city_list(request.args, MAX_ORIENTATION_CITIES)
+    if requested is None:
+        return city_limit_error(MAX_ORIENTATION_CITIES)
+    found = [name for name in requested if name in SOLAR_INSOLATION]
+    not_found = [name for name in requested if name not in SOLAR_INSOLATION]
+    orientations = ORIENTATION_RESULTS.get_many(
+        [(name, system) for name in found],
+        lambda missing: HEAVY_WORK.run(optimize_city_orientations, missing),
+    )
+
+    results = []
+    for name, orientation in zip(found, orientations):
+        results.append({
+            'city': name,
+            'tilt': orientation['tilt'],
+            'azimuth': orientation['azimuth'],
+            'yearly': round(orientation['yearly'], 2),
+            'horizontal_yearly': round(orientation['horizontal_yearly'], 2),
+            # Прирост относительно горизонтальной установки, %
+            'gain': round((orientation['yearly'] / orientation['horizontal_yearly'] - 1) * 100, 2)
+            if orientation['horizontal_yearly'] > 0 else None,
         })
-    return jsonify({'success': False, 'error': 'Город не найден'}), 404
+
+    return jsonify({
+        'success': True,
+        'system': system._asdict(),
+        'results': results,
+        'not_found': not_found,
+    })
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_portfolio_job():
+    """Принимает CSV или Parquet с площадками (lat, lon, area, efficiency) и ставит задачу расчета"""
+    upload = request.files.get('file')
+    if upload is not None:
+        name = upload.filename or ''
+        save_input = upload.save
+    elif request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        # Тело формы уже разобрано, и request.stream пуст: без поля file задачу ставить не из чего
+        return jsonify({'success': False, 'error': 'Файл передается в поле формы file'}), 400
+    else:
+        # Файл можно прислать и телом запроса, формат тогда задается параметром
+        name = ''
+
+        def save_input(path):
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(request.stream, f, 1024 * 1024)
+
+    input_format = request.args.get('format') or os.path.splitext(name)[1].lstrip('.').lower() or 'csv'
+    if input_format not in INPUT_FORMATS:
+        return jsonify({'success': False, 'error': 'Поддерживаются файлы CSV и Parquet'}), 400
+    if input_format == 'parquet' and pq is None:
+        return jsonify({'success': False, 'error': 'Для Parquet на сервере нужен pyarrow'}), 400
+
+    job_id = PORTFOLIO_JOBS.submit(save_input, input_format)
+    if job_id is None:
+        return jsonify({'success': False, 'error': 'Файл пуст'}), 400
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('get_portfolio_job', job_id=job_id),
+        'result_url': url_for('get_portfolio_job_result', job_id=job_id),
+    }), 202
+
+
+@app.route('/api/jobs/<job_id>')
+def get_portfolio_job(job_id):
+    """Состояние задачи: queued, running, done или failed, с прогрессом"""
+    status = PORTFOLIO_JOBS.status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Задача не найдена'}), 404
+    response = jsonify({'success': status['state'] != 'failed', **status})
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route('/api/jobs/<job_id>/result')
+def get_portfolio_job_result(job_id):
+    """Скачивание результата завершенной задачи"""
+    status = PORTFOLIO_JOBS.status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Задача не найдена'}), 404
+    path = PORTFOLIO_JOBS.result_path(job_id)
+    if path is None:
+        return jsonify({'success': False, 'error': 'Задача еще не завершена', 'state': status['state']}), 409
+    return send_file(path, mimetype='text/csv', as_attachment=True,
+                     download_name=f'portfolio-{job_id}.csv', conditional=True)
+
+
+# Ограничение на число наборов параметров в одной выгрузке
+MAX_EXPORT_PARAMETER_SETS = 100000
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', encode_ndjson),
+    'csv': ('text/csv; charset=utf-8', encode_csv),
+}
+
+
+def parse_float_list(args, name, default):
+    """Список чисел из повторяющегося параметра или значений через запятую"""
+    values = [value for raw in args.getlist(name) for value in raw.split(',') if value.strip()]
+    if not values:
+        return [default]
+    try:
+        return list(dict.fromkeys(float(value) for value in values))
+    except ValueError:
+        return None
+
+
+@app.route('/api/export')
+def export_solar_data():
+    """Потоковая выгрузка потенциала городов для всех сочетаний площади и КПД в NDJSON или CSV"""
+    export_format = request.args.get('format', 'ndjson')
+    panel_areas = parse_float_list(request.args, 'panel_area', DEFAULT_PANEL_AREA)
+    efficiencies = parse_float_list(request.args, 'efficiency', DEFAULT_EFFICIENCY)
+    if export_format not in EXPORT_FORMATS or panel_areas is None or efficiencies is None \
+            or not all(0 < area < float('inf') for area in panel_areas) \
+            or not all(0 < efficiency <= 1 for efficiency in efficiencies):
+        return jsonify({'success': False, 'error': 'Некорректные параметры выгрузки'}), 400
+    if len(panel_areas) * len(efficiencies) > MAX_EXPORT_PARAMETER_SETS:
+        return jsonify({'success': False, 'error': 'Слишком много наборов параметров'}), 400
+    # Генератор работает уже после выхода из обработчика, поэтому берет снимок данных явно
+    locations = current_data().locations
+    names = [name for name in parse_city_list(request.args) if name in locations]
+
+    content_type, encode = EXPORT_FORMATS[export_format]
+    # Генератор считает и отдает строки порциями: память не растет с объемом выгрузки
+    body = encode(iter_potential_chunks(locations, names, panel_areas, efficiencies))
+    response = Response(body, content_type=content_type)
+    if request.args.get('gzip') == '1':
+        response.response = gzip_stream(body)
+        response.headers['Content-Encoding'] = 'gzip'
+    response.response = EXPORT_STREAMS.stream(response.response)
+    response.headers['Content-Disposition'] = f'attachment; filename=solar-export.{export_format}'
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route('/api/solar-point')
+def get_solar_point():
+    """API расчета потенциала в произвольной точке по сетке инсоляции"""
+    coords = parse_float_args(request.args, ('lat', 'lon'))
+    params = parse_calc_params(request.args)
+    if coords is None or params is None or not -90 <= coords[0] <= 90:
+        return jsonify({'success': False, 'error': 'Некорректные параметры расчета'}), 400
+
+    point = estimate_location(*coords)
+    if point is None:
+        return jsonify({'success': False, 'error': 'Нет данных для этой точки'}), 404
+    return jsonify({
+        'success': True,
+        **point,
+        'potential': calculate_solar_potential(point, *params),
+    })
+
+
+@app.route('/tiles/zones/<int:z>/<int:x>/<int:y>.geojson')
+def get_zone_tile(z, x, y):
+    """Тайл геометрии зон эффективности"""
+    if not is_valid_tile(z, x, y):
+        return jsonify({'success': False, 'error': 'Некорректный тайл'}), 404
+    asset = render_zone_tiles(get_dataset_version(), z, x, y, x, y)
+    return send_asset(asset, immutable=request.args.get('v') == get_dataset_version())
+
+
+@app.route('/tiles/heat/<int:z>/<int:x>/<int:y>.png')
+def get_heat_tile(z, x, y):
+    """PNG-тайл тепловой карты инсоляции"""
+    if not is_valid_tile(z, x, y, max_zoom=HEAT_MAX_ZOOM):
+        return jsonify({'success': False, 'error': 'Некорректный тайл'}), 404
+    version = get_dataset_version()
+    body = HEAT_TILE_CACHE.get(version, (z, x, y))
+    if body is None:
+        with stage('heat_tile_render'):
+            body = TILE_WORK.run(HEAT_TILES.get().render, z, x, y)
+        # Пустые тайлы отдаются из памяти, на диск их не пишем
+        if body is not EMPTY_TILE:
+            HEAT_TILE_CACHE.put(version, (z, x, y), body)
+    asset = CompressedAsset(body, 'image/png', compress=False)
+    return send_asset(asset, immutable=request.args.get('v') == version)
+
+
+def parse_tile_range(args):
+    """Читает диапазон тайлов z, x0, y0, x1, y1; None, если он некорректен или слишком велик"""
+    try:
+        z, x0, y0, x1, y1 = (int(args[name]) for name in ('z', 'x0', 'y0', 'x1', 'y1'))
+    except (KeyError, ValueError):
+        return None
+    n = 2 ** z if 0 <= z <= 18 else 0
+    # x может выходить за [0, n) при прокрутке через 180-й меридиан
+    if not n or not (-n <= x0 <= x1 < 2 * n and 0 <= y0 <= y1 < n) \
+            or (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_VIEWPORT_TILES:
+        return None
+    return z, x0, y0, x1, y1
+
+
+@app.route(POPUP_API_URL + '<int:city_id>')
+def get_city_popup(city_id):
+    """HTML всплывающего окна города для параметров панелей"""
+    # Номер из старой версии данных после перезагрузки указывает на другой город
+    if request.args.get('v', get_dataset_version()) != get_dataset_version():
+        return jsonify({'success': False, 'error': 'Данные обновились, обновите страницу'}), 410
+    if not 0 <= city_id < len(SOLAR_INSOLATION):
+        return jsonify({'success': False, 'error': 'Город не найден'}), 404
+    params = parse_panel_params(request.args)
+    if params is None:
+        return jsonify({'success': False, 'error': 'Некорректные параметры расчета'}), 400
+
+    asset = render_popup_fragment(get_dataset_version(), city_id, *params)
+    return send_asset(asset, immutable=request.args.get('v') == get_dataset_version())
+
+
+@app.route(ZONES_API_URL)
+def get_zones_in_view():
+    """Геометрия зон для диапазона тайлов x0..x1, y0..y1, покрывающего область просмотра"""
+    tiles = parse_tile_range(request.args)
+    if tiles is None:
+        return jsonify({'success': False, 'error': 'Некорректные параметры'}), 400
+
+    asset = render_zone_tiles(get_dataset_version(), *tiles)
+    return send_asset(asset, immutable=request.args.get('v') == get_dataset_version())
+
+
+@app.route(CLUSTERS_API_URL)
+def get_clusters_in_view():
+    """Кластеры и точки городов для диапазона тайлов области просмотра"""
+    tiles = parse_tile_range(request.args)
+    if tiles is None:
+        return jsonify({'success': False, 'error': 'Некорректные параметры'}), 400
+
+    asset = render_cluster_tiles(get_dataset_version(), *tiles)
+    return send_asset(asset, immutable=request.args.get('v') == get_dataset_version())
+
+
+@app.route('/api/autocomplete')
+def get_city_suggestions():
+    """API автодополнения названий городов"""
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+
+    response = jsonify({
+        'success': True,
+        'query': query,
+        'results': [location_payload(name, match=match) for name, match in CITY_SEARCH.get().complete(query, limit)],
+    })
+    response.cache_control.public = True
+    response.cache_control.max_age = REVALIDATE_MAX_AGE
+    return response
+
+
+@app.route('/api/nearest')
+def get_nearest_cities():
+    """API поиска ближайших к точке городов"""
+    coords = parse_float_args(request.args, ('lat', 'lon'))
+    if coords is None or not -90 <= coords[0] <= 90:
+        return jsonify({'success': False, 'error': 'Некорректные координаты'}), 400
+    k = min(max(request.args.get('k', 1, type=int), 1), 100)
+
+    index = SPATIAL_INDEX.get()
+    return jsonify({
+        'success': True,
+        'results': [
+            location_payload(index.names[i], distance_km=round(distance, 2))
+            for i, distance in index.nearest(coords[0], coords[1], k)
+        ],
+    })
+
+
+@app.route('/api/bbox')
+def get_cities_in_bbox():
+    """API поиска городов в прямоугольнике south/west/north/east"""
+    bounds = parse_float_args(request.args, ('south', 'west', 'north', 'east'))
+    if bounds is None or not -90 <= bounds[0] <= bounds[2] <= 90:
+        return jsonify({'success': False, 'error': 'Некорректные границы'}), 400
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+
+    index = SPATIAL_INDEX.get()
+    found = index.bbox(*bounds)
+    return jsonify({
+        'success': True,
+        'total': int(len(found)),
+        'results': [location_payload(index.names[i]) for i in found[:limit]],
+    })
+
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(error):
+    """Ответ при заполненной очереди тяжелых расчетов"""
+    response = jsonify({'success': False, 'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+@app.route('/api/ready')
+def get_readiness():
+    """Проверка готовности для балансировщика: 200 только после прогрева кэшей"""
+    if not WARM_UP_DONE.is_set():
+        return jsonify({'success': False, 'ready': False, 'error': 'Прогрев еще не завершен'}), 503
+    return jsonify({'success': True, 'ready': True, 'version': get_dataset_version(), 'pid': os.getpid()})
+
+
+def lru_cache_stats(function):
+    """Статистика функции под lru_cache в тех же полях, что у остальных кэшей"""
+    info = function.cache_info()
+    total = info.hits + info.misses
+    return {
+        'entries': info.currsize,
+        'maxsize': info.maxsize,
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_ratio': round(info.hits / total, 4) if total else 0.0,
+    }
+
+
+def collect_cache_stats():
+    """Статистика кэшей, пулов расчетов и источника данных"""
+    return {
+        'map': MAP_CACHE.stats(),
+        'page': PAGE_CACHE.stats(),
+        'heat_tiles': HEAT_TILE_CACHE.stats(),
+        'pv_resource': PV_RESOURCES.stats(),
+        'pv_yield': PV_RESULTS.stats(),
+        'orientation': ORIENTATION_RESULTS.stats(),
+        'solar_data': CALC_RESULTS.stats(),
+        'zone_tiles': lru_cache_stats(render_zone_tiles),
+        'cluster_tiles': lru_cache_stats(render_cluster_tiles),
+        'popup': lru_cache_stats(render_popup_fragment),
+        'heavy_work': HEAVY_WORK.stats(),
+        'tile_work': TILE_WORK.stats(),
+        'export_streams': EXPORT_STREAMS.stats(),
+        'data_store': DATA_STORE.stats(),
+    }
+
+
+@app.route('/api/cache-stats')
+def get_cache_stats():
+    """Статистика попаданий в кэши рендера"""
+    return jsonify(collect_cache_stats())
+
+
+# Поля статистики, которые только растут; остальные числа - текущие значения
+COUNTER_FIELDS = {
+    'hits', 'misses', 'coalesced', 'evicted', 'expired', 'completed', 'rejected', 'timed_out', 'reloads', 'failures',
+}
+WORK_POOLS = ('heavy_work', 'tile_work', 'export_streams')
+# Справка семейства метрик; сам кэш или пул различается меткой
+METRIC_HELP = {
+    'solar_cache_entries': 'Записей в кэше',
+    'solar_cache_maxsize': 'Наибольшее число записей в кэше',
+    'solar_cache_bytes': 'Размер файлов кэша на диске, байт',
+    'solar_cache_hits_total': 'Попадания в кэш',
+    'solar_cache_misses_total': 'Промахи кэша',
+    'solar_cache_coalesced_total': 'Промахи, дождавшиеся рендера, начатого другим запросом',
+    'solar_cache_evicted_total': 'Записи, вытесненные из-за ограничения размера',
+    'solar_cache_expired_total': 'Записи, сброшенные при смене версии данных',
+    'solar_cache_hit_ratio': 'Доля попаданий в кэш с запуска процесса',
+    'solar_work_pool_max_workers': 'Наибольшее число одновременных задач пула',
+    'solar_work_pool_max_pending': 'Наибольшее число задач в очереди пула',
+    'solar_work_pool_active': 'Задачи пула, выполняемые сейчас',
+    'solar_work_pool_waiting': 'Задачи, ожидающие места в пуле',
+    'solar_work_pool_average_ms': 'Скользящее среднее время задачи пула, мс',
+    'solar_work_pool_completed_total': 'Завершенные задачи пула',
+    'solar_work_pool_rejected_total': 'Задачи, отклоненные из-за заполненной очереди (503)',
+    'solar_work_pool_timed_out_total': 'Задачи, не дождавшиеся места в пуле (503)',
+    'solar_data_store_locations': 'Станций в текущем снимке данных',
+    'solar_data_store_zones': 'Зон в текущем снимке данных',
+    'solar_data_store_reloads_total': 'Перезагрузки источника данных',
+    'solar_data_store_failures_total': 'Неудачные перезагрузки источника данных',
+}
+
+
+def collect_stats_metrics():
+    """Статистика кэшей в виде метрик, снимается в момент опроса /metrics"""
+    for group, stats in collect_cache_stats().items():
+        if group in WORK_POOLS:
+            prefix, labels = 'solar_work_pool', (('pool', group),)
+        elif group == 'data_store':
+            prefix, labels = 'solar_data_store', ()
+        else:
+            prefix, labels = 'solar_cache', (('cache', group),)
+        for field, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            kind = 'counter' if field in COUNTER_FIELDS else 'gauge'
+            name = f'{prefix}_{field}_total' if kind == 'counter' else f'{prefix}_{field}'
+            yield name, kind, METRIC_HELP.get(name, field), labels, value
+
+
+METRICS.add_collector(collect_stats_metrics)
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return Response(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Выборочное профилирование отдельного запроса: заголовок X-Solar-Profile
+# с токеном из SOLAR_ADMIN_TOKEN; без токена в окружении профайлер выключен
+ADMIN_TOKEN = os.environ.get('SOLAR_ADMIN_TOKEN')
+PROFILE_HEADER = 'X-Solar-Profile'
+PROFILE_DIR = os.environ.get('SOLAR_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'solar_profiles'))
+# Сколько последних профилей хранить
+PROFILE_KEEP = 50
+
+
+def is_admin_token(token):
+    return bool(ADMIN_TOKEN and token) and hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+
+def save_profile(profiler, endpoint):
+    """Пишет свернутые стеки в PROFILE_DIR и удаляет самые старые профили; возвращает имя файла"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = ''.join(c if c.isalnum() else '-' for c in endpoint).strip('-') or 'root'
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{slug}-{round(profiler.duration * 1000)}ms.folded'
+    profiler.dump(os.path.join(PROFILE_DIR, name))
+    profiles = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith('.folded')),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[:-PROFILE_KEEP]:
+        os.remove(entry.path)
+    return name
+
+
+@app.before_request
+def start_request_instrumentation():
+    g.request_started = time.perf_counter()
+    if is_admin_token(request.headers.get(PROFILE_HEADER)):
+        g.profiler = SamplingProfiler().start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    # Шаблон маршрута, а не URL: число рядов метрик не растет с числом городов и тайлов
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    METRICS.observe('solar_request_seconds', time.perf_counter() - started,
+                    (('endpoint', endpoint), ('status', response.status_code)))
+    # У потоковых ответов размер заранее неизвестен
+    if response.content_length is not None:
+        METRICS.observe('solar_response_bytes', response.content_length, (('endpoint', endpoint),), SIZE_BUCKETS)
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        response.headers['X-Solar-Profile-File'] = save_profile(profiler.stop(), endpoint)
+    return response
+
+
+@app.route('/api/profiles/<name>')
+def get_profile(name):
+    """Сохраненный профиль запроса в формате свернутых стеков (flamegraph.pl, speedscope)"""
+    if not is_admin_token(request.headers.get(PROFILE_HEADER)):
+        return jsonify({'success': False, 'error': 'Нужен токен администратора'}), 403
+    if not name.endswith('.folded'):
+        return jsonify({'success': False, 'error': 'Профиль не найден'}), 404
+    return send_from_directory(PROFILE_DIR, name, mimetype='text/plain')
 
 
 if __name__ == '__main__':
+    warm_up_caches()
     app.run(debug=True, host='127.0.0.1', port=5000)
\ No newline at end of file
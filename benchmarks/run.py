@@ -0,0 +1,324 @@
+"""Бенчмарки карты, API и расчета потенциала.
+
+Запуск из корня репозитория:
+
+    python benchmarks/run.py                       # полный набор, сравнение с baseline.json
+    python benchmarks/run.py --quick               # малые наборы данных и меньше повторов
+    python benchmarks/run.py --save-baseline       # записать результаты как новую базу
+    python benchmarks/run.py --output results.json --tolerance 0.5
+    python benchmarks/run.py --import-only         # только бюджет холодного импорта
+
+Работает без сети: станции генерируются с фиксированным зерном, кэши
+тайлов, задач и шаблонов пишутся во временный каталог. Результаты
+сравниваются с базой по медианам; замедление больше tolerance и больше
+--min-delta-ms - регрессия и код выхода 1. Холодный импорт app
+проверяется по абсолютному бюджету: он не должен превышать
+--import-budget-ms и тянуть стек карты (folium, branca, requests). База зависит от машины, обновлять ее нужно на той же
+машине, где идут сравнения.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+MAP_SIZES = (20, 1000, 10000, 100000)
+QUICK_MAP_SIZES = (20, 1000)
+CALC_SIZES = (1000, 100000)
+API_SIZES = (1000, 10000)
+# Бюджет холодного импорта app, миллисекунды; стек карты грузится только при рендере
+IMPORT_BUDGET_MS = 500
+MAP_STACK_MODULES = ('folium', 'branca', 'requests')
+COLORS = ('#FF6B6B', '#4ECDC4', '#FFEAA7', '#DDA0DD', '#96CEB4', '#FFD700', '#1E90FF', '#FF8C00')
+
+# Маршруты для замера через тестовый клиент на встроенных данных
+E2E_ROUTES = (
+    '/',
+    '/?city=Москва',
+    '/map',
+    '/map?city=Москва',
+    '/map?lat=50&lon=50',
+    '/api/solar-data',
+    '/api/solar-data?panel_area=12&losses=0.1',
+    '/api/solar-data/Москва',
+    '/api/popup/0',
+    '/api/clusters?z=4&x0=8&y0=3&x1=15&y1=7',
+    '/api/zones?z=4&x0=8&y0=3&x1=12&y1=6',
+    '/tiles/heat/4/10/5.png',
+    '/api/autocomplete?q=Мо',
+    '/api/nearest?lat=55&lon=37',
+    '/api/solar-point?lat=50&lon=50',
+    '/api/pv-yield?city=Москва',
+    '/api/optimal-orientation?city=Москва',
+    '/api/export?format=ndjson',
+)
+# Маршруты, время которых зависит от числа станций
+API_SCALE_ROUTES = (
+    '/api/solar-data',
+    '/api/solar-data?panel_area=12',
+    '/api/clusters?z=4&x0=8&y0=3&x1=15&y1=7',
+    '/api/autocomplete?q=Станция%2012',
+    '/api/nearest?lat=55&lon=37&k=10',
+)
+
+
+def synthetic_locations(count, seed=0):
+    """Станции со случайными координатами в пределах России и инсоляцией 1.5-4"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    lat = np.round(rng.uniform(42.0, 70.0, count), 4).tolist()
+    lon = np.round(rng.uniform(20.0, 180.0, count), 4).tolist()
+    insolation = np.round(rng.uniform(1.5, 4.0, count), 1).tolist()
+    return {
+        f'Станция {i}': {'coords': [lat[i], lon[i]], 'insolation': insolation[i], 'color': COLORS[i % len(COLORS)]}
+        for i in range(count)
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    """Медиана, минимум и максимум времени вызова fn, миллисекунды"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': round(statistics.median(times), 3),
+        'min_ms': round(min(times), 3),
+        'max_ms': round(max(times), 3),
+        'runs': repeat,
+    }
+
+
+def current_rss_mb():
+    """Текущий RSS процесса; на системах без /proc - пиковый"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, 1)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В macOS ru_maxrss в байтах, в Linux - в килобайтах
+    return round(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def use_dataset(app, locations):
+    """Подменяет источник данных приложения; все кэши пересобираются по новой версии"""
+    from data_store import DataStore, StaticSource
+
+    app.DATA_STORE = DataStore(StaticSource(locations, app.DEFAULT_ZONES))
+
+
+def bench_import(results, runs=5):
+    """Холодный импорт app в отдельном процессе и загруженные модули стека карты"""
+    code = (
+        'import sys, time; t = time.perf_counter(); import app; print(time.perf_counter() - t); '
+        f'print(",".join(name for name in {MAP_STACK_MODULES!r} if name in sys.modules))'
+    )
+    seconds = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+        elapsed, loaded = output.stdout.split('\n')[-3:-1]
+        seconds.append(float(elapsed) * 1000)
+    results['startup.import_app'] = {
+        'median_ms': round(statistics.median(seconds), 3),
+        'min_ms': round(min(seconds), 3),
+        'runs': len(seconds),
+        'map_stack': loaded,
+    }
+
+
+def check_import_budget(results, budget_ms):
+    """Нарушения бюджета холодного старта"""
+    timing = results['startup.import_app']
+    problems = []
+    if timing['median_ms'] > budget_ms:
+        problems.append(f'импорт app {timing["median_ms"]} мс, бюджет {budget_ms} мс')
+    if timing['map_stack']:
+        problems.append(f'импорт app загружает стек карты: {timing["map_stack"]}')
+    return problems
+
+
+def bench_map(app, results, sizes, repeat):
+    """Построение карты folium и ее сериализация на синтетических наборах станций"""
+    from data_store import DataSnapshot
+
+    for size in sizes:
+        locations = synthetic_locations(size)
+        results[f'data.snapshot.n={size}'] = measure(
+            lambda: DataSnapshot(locations, app.DEFAULT_ZONES), max(1, repeat // 4), warmup=0)
+        use_dataset(app, locations)
+        city = next(iter(locations))
+        with app.app.test_request_context():
+            results[f'map.build.n={size}'] = measure(lambda: app.create_solar_map(None), repeat)
+            results[f'map.build_city.n={size}'] = measure(lambda: app.create_solar_map(city), repeat)
+            root = app.create_solar_map(city).get_root()
+            app.stabilize_element_ids(root)
+            results[f'map.serialize.n={size}'] = measure(root.render, repeat)
+
+
+def bench_calc(results, sizes, repeat):
+    """Пропускная способность расчета потенциала: поэлементно и векторно"""
+    import numpy as np
+
+    from solar_calc import calculate_solar_potential, calculate_solar_potential_batch
+
+    for size in sizes:
+        insolation = np.random.default_rng(1).uniform(1.5, 4.0, size)
+        records = [{'insolation': value} for value in insolation.tolist()]
+        scalar_repeat = max(1, repeat // 4) if size > 10000 else repeat
+        scalar = measure(lambda: [calculate_solar_potential(record) for record in records], scalar_repeat)
+        batch = measure(lambda: calculate_solar_potential_batch(insolation), repeat)
+        for name, timing in (('scalar', scalar), ('batch', batch)):
+            timing['rows_per_s'] = round(size / (timing['median_ms'] / 1000))
+            results[f'calc.{name}.n={size}'] = timing
+
+
+def request_timing(client, url, repeat):
+    """Холодный первый запрос и медиана повторных через тестовый клиент"""
+    start = time.perf_counter()
+    response = client.get(url)
+    size = len(response.get_data())
+    response.close()
+    cold_ms = (time.perf_counter() - start) * 1000
+
+    def fetch():
+        client.get(url).close()
+
+    timing = measure(fetch, repeat, warmup=0)
+    timing.update(cold_ms=round(cold_ms, 3), status=response.status_code, bytes=size)
+    return timing
+
+
+def bench_e2e(app, results, repeat):
+    """Задержка маршрутов через тестовый клиент Flask и память процесса"""
+    use_dataset(app, app.DEFAULT_INSOLATION)
+    client = app.app.test_client()
+    results['memory.before_e2e'] = {'rss_mb': current_rss_mb()}
+    for url in E2E_ROUTES:
+        results[f'e2e.{url}'] = request_timing(client, url, repeat)
+    results['memory.after_e2e'] = {'rss_mb': current_rss_mb()}
+
+
+def bench_api_scale(app, results, sizes, repeat):
+    """Маршруты API на синтетических наборах станций"""
+    client = app.app.test_client()
+    for size in sizes:
+        use_dataset(app, synthetic_locations(size))
+        for url in API_SCALE_ROUTES:
+            results[f'api.n={size}.{url}'] = request_timing(client, url, repeat)
+        results[f'memory.api.n={size}'] = {'rss_mb': current_rss_mb()}
+
+
+def compare(results, baseline, tolerance, min_delta_ms=1.0):
+    """Регрессии относительно базы: время медиан и пропускная способность"""
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if 'rows_per_s' in current and previous.get('rows_per_s'):
+            ratio = previous['rows_per_s'] / max(current['rows_per_s'], 1)
+        elif 'median_ms' in current and previous.get('median_ms'):
+            ratio = current['median_ms'] / max(previous['median_ms'], 1e-6)
+        else:
+            continue
+        # Доли миллисекунды на общей машине шумят сильнее, чем меняется код
+        if ratio > 1 + tolerance and current['median_ms'] - previous['median_ms'] >= min_delta_ms:
+            regressions.append((name, previous, current, ratio))
+    return regressions
+
+
+def machine_info():
+    from importlib.metadata import version
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': version('numpy'),
+        'flask': version('flask'),
+        'folium': version('folium'),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки карты инсоляции')
+    parser.add_argument('--quick', action='store_true', help='малые наборы данных и меньше повторов')
+    parser.add_argument('--repeat', type=int, help='число повторов каждого замера')
+    parser.add_argument('--output', help='файл для результатов JSON')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='файл базы для сравнения')
+    parser.add_argument('--save-baseline', action='store_true', help='записать результаты в файл базы')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='допустимое замедление, доля (0.3 = 30%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='меньшее замедление медианы не считается')
+    parser.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS, help='бюджет холодного импорта app')
+    parser.add_argument('--import-only', action='store_true', help='проверить только бюджет импорта')
+    args = parser.parse_args()
+    repeat = args.repeat or (5 if args.quick else 20)
+
+    # Кэши приложения - во временном каталоге, чтобы прогоны не влияли друг на друга
+    scratch = tempfile.mkdtemp(prefix='solar-bench-')
+    for name in ('SOLAR_TILE_CACHE_DIR', 'SOLAR_JOBS_DIR', 'SOLAR_PROFILE_DIR'):
+        os.environ[name] = os.path.join(scratch, name.lower())
+    os.environ.pop('SOLAR_DATA_SOURCE', None)
+    sys.path.insert(0, ROOT)
+
+    results = {}
+    bench_import(results)
+    budget_problems = check_import_budget(results, args.import_budget_ms)
+    for problem in budget_problems:
+        print(f'БЮДЖЕТ {problem}')
+    if args.import_only:
+        print(f'Холодный импорт app: {results["startup.import_app"]["median_ms"]} мс')
+        return 1 if budget_problems else 0
+    import app
+
+    results['memory.after_import'] = {'rss_mb': current_rss_mb()}
+    bench_calc(results, CALC_SIZES, repeat)
+    bench_e2e(app, results, repeat)
+    bench_api_scale(app, results, API_SIZES[:1] if args.quick else API_SIZES, repeat)
+    bench_map(app, results, QUICK_MAP_SIZES if args.quick else MAP_SIZES, repeat)
+    results['memory.peak'] = {'rss_mb': peak_rss_mb()}
+
+    report = {'machine': machine_info(), 'quick': args.quick, 'repeat': repeat, 'results': results}
+    for name, values in results.items():
+        print(f'{name:60} ' + '  '.join(f'{key}={value}' for key, value in values.items()))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f'База сохранена: {args.baseline}')
+        return 1 if budget_problems else 0
+
+    if not os.path.exists(args.baseline):
+        print('Файла базы нет, сравнение пропущено')
+        return 1 if budget_problems else 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    for name, previous, current, ratio in regressions:
+        print(f'РЕГРЕССИЯ {name}: {previous.get("median_ms")} -> {current.get("median_ms")} мс (x{ratio:.2f})')
+    print(f'Регрессий: {len(regressions)}')
+    return 1 if regressions or budget_problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+from bisect import bisect_left
+import re
+
+import numpy as np
+
+# Транслитерация в латиницу: запросы на обоих алфавитах сводятся к одному ключу
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'shch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+# Разные латинские написания одного звука (Khabarovsk/Habarovsk, Yekaterinburg/Ekaterinburg)
+SPELLING_VARIANTS = [
+    ('shch', 'sch'), ('kh', 'h'), ('tz', 'c'), ('ts', 'c'), ('j', 'y'),
+    ('yo', 'e'), ('ye', 'e'), ('iy', 'y'), ('yy', 'y'), ('x', 'ks'), ('w', 'v'),
+]
+TRANSLIT_TABLE = str.maketrans(TRANSLIT)
+NON_WORD = re.compile(r'[^0-9a-z]+')
+
+# Префиксы короче этой длины совпадают со слишком многими названиями,
+# поэтому лучшие результаты для них считаются заранее
+SHORT_PREFIX_LENGTH = 2
+FUZZY_THRESHOLD = 0.3
+
+
+def normalize(text):
+    """Сводит название к ключу поиска: регистр, ё/е, транслитерация, написание"""
+    key = text.lower().replace('ё', 'е').translate(TRANSLIT_TABLE)
+    key = NON_WORD.sub(' ', key).strip()
+    for variant, canonical in SPELLING_VARIANTS:
+        key = key.replace(variant, canonical)
+    return key
+
+
+def trigrams(key, pad_end=True):
+    padded = f'  {key} ' if pad_end else f'  {key}'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CitySearchIndex:
+    """Индекс названий для автодополнения.
+
+    Префиксный поиск идет по отсортированному массиву ключей (полное
+    название и каждое слово в нем) двумя бинарными поисками; это тот же
+    префиксный обход, что и у trie, но без сотен тысяч узлов в памяти.
+    Опечатки ловит триграммный индекс с мерой Жаккара.
+    """
+
+    def __init__(self, names, weights=None):
+        self.names = list(names)
+        count = len(self.names)
+        # Чем меньше rank, тем выше название в выдаче; по умолчанию порядок входа
+        order = np.argsort(-np.asarray(weights, dtype=np.float64), kind='stable') if weights is not None \
+            else np.arange(count)
+        rank = np.empty(count, dtype=np.int64)
+        rank[order] = np.arange(count)
+
+        self._full_keys = [normalize(name) for name in self.names]
+        entries = []
+        for i, key in enumerate(self._full_keys):
+            entries.append((key, 0, i))
+            words = key.split(' ')
+            for position in range(1, len(words)):
+                entries.append((' '.join(words[position:]), 1, i))
+        entries.sort()
+        self._keys = [key for key, _, _ in entries]
+        self._ids = np.array([i for _, _, i in entries], dtype=np.int64)
+        # Совпадение с началом полного названия важнее совпадения со словом
+        self._scores = np.array([kind * count + rank[i] for _, kind, i in entries], dtype=np.int64)
+
+        postings = {}
+        self._trigram_counts = np.zeros(count, dtype=np.int64)
+        for i, key in enumerate(self._full_keys):
+            grams = trigrams(key)
+            self._trigram_counts[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+        self._exact = {}
+        for i in np.argsort(rank, kind='stable'):
+            self._exact.setdefault(self._full_keys[i], int(i))
+
+        self._short_prefix_top = {}
+        self._short_prefix_limit = 20
+        for key in {key[:length] for key in self._keys for length in range(1, SHORT_PREFIX_LENGTH + 1)}:
+            self._short_prefix_top[key] = self._prefix_scan(key, self._short_prefix_limit)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prefix_scan(self, key, limit):
+        lo = bisect_left(self._keys, key)
+        hi = bisect_left(self._keys, key + '\uffff')
+        if hi <= lo:
+            return []
+        scores = self._scores[lo:hi]
+        ids = self._ids[lo:hi]
+        # Одно название может совпасть несколькими словами, берем с запасом
+        take = min(len(scores), limit * 3)
+        best = np.argpartition(scores, take - 1)[:take] if take < len(scores) else np.arange(len(scores))
+        best = best[np.argsort(scores[best], kind='stable')]
+        return list(dict.fromkeys(ids[best].tolist()))[:limit]
+
+    def prefix(self, query, limit=10):
+        """Названия, у которых запрос совпадает с началом названия или слова"""
+        key = normalize(query)
+        if not key:
+            return []
+        if len(key) <= SHORT_PREFIX_LENGTH and limit <= self._short_prefix_limit:
+            found = self._short_prefix_top.get(key, [])[:limit]
+        else:
+            found = self._prefix_scan(key, limit)
+        exact = self._exact.get(key)
+        if exact is not None:
+            found = [exact] + [i for i in found if i != exact][:limit - 1]
+        return found
+
+    def fuzzy(self, query, limit=10, threshold=FUZZY_THRESHOLD):
+        """Названия, похожие на запрос по триграммам (с опечатками)"""
+        key = normalize(query)
+        if not key:
+            return []
+        grams = trigrams(key, pad_end=False)
+        lists = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not lists:
+            return []
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.names))
+        candidates = np.flatnonzero(shared)
+        similarity = shared[candidates] / (len(grams) + self._trigram_counts[candidates] - shared[candidates])
+        keep = similarity >= threshold
+        candidates, similarity = candidates[keep], similarity[keep]
+        if len(candidates) > limit:
+            top = np.argpartition(-similarity, limit - 1)[:limit]
+            candidates, similarity = candidates[top], similarity[top]
+        return candidates[np.argsort(-similarity, kind='stable')].tolist()
+
+    def complete(self, query, limit=10):
+        """Автодополнение: сначала совпадения по префиксу, затем нечеткие"""
+        results = [(i, 'prefix') for i in self.prefix(query, limit)]
+        if len(results) < limit:
+            seen = {i for i, _ in results}
+            results.extend((i, 'fuzzy') for i in self.fuzzy(query, limit) if i not in seen)
+        return [(self.names[i], match) for i, match in results[:limit]]
+
+    def resolve(self, query):
+        """Точное название по запросу без учета регистра, ё/е и алфавита"""
+        i = self._exact.get(normalize(query))
+        return self.names[i] if i is not None else None
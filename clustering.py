@@ -0,0 +1,138 @@
+import numpy as np
+
+from data_store import location_columns
+from tile_math import MAX_MERCATOR_LAT, TILE_SIZE
+
+# Уровни зума с кластерами; глубже точки отдаются по отдельности
+CLUSTER_MIN_ZOOM = 3
+CLUSTER_MAX_ZOOM = 12
+# Размер ячейки кластеризации в пикселях экрана
+CLUSTER_CELL_PIXELS = 64
+
+
+def mercator_pixels(lat, lon, zoom):
+    """Координаты точек в пикселях мира Web Mercator на уровне зума"""
+    size = TILE_SIZE * 2 ** zoom
+    rad = np.radians(np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    x = (np.asarray(lon) + 180.0) / 360.0 * size
+    y = (1 - np.log(np.tan(rad) + 1 / np.cos(rad)) / np.pi) / 2 * size
+    return x, y
+
+
+class ClusterLevel:
+    """Кластеры одного уровня зума, отсортированные по долготе для выборки по bbox"""
+
+    def __init__(self, lat, lon, count, value, bounds, point):
+        order = np.argsort(lon, kind='stable')
+        self.lat = lat[order]
+        self.lon = lon[order]
+        self.count = count[order]
+        self.value = value[order]
+        self.bounds = bounds[order]
+        # Номер исходной точки для одиночных кластеров, иначе -1
+        self.point = point[order]
+
+    def __len__(self):
+        return len(self.lat)
+
+    def bbox(self, south, west, north, east):
+        """Номера кластеров внутри прямоугольника; west > east означает переход через 180°"""
+        ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        chunks = []
+        for first, last in ranges:
+            lo = np.searchsorted(self.lon, first, side='left')
+            hi = np.searchsorted(self.lon, last, side='right')
+            chunks.append(np.arange(lo, hi))
+        candidates = np.concatenate(chunks)
+        lat = self.lat[candidates]
+        return candidates[(lat >= south) & (lat <= north)]
+
+
+class ClusterIndex:
+    """Кластеры точек, заранее посчитанные для каждого уровня зума.
+
+    Точки группируются по ячейкам сетки фиксированного размера в пикселях.
+    Ячейки соседних уровней вложены друг в друга (ячейка зума z - это
+    ровно четыре ячейки зума z+1), поэтому при приближении кластер
+    распадается только на свои же точки.
+    """
+
+    def __init__(self, lat, lon, values, min_zoom=CLUSTER_MIN_ZOOM, max_zoom=CLUSTER_MAX_ZOOM,
+                 cell_pixels=CLUSTER_CELL_PIXELS):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = (np.asarray(lon, dtype=np.float64) + 180.0) % 360.0 - 180.0
+        self.values = np.asarray(values, dtype=np.float64)
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.cell_pixels = cell_pixels
+        self.levels = {zoom: self._cluster(zoom) for zoom in range(min_zoom, max_zoom + 1)}
+        indices = np.arange(len(self.lat))
+        self._points = ClusterLevel(
+            self.lat, self.lon, np.ones(len(indices), dtype=np.int64), self.values,
+            np.column_stack([self.lat, self.lon, self.lat, self.lon]), indices,
+        )
+
+    @classmethod
+    def from_locations(cls, locations, **kwargs):
+        """Строит кластеры по словарю вида {имя: {'coords': [lat, lon], 'insolation': ...}}"""
+        _, lat, lon, values = location_columns(locations)
+        return cls(lat, lon, values, **kwargs)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _cluster(self, zoom):
+        if not len(self.lat):
+            empty = np.empty(0)
+            return ClusterLevel(empty, empty, empty.astype(np.int64), empty, np.empty((0, 4)), empty.astype(np.int64))
+        x, y = mercator_pixels(self.lat, self.lon, zoom)
+        columns = -(-TILE_SIZE * 2 ** zoom // self.cell_pixels)
+        cells = (y // self.cell_pixels).astype(np.int64) * columns + (x // self.cell_pixels).astype(np.int64)
+        _, inverse, counts = np.unique(cells, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+
+        # Точки одной ячейки идут подряд, агрегаты считаются через reduceat
+        order = np.argsort(inverse, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        lat, lon = self.lat[order], self.lon[order]
+        bounds = np.column_stack([
+            np.minimum.reduceat(lat, starts), np.minimum.reduceat(lon, starts),
+            np.maximum.reduceat(lat, starts), np.maximum.reduceat(lon, starts),
+        ])
+        return ClusterLevel(
+            np.bincount(inverse, weights=self.lat) / counts,
+            np.bincount(inverse, weights=self.lon) / counts,
+            counts,
+            np.bincount(inverse, weights=self.values) / counts,
+            bounds,
+            np.where(counts == 1, order[starts], -1),
+        )
+
+    def level_for(self, zoom):
+        if zoom > self.max_zoom:
+            return self._points
+        return self.levels[max(zoom, self.min_zoom)]
+
+    def query(self, zoom, south, west, north, east):
+        """Кластеры и одиночные точки в прямоугольнике для зума.
+
+        Возвращает список кластеров (словари для API) и номера одиночных точек.
+        """
+        if east - west >= 360.0:
+            west, east = -180.0, 180.0
+        else:
+            west = (west + 180.0) % 360.0 - 180.0
+            east = (east + 180.0) % 360.0 - 180.0 if east != 180.0 else east
+        level = self.level_for(zoom)
+        found = level.bbox(south, west, north, east)
+        single = level.point[found] >= 0
+        clusters = [
+            {
+                'coords': [round(float(level.lat[i]), 4), round(float(level.lon[i]), 4)],
+                'count': int(level.count[i]),
+                'insolation': round(float(level.value[i]), 2),
+                'bounds': np.round(level.bounds[i], 4).tolist(),
+            }
+            for i in found[~single].tolist()
+        ]
+        return clusters, level.point[found[single]].tolist()
@@ -0,0 +1,442 @@
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+
+# Порядковые номера снимков общие для всех хранилищ процесса и только растут
+SNAPSHOT_GENERATIONS = itertools.count(1)
+RECORD_KEYS = ('coords', 'insolation', 'color')
+
+
+class LocationRecord:
+    """Станция из таблицы; читается и как словарь {'coords', 'insolation', 'color'}"""
+
+    __slots__ = ('name', 'lat', 'lon', 'insolation', 'color')
+
+    def __init__(self, name, lat, lon, insolation, color):
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.insolation = insolation
+        self.color = color
+
+    @property
+    def coords(self):
+        return [self.lat, self.lon]
+
+    def __getitem__(self, key):
+        if key not in RECORD_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in RECORD_KEYS else default
+
+    def keys(self):
+        return RECORD_KEYS
+
+    def to_dict(self):
+        return {'coords': self.coords, 'insolation': self.insolation, 'color': self.color}
+
+
+class LocationTable:
+    """Колоночная таблица станций.
+
+    Координаты и инсоляция лежат в массивах float64 (точные исходные
+    значения, без округления float32), цвет - номер в палитре уникальных
+    строк, названия интернированы. Доступ по имени как у словаря создает
+    запись на лету; векторный код берет массивы напрямую через columns().
+    """
+
+    def __init__(self, names, lat, lon, insolation, colors):
+        self.names = tuple(sys.intern(str(name)) for name in names)
+        self.index = {name: row for row, name in enumerate(self.names)}
+        if len(self.index) != len(self.names):
+            raise ValueError('Названия станций повторяются')
+        self.lat = np.array(lat, dtype=np.float64)
+        self.lon = np.array(lon, dtype=np.float64)
+        self.insolation = np.array(insolation, dtype=np.float64)
+        if not len(self.lat) == len(self.lon) == len(self.insolation) == len(self.names):
+            raise ValueError('Столбцы таблицы станций разной длины')
+        palette = {}
+        self.color_codes = np.array(
+            [palette.setdefault(sys.intern(str(color)), len(palette)) for color in colors],
+            dtype=np.uint16 if len(palette) < 2 ** 16 else np.uint32,
+        ).reshape(-1)
+        self.palette = tuple(palette)
+        for array in (self.lat, self.lon, self.insolation, self.color_codes):
+            array.flags.writeable = False
+
+    @classmethod
+    def from_mapping(cls, locations):
+        """Таблица из словаря вида {имя: {'coords': [lat, lon], 'insolation', 'color'}}"""
+        if isinstance(locations, cls):
+            return locations
+        names = list(locations)
+        coords = [locations[name]['coords'] for name in names]
+        if any(len(pair) != 2 for pair in coords):
+            raise ValueError('Координаты станции - это пара [lat, lon]')
+        return cls(
+            names,
+            [float(lat) for lat, _ in coords],
+            [float(lon) for _, lon in coords],
+            [float(locations[name]['insolation']) for name in names],
+            [locations[name]['color'] for name in names],
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        return self.record(self.index[name])
+
+    def get(self, name, default=None):
+        row = self.index.get(name)
+        return default if row is None else self.record(row)
+
+    def keys(self):
+        return self.index.keys()
+
+    def values(self):
+        return (self.record(row) for row in range(len(self.names)))
+
+    def items(self):
+        return ((name, self.record(row)) for row, name in enumerate(self.names))
+
+    def record(self, row):
+        return LocationRecord(
+            self.names[row],
+            float(self.lat[row]),
+            float(self.lon[row]),
+            float(self.insolation[row]),
+            self.palette[self.color_codes[row]],
+        )
+
+    def rows(self, names):
+        """Номера строк для списка названий"""
+        return np.fromiter((self.index[name] for name in names), dtype=np.int64, count=len(names))
+
+    def columns(self, names=None):
+        """Названия и массивы lat, lon, insolation; без names - представления без копирования"""
+        if names is None:
+            return self.names, self.lat, self.lon, self.insolation
+        rows = self.rows(names)
+        return list(names), self.lat[rows], self.lon[rows], self.insolation[rows]
+
+    def to_dict(self):
+        return {name: record.to_dict() for name, record in self.items()}
+
+    def digest(self):
+        """Хэш содержимого таблицы по байтам массивов"""
+        digest = hashlib.sha256()
+        digest.update('\0'.join(self.names).encode('utf-8'))
+        digest.update('\0'.join(self.palette).encode('utf-8'))
+        for array in (self.lat, self.lon, self.insolation, self.color_codes.astype(np.uint32)):
+            digest.update(array.tobytes())
+        return digest
+
+
+def location_columns(locations, names=None):
+    """Названия и массивы lat, lon, insolation для таблицы станций или обычного словаря"""
+    columns = getattr(locations, 'columns', None)
+    if columns is not None:
+        return columns(names)
+    names = list(locations) if names is None else list(names)
+    coords = np.array([locations[name]['coords'] for name in names], dtype=np.float64).reshape(-1, 2)
+    insolation = np.array([locations[name]['insolation'] for name in names], dtype=np.float64)
+    return names, coords[:, 0], coords[:, 1], insolation
+
+
+def normalize_zones(zones):
+    """Проверяет зоны и приводит значения к числам"""
+    return [
+        {'name': str(zone['name']), 'color': str(zone['color']), 'min': float(zone['min']), 'max': float(zone['max'])}
+        for zone in zones
+    ]
+
+
+class DataVersion(str):
+    """Версия данных: хэш содержимого и номер снимка, в котором она получена.
+
+    Как строка версия попадает в URL, ETag и ключи кэшей; по номеру кэши
+    отличают новую версию от прежней, на которой еще дорабатывают запросы.
+    """
+
+    def __new__(cls, digest, generation):
+        version = super().__new__(cls, digest)
+        version.generation = generation
+        return version
+
+    def __getnewargs__(self):
+        return str(self), self.generation
+
+
+class DataSnapshot:
+    """Неизменяемый снимок данных: таблица станций, зоны и версия"""
+
+    def __init__(self, locations, zones):
+        self.locations = LocationTable.from_mapping(locations)
+        self.zones = normalize_zones(zones)
+        digest = self.locations.digest()
+        digest.update(json.dumps(self.zones, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        self.version = DataVersion(digest.hexdigest()[:16], next(SNAPSHOT_GENERATIONS))
+
+
+class StaticSource:
+    """Данные, заданные в коде; не меняются"""
+
+    def __init__(self, locations, zones):
+        self.locations = locations
+        self.zones = zones
+
+    def fingerprint(self):
+        return None
+
+    def load(self):
+        return self.locations, self.zones
+
+
+class JsonFileSource:
+    """JSON-файл вида {"locations": {имя: {...}}, "zones": [...]}"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def fingerprint(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data['locations'], data['zones']
+
+    def save(self, locations, zones):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'locations': LocationTable.from_mapping(locations).to_dict(), 'zones': zones}, f, ensure_ascii=False, indent=1)
+        # Замена файла целиком: читатель не увидит половину записи
+        os.replace(tmp_path, self.path)
+
+
+class SqliteSource:
+    """База SQLite с таблицами locations и zones"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS locations (
+            name TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL,
+            insolation REAL NOT NULL, color TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS zones (
+            position INTEGER PRIMARY KEY, name TEXT NOT NULL, color TEXT NOT NULL,
+            min REAL NOT NULL, max REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def fingerprint(self):
+        # Изменения в режиме WAL сначала попадают в файл -wal
+        parts = []
+        for path in (self.path, self.path + '-wal'):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            parts.append((stat.st_mtime_ns, stat.st_size))
+        if not parts:
+            raise FileNotFoundError(self.path)
+        return tuple(parts)
+
+    def load(self):
+        with sqlite3.connect(f'file:{self.path}?mode=ro', uri=True) as connection:
+            rows = connection.execute(
+                'SELECT name, lat, lon, insolation, color FROM locations ORDER BY rowid').fetchall()
+            # Столбцы собираются сразу в массивы, минуя словари записей
+            locations = LocationTable(*(zip(*rows) if rows else ([],) * 5))
+            zones = [
+                {'name': name, 'color': color, 'min': low, 'max': high}
+                for name, color, low, high in connection.execute(
+                    'SELECT name, color, min, max FROM zones ORDER BY position')
+            ]
+        return locations, zones
+
+    def save(self, locations, zones):
+        with sqlite3.connect(self.path) as connection:
+            connection.executescript(self.SCHEMA)
+            # Одна транзакция: читатели видят либо старые, либо новые данные
+            connection.execute('DELETE FROM locations')
+            connection.execute('DELETE FROM zones')
+            connection.executemany(
+                'INSERT INTO locations (name, lat, lon, insolation, color) VALUES (?, ?, ?, ?, ?)',
+                [(name, record.lat, record.lon, record.insolation, record.color)
+                 for name, record in LocationTable.from_mapping(locations).items()],
+            )
+            connection.executemany(
+                'INSERT INTO zones (position, name, color, min, max) VALUES (?, ?, ?, ?, ?)',
+                [(i, zone['name'], zone['color'], zone['min'], zone['max']) for i, zone in enumerate(zones)],
+            )
+
+
+def open_source(path):
+    """Источник данных по расширению файла"""
+    if path.lower().endswith('.json'):
+        return JsonFileSource(path)
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteSource(path)
+    raise ValueError(f'Неизвестный формат источника данных: {path}')
+
+
+class DataStore:
+    """Текущий снимок данных с горячей перезагрузкой.
+
+    Не чаще раза в check_interval секунд запрос сверяет отпечаток
+    источника (время изменения и размер файла). Если он изменился, новый
+    снимок собирается целиком и подменяет старый одной операцией
+    присваивания; запросы, уже получившие старый снимок, дорабатывают с
+    ним. Ошибка чтения оставляет прежние данные, а если их еще нет -
+    передается вызывающему.
+    """
+
+    def __init__(self, source, check_interval=2.0):
+        self.source = source
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._fingerprint = None
+        self._failed_fingerprint = None
+        # Источник читается при первом обращении, а не при импорте приложения
+        self._snapshot = None
+        self.reloads = 0
+        self.failures = 0
+
+    def current(self):
+        """Текущий снимок; при необходимости проверяет источник на изменения"""
+        if self._snapshot is None:
+            return self._load_first()
+        now = time.monotonic()
+        # Проверяет один поток, остальные не ждут и берут прежний снимок
+        if now - self._checked >= self.check_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked = now
+                self._reload_if_changed()
+            finally:
+                self._lock.release()
+        return self._snapshot
+
+    def reload(self):
+        """Перечитывает источник без проверки отпечатка"""
+        if self._snapshot is None:
+            return self._load_first()
+        with self._lock:
+            self._reload_if_changed(force=True)
+            return self._snapshot
+
+    def _load_first(self):
+        with self._lock:
+            if self._snapshot is None:
+                # Прежних данных нет, поэтому ошибка чтения уходит вызывающему
+                self._fingerprint = self.source.fingerprint()
+                self._snapshot = DataSnapshot(*self.source.load())
+                self._checked = time.monotonic()
+            return self._snapshot
+
+    def _reload_if_changed(self, force=False):
+        try:
+            fingerprint = self.source.fingerprint()
+        except OSError as error:
+            self.failures += 1
+            logger.warning('Источник данных инсоляции недоступен: %s', error)
+            return
+        if not force and fingerprint in (self._fingerprint, self._failed_fingerprint):
+            return
+        try:
+            snapshot = DataSnapshot(*self.source.load())
+        except (OSError, ValueError, KeyError, TypeError, sqlite3.Error) as error:
+            # Недописанный файл будет прочитан снова, как только его отпечаток изменится
+            self._failed_fingerprint = fingerprint
+            self.failures += 1
+            logger.warning('Не удалось перечитать данные инсоляции: %s', error)
+            return
+        self._fingerprint = fingerprint
+        self._failed_fingerprint = None
+        self._snapshot = snapshot
+        self.reloads += 1
+
+    def stats(self):
+        snapshot = self.current()
+        return {
+            'version': snapshot.version,
+            'locations': len(snapshot.locations),
+            'zones': len(snapshot.zones),
+            'reloads': self.reloads,
+            'failures': self.failures,
+        }
+
+
+class SnapshotView:
+    """Поле текущего снимка, которое читается как обычный словарь или список"""
+
+    def __init__(self, get_snapshot, field):
+        self._get_snapshot = get_snapshot
+        self._field = field
+
+    def _target(self):
+        return getattr(self._get_snapshot(), self._field)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def __contains__(self, key):
+        return key in self._target()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self._target()!r})'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Выгрузка встроенных данных инсоляции в файл JSON или SQLite')
+    parser.add_argument('output', help='файл .json, .sqlite или .db')
+    args = parser.parse_args()
+
+    from app import DEFAULT_INSOLATION, DEFAULT_ZONES
+
+    locations = LocationTable.from_mapping(DEFAULT_INSOLATION)
+    zones = normalize_zones(DEFAULT_ZONES)
+    open_source(args.output).save(locations, zones)
+    print(f'{args.output}: {len(locations)} станций, {len(zones)} зон')
+
+
+if __name__ == '__main__':
+    main()
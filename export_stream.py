@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+import zlib
+
+import numpy as np
+
+from data_store import location_columns
+from solar_calc import calculate_solar_potential_batch
+
+# Строк в одном векторном проходе и в одной порции ответа
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_COLUMNS = ['city', 'lat', 'lon', 'insolation', 'panel_area', 'efficiency',
+                  'daily', 'monthly', 'yearly', 'savings', 'co2_reduction']
+POTENTIAL_COLUMNS = EXPORT_COLUMNS[6:]
+
+
+def iter_potential_chunks(locations, names, panel_areas, efficiencies, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Блоки строк экспорта: все города для каждого набора параметров (площадь x КПД).
+
+    Наборы параметров перебираются порциями, поэтому в памяти одновременно
+    только один блок, сколько бы строк ни было всего.
+    """
+    names, lat, lon, insolation = location_columns(locations, names)
+    sets_per_chunk = max(1, chunk_rows // max(len(names), 1))
+    total_sets = len(panel_areas) * len(efficiencies)
+
+    for first in range(0, total_sets, sets_per_chunk):
+        sets = np.arange(first, min(first + sets_per_chunk, total_sets))
+        # Номер набора раскладывается на площадь и КПД без построения всего произведения
+        area = np.asarray(panel_areas, dtype=np.float64)[sets // len(efficiencies)]
+        efficiency = np.asarray(efficiencies, dtype=np.float64)[sets % len(efficiencies)]
+        potential = calculate_solar_potential_batch(insolation[None, :], area[:, None], efficiency[:, None])
+        columns = [
+            np.tile(np.arange(len(names)), len(sets)),
+            np.tile(lat, len(sets)),
+            np.tile(lon, len(sets)),
+            np.tile(insolation, len(sets)),
+            np.repeat(area, len(names)),
+            np.repeat(efficiency, len(names)),
+            *(potential[name].ravel() for name in POTENTIAL_COLUMNS),
+        ]
+        yield [[names[row[0]], *row[1:]] for row in zip(*(column.tolist() for column in columns))]
+
+
+def encode_ndjson(chunks):
+    # Ключи постоянны, поэтому строка собирается по шаблону; str(float) совпадает с JSON
+    template = '{' + ', '.join(f'"{column}": %s' for column in EXPORT_COLUMNS) + '}\n'
+    quoted = {}
+    for rows in chunks:
+        parts = []
+        for row in rows:
+            name = quoted.get(row[0])
+            if name is None:
+                name = quoted[row[0]] = json.dumps(row[0], ensure_ascii=False)
+            parts.append(template % (name, *row[1:]))
+        yield ''.join(parts).encode('utf-8')
+
+
+def encode_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def gzip_stream(parts):
+    """Сжимает поток порций на лету; каждая порция дожимается до границы для клиента"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for part in parts:
+        data = compressor.compress(part) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
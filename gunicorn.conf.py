@@ -0,0 +1,41 @@
+"""Настройки gunicorn для карты инсоляции: gunicorn -c gunicorn.conf.py wsgi:app"""
+import os
+
+
+def available_cores():
+    """Число ядер, доступных процессу (с учетом ограничений контейнера по affinity)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = os.environ.get('SOLAR_BIND', '127.0.0.1:8000')
+
+# Приложение и кэши прогреваются в мастере до fork (см. wsgi.py)
+preload_app = True
+
+# Расчеты упираются в процессор, поэтому процесс на ядро; потоки внутри
+# воркера закрывают ожидание сети и время, когда numpy и zlib отпускают GIL
+workers = int(os.environ.get('SOLAR_WORKERS', available_cores()))
+worker_class = 'gthread'
+threads = int(os.environ.get('SOLAR_THREADS', 4))
+
+# Пулы процессов подбора ориентации и задач портфеля создаются в каждом
+# воркере; без ограничения их было бы по ядру на воркер, то есть ядер в
+# квадрате. Каждому воркеру достается своя доля ядер (см. work_pool.py)
+os.environ.setdefault('SOLAR_POOL_WORKERS', str(max(1, available_cores() // workers)))
+
+# Моделирование выработки и подбор ориентации для многих городов идут секунды
+timeout = int(os.environ.get('SOLAR_WORKER_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Перезапуск воркеров ограничивает рост их собственных LRU-кэшей; новый
+# воркер снова форкается от прогретого мастера
+max_requests = int(os.environ.get('SOLAR_MAX_REQUESTS', 20000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('SOLAR_ACCESS_LOG')
+errorlog = '-'
+
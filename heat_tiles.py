@@ -0,0 +1,266 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # fcntl есть только в Unix; без него счетчик байт защищен лишь внутри процесса
+    fcntl = None
+
+from insolation_grid import annual_mean
+from render_cache import is_stale
+from tile_math import TILE_SIZE, tile_bounds
+
+# Палитра и масштаб прежнего клиентского слоя HeatMap
+HEAT_GRADIENT = {0.2: 'blue', 0.4: 'lime', 0.6: 'yellow', 0.8: 'orange', 1.0: 'red'}
+HEAT_MAX_VALUE = 4.0
+HEAT_MIN_OPACITY = 0.3
+# Глубже этого зума тайлы растягивает браузер
+HEAT_MAX_ZOOM = 12
+# Каталоги других версий удаляются, только если их не трогали дольше этого, секунды
+STALE_VERSION_AGE = 600
+# Файл с общим для процессов размером тайлов версии, байты
+USAGE_FILE = '.usage'
+
+COLOR_NAMES = {
+    'blue': (0, 0, 255),
+    'lime': (0, 255, 0),
+    'yellow': (255, 255, 0),
+    'orange': (255, 165, 0),
+    'red': (255, 0, 0),
+}
+
+
+def build_palette(gradient, size=256):
+    """Таблица цветов RGB (size, 3) с линейной интерполяцией между точками градиента"""
+    stops = sorted(gradient)
+    colors = np.array([COLOR_NAMES[gradient[stop]] for stop in stops], dtype=np.float64)
+    positions = np.linspace(0.0, 1.0, size)
+    # До первой точки и после последней цвет постоянный, как у градиента canvas
+    palette = np.column_stack([np.interp(positions, stops, colors[:, channel]) for channel in range(3)])
+    return np.rint(palette).astype(np.uint8)
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def encode_png(rgba):
+    """Кодирует массив (h, w, 4) uint8 в PNG без сторонних библиотек"""
+    height, width = rgba.shape[:2]
+    # Каждая строка начинается с байта фильтра 0 (без фильтрации)
+    rows = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    rows[:, 1:] = rgba.reshape(height, -1)
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+        png_chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)),
+        png_chunk(b'IEND', b''),
+    ])
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+class HeatTileRenderer:
+    """Растеризует тайлы тепловой карты по сетке среднегодовой инсоляции"""
+
+    def __init__(self, grid, gradient=HEAT_GRADIENT, max_value=HEAT_MAX_VALUE, min_opacity=HEAT_MIN_OPACITY):
+        self.grid = grid
+        # Среднегодовой слой в памяти в 12 раз меньше помесячной сетки
+        self.annual = annual_mean(np.asarray(grid.monthly, dtype=np.float64))[np.newaxis].astype(np.float32)
+        self.palette = build_palette(gradient)
+        self.max_value = max_value
+        self.min_opacity = min_opacity
+
+    def render(self, z, x, y):
+        """PNG-тайл z/x/y; тайлы вне сетки - общий прозрачный тайл"""
+        south, west, north, east = tile_bounds(z, x, y)
+        grid = self.grid
+        # Сетка может заходить за 180-й меридиан (долготы больше 180)
+        if south > grid.north or north < grid.south \
+                or (west > grid.east or east < grid.west) and (west + 360 > grid.east or east + 360 < grid.west):
+            return EMPTY_TILE
+
+        n = 2 ** z
+        pixels = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+        lon = (x + pixels) / n * 360.0 - 180.0
+        lon = np.where(lon < grid.west, lon + 360.0, lon)
+        # Широты строк пикселей в проекции Меркатора
+        lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pixels) / n))))
+        lat_2d, lon_2d = np.meshgrid(lat, lon, indexing='ij')
+        values = grid.interpolate(self.annual, lat_2d.ravel(), lon_2d.ravel())[0].reshape(TILE_SIZE, TILE_SIZE)
+
+        inside = ~np.isnan(values)
+        if not inside.any():
+            return EMPTY_TILE
+        level = np.clip(np.nan_to_num(values) / self.max_value, 0.0, 1.0)
+        rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        rgba[..., :3] = self.palette[np.rint(level * (len(self.palette) - 1)).astype(np.int64)]
+        alpha = np.maximum(level, self.min_opacity)
+        rgba[..., 3] = np.where(inside, np.rint(alpha * 255), 0).astype(np.uint8)
+        return encode_png(rgba)
+
+
+class TileDiskCache:
+    """Кэш тайлов на диске с вытеснением давно не запрошенных (LRU).
+
+    Тайлы лежат в каталоге <версия>/<z>/<x>/<y>.png. Каталог общий для
+    воркеров: тайл, которого нет в индексе процесса, ищется на диске, а
+    размер версии ведется в файле .usage под файловой блокировкой. Любая
+    запись и удаление тайла идут под той же блокировкой, поэтому предел
+    max_bytes действует на весь каталог; процесс, который превысил его
+    своей записью, вытесняет самые давние тайлы из своего индекса.
+
+    Кэш переходит только на более новую версию данных; запросы на прежнем
+    снимке получают промах и не пишут тайлы. Воркеры видят новую версию в
+    разные моменты, поэтому при переходе удаляются лишь каталоги других
+    версий, не менявшиеся дольше stale_after секунд.
+    """
+
+    def __init__(self, directory, max_bytes, stale_after=STALE_VERSION_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stale_after = stale_after
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _path(self, version, key):
+        z, x, y = key
+        return os.path.join(self.directory, version, str(z), str(x), f'{y}.png')
+
+    @contextmanager
+    def _usage(self, version):
+        """Размер тайлов версии под блокировкой, общей для процессов; вызывается под self._lock"""
+        fd = os.open(os.path.join(self.directory, version, USAGE_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            usage = {'bytes': int(f.read() or 0)}
+            yield usage
+            f.seek(0)
+            f.truncate()
+            f.write(str(usage['bytes']))
+
+    def _switch(self, version):
+        """Переход на новую версию данных: давно забытые тайлы удаляются, уже готовые подхватываются"""
+        version_dir = os.path.join(self.directory, version)
+        os.makedirs(version_dir, exist_ok=True)
+        # Отметка активности: другие процессы не сочтут каталог заброшенным
+        os.utime(version_dir)
+        idle_before = time.time() - self.stale_after
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name != version and os.stat(path).st_mtime < idle_before:
+                    shutil.rmtree(path, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+        with self._usage(version) as usage:
+            found = []
+            for root, _, files in os.walk(version_dir):
+                for filename in files:
+                    if not filename.endswith('.png'):
+                        continue
+                    path = os.path.join(root, filename)
+                    z, x = os.path.relpath(root, version_dir).split(os.sep)
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, (int(z), int(x), int(filename[:-4])), stat.st_size))
+            # Пересчет по диску исправляет счетчик, если процесс умер посреди записи
+            usage['bytes'] = sum(size for _, _, size in found)
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(found))
+        self.version = version
+
+    def get(self, version, key):
+        with self._lock:
+            if is_stale(version, self.version):
+                self.misses += 1
+                return None
+            if version != self.version:
+                self._switch(version)
+            indexed = key in self._entries
+            if indexed:
+                self._entries.move_to_end(key)
+        # Тайла нет в индексе, но его мог уже записать другой воркер
+        try:
+            with open(self._path(version, key), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                # Файл мог вытеснить другой процесс с тем же каталогом
+                self._entries.pop(key, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            if not indexed and version == self.version:
+                self._entries[key] = len(body)
+        return body
+
+    def put(self, version, key, body):
+        if is_stale(version, self.version):
+            return
+        path = self._path(version, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл: читатели не увидят недописанный тайл
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+
+        with self._lock, self._usage(version) as usage:
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            usage['bytes'] += len(body) - replaced
+            if version != self.version:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = len(body)
+            while usage['bytes'] > self.max_bytes and len(self._entries) > 1:
+                old_key, _ = self._entries.popitem(last=False)
+                old_path = self._path(version, old_key)
+                # Тот же тайл мог уже удалить другой процесс: вычитаем только то, что удалили сами
+                try:
+                    size = os.stat(old_path).st_size
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    continue
+                usage['bytes'] -= size
+                self.evicted += 1
+
+    def disk_bytes(self):
+        """Размер тайлов текущей версии по общему счетчику"""
+        if self.version is None:
+            return 0
+        try:
+            with open(os.path.join(self.directory, self.version, USAGE_FILE), encoding='utf-8') as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'version': self.version,
+                'entries': len(self._entries),
+                'bytes': self.disk_bytes(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evicted': self.evicted,
+                'hit_ratio': round(self.hits / requests, 4) if requests else 0.0,
+            }
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from data_store import location_columns
+from spatial_index import SpatialIndex
+
+# Границы сетки по умолчанию: вся Россия, долготы за 180° идут как 180..191
+RUSSIA_BOUNDS = (41.0, 19.0, 82.0, 191.0)
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype=np.float64)
+# Дни года, близкие к среднемесячному склонению Солнца
+MID_MONTH_DAYS = np.array([17, 47, 75, 105, 135, 162, 198, 228, 258, 288, 318, 344], dtype=np.float64)
+
+
+def extraterrestrial_daily(lat, day_of_year):
+    """Внеатмосферная дневная инсоляция горизонтальной площадки, кВтч/м²/день"""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    day_of_year = np.asarray(day_of_year, dtype=np.float64)
+    declination = np.radians(23.45) * np.sin(2 * np.pi * (284 + day_of_year) / 365)
+    # Полярные день и ночь: часовой угол заката ограничен [0, pi]
+    sunset = np.arccos(np.clip(-np.tan(lat) * np.tan(declination), -1.0, 1.0))
+    eccentricity = 1 + 0.033 * np.cos(2 * np.pi * day_of_year / 365)
+    return (24 / np.pi) * 1.367 * eccentricity * (
+        np.cos(lat) * np.cos(declination) * np.sin(sunset)
+        + sunset * np.sin(lat) * np.sin(declination)
+    )
+
+
+def monthly_profile(lat):
+    """Сезонный профиль: доля каждого месяца от среднегодовой инсоляции, форма (12, n)"""
+    lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+    daily = extraterrestrial_daily(lat[None, :], MID_MONTH_DAYS[:, None])
+    return daily / annual_mean(daily)
+
+
+class InsolationGrid:
+    """Сетка среднемесячной инсоляции (кВтч/м²/день) с билинейной интерполяцией.
+
+    Значения хранятся в узлах сетки массивом формы (12, nlat, nlon). Сетка,
+    открытая через open(), отображается в память: воркеры делят страницы
+    файла через кэш ОС, а запрос к точке читает только четыре соседних узла.
+    """
+
+    def __init__(self, monthly, south, west, step):
+        self.monthly = monthly
+        self.south = float(south)
+        self.west = float(west)
+        self.step = float(step)
+        self.nlat, self.nlon = monthly.shape[1:]
+
+    @property
+    def north(self):
+        return self.south + self.step * (self.nlat - 1)
+
+    @property
+    def east(self):
+        return self.west + self.step * (self.nlon - 1)
+
+    @classmethod
+    def open(cls, path):
+        """Открывает сетку из .npy файла и метаданных рядом с ним"""
+        with open(metadata_path(path), encoding='utf-8') as f:
+            metadata = json.load(f)
+        monthly = np.load(path, mmap_mode='r')
+        return cls(monthly, metadata['south'], metadata['west'], metadata['step'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.save(path, np.asarray(self.monthly, dtype=np.float32))
+        with open(metadata_path(path), 'w', encoding='utf-8') as f:
+            json.dump({'south': self.south, 'west': self.west, 'step': self.step,
+                       'shape': list(self.monthly.shape)}, f)
+
+    def _fractional_index(self, lat, lon):
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        # Долготу приводим к диапазону [west, west + 360)
+        lon = self.west + (lon - self.west) % 360.0
+        row = (lat - self.south) / self.step
+        col = (lon - self.west) / self.step
+        inside = (row >= 0) & (row <= self.nlat - 1) & (col >= 0) & (col <= self.nlon - 1)
+        return row, col, inside
+
+    def monthly_at(self, lat, lon):
+        """Среднемесячная инсоляция в точках, форма (12, n); вне сетки NaN"""
+        return self.interpolate(self.monthly, lat, lon)
+
+    def interpolate(self, layers, lat, lon):
+        """Билинейная интерполяция слоев формы (k, nlat, nlon) в узлах этой сетки"""
+        row, col, inside = self._fractional_index(lat, lon)
+        result = np.full((layers.shape[0], row.size), np.nan)
+        if not inside.any():
+            return result
+
+        row, col = row[inside], col[inside]
+        row0 = np.minimum(np.floor(row).astype(np.int64), self.nlat - 2)
+        col0 = np.minimum(np.floor(col).astype(np.int64), self.nlon - 2)
+        dy, dx = row - row0, col - col0
+        # Читаем только нужные узлы, не трогая остальной файл
+        v00 = layers[:, row0, col0]
+        v01 = layers[:, row0, col0 + 1]
+        v10 = layers[:, row0 + 1, col0]
+        v11 = layers[:, row0 + 1, col0 + 1]
+        result[:, inside] = (
+            v00 * (1 - dy) * (1 - dx) + v01 * (1 - dy) * dx
+            + v10 * dy * (1 - dx) + v11 * dy * dx
+        )
+        return result
+
+    def annual_at(self, lat, lon):
+        """Среднегодовая дневная инсоляция в точках"""
+        return annual_mean(self.monthly_at(lat, lon))
+
+
+def annual_mean(monthly):
+    """Среднегодовое значение из среднемесячных с учетом длины месяцев"""
+    monthly = np.asarray(monthly, dtype=np.float64)
+    weights = DAYS_IN_MONTH.reshape((12,) + (1,) * (monthly.ndim - 1))
+    return (monthly * weights).sum(axis=0) / DAYS_IN_MONTH.sum()
+
+
+def metadata_path(path):
+    """Путь к json с границами и шагом сетки"""
+    return os.path.splitext(path)[0] + '.json'
+
+
+def build_grid_from_stations(locations, step=0.1, bounds=RUSSIA_BOUNDS, power=2.0, neighbors=12, rows_per_chunk=64):
+    """Строит сетку по станциям: IDW по ближайшим станциям и сезонный профиль по широте"""
+    south, west, north, east = bounds
+    nlat = int(round((north - south) / step)) + 1
+    nlon = int(round((east - west) / step)) + 1
+    lats = south + step * np.arange(nlat)
+    lons = west + step * np.arange(nlon)
+
+    names, station_lat, station_lon, values = location_columns(locations)
+    index = SpatialIndex(names, station_lat, station_lon)
+
+    annual = np.empty((nlat, nlon))
+    # Каждый узел взвешивает только neighbors ближайших станций, а полосы строк
+    # ограничивают память: она не растет ни с размером сетки, ни с числом станций
+    for start in range(0, nlat, rows_per_chunk):
+        chunk_lats = lats[start:start + rows_per_chunk]
+        grid_lat, grid_lon = np.meshgrid(chunk_lats, lons, indexing='ij')
+        nearest, chords = index.nearest_many(grid_lat.ravel(), grid_lon.ravel(), neighbors)
+        weights = 1 / np.maximum(chords ** 2, 1e-12) ** (power / 2)
+        annual[start:start + len(chunk_lats)] = (
+            (weights * values[nearest]).sum(axis=1) / weights.sum(axis=1)
+        ).reshape(grid_lat.shape)
+
+    monthly = annual[None, :, :] * monthly_profile(lats)[:, :, None]
+    return InsolationGrid(monthly.astype(np.float32), south, west, step)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сборка сетки инсоляции из данных станций')
+    parser.add_argument('output', help='путь к .npy файлу сетки')
+    parser.add_argument('--step', type=float, default=0.1, help='шаг сетки в градусах')
+    args = parser.parse_args()
+
+    from app import SOLAR_INSOLATION
+
+    grid = build_grid_from_stations(SOLAR_INSOLATION, step=args.step)
+    grid.save(args.output)
+    print(f'Сетка {grid.nlat}x{grid.nlon} сохранена в {args.output}')
+
+
+if __name__ == '__main__':
+    main()
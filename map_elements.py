@@ -0,0 +1,198 @@
+from branca.element import MacroElement
+from jinja2 import Template
+
+# Диапазон тайлов, покрывающий область просмотра, в виде параметров запроса z, x0, y0, x1, y1
+VIEWPORT_TILES_JS = """
+            function tileX(lon, n) {
+                return Math.floor((lon + 180) / 360 * n);
+            }
+
+            function tileY(lat, n) {
+                var rad = Math.max(Math.min(lat, 85.0511), -85.0511) * Math.PI / 180;
+                return Math.floor((1 - Math.log(Math.tan(rad) + 1 / Math.cos(rad)) / Math.PI) / 2 * n);
+            }
+
+            function viewportTiles(map) {
+                var zoom = Math.round(map.getZoom());
+                var n = Math.pow(2, zoom);
+                var bounds = map.getBounds();
+                return 'z=' + zoom + '&x0=' + tileX(bounds.getWest(), n) + '&y0=' + Math.max(tileY(bounds.getNorth(), n), 0)
+                    + '&x1=' + tileX(bounds.getEast(), n) + '&y1=' + Math.min(tileY(bounds.getSouth(), n), n - 1);
+            }
+"""
+
+
+class ViewportZoneLoader(MacroElement):
+    """Подгружает геометрию зон только для видимой области карты.
+
+    Каждой зоне соответствует своя группа слоев (видна в LayerControl).
+    При перемещении карты запрашивается диапазон тайлов, покрывающий
+    область просмотра, поэтому объем данных растет с видимой областью,
+    а не с площадью всей страны.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var groups = [{% for group in this.groups %}{{ group.get_name() }}{{ ", " if not loop.last }}{% endfor %}];
+            var styles = {{ this.styles|tojson }};
+            var lastKey = null;
+""" + VIEWPORT_TILES_JS + """
+
+            function loadZones() {
+                var key = viewportTiles(map);
+                if (key === lastKey) {
+                    return;
+                }
+                lastKey = key;
+                fetch({{ this.url|tojson }} + '?' + key + '&v=' + {{ this.version|tojson }})
+                    .then(function(response) { return response.json(); })
+                    .then(function(data) {
+                        if (key !== lastKey) {
+                            return;
+                        }
+                        groups.forEach(function(group) { group.clearLayers(); });
+                        data.features.forEach(function(feature) {
+                            var index = feature.properties.zone;
+                            L.geoJSON(feature, {style: styles[index]}).addTo(groups[index]);
+                        });
+                    });
+            }
+
+            map.on('moveend', loadZones);
+            loadZones();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, groups, styles, url, version):
+        super().__init__()
+        self._name = 'ViewportZoneLoader'
+        self.groups = groups
+        self.styles = styles
+        self.url = url
+        self.version = version
+
+
+class ViewportClusterLoader(MacroElement):
+    """Заполняет MarkerCluster кластерами и точками видимой области.
+
+    Кластеры заранее посчитаны на сервере для каждого зума; браузер
+    получает только то, что попадает в область просмотра. MarkerCluster
+    объединяет маркеры, которые все же перекрываются на экране, и
+    суммирует в значке число точек серверных кластеров. Маркеры хранят
+    только номер города, всплывающее окно загружается при открытии.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var group = {{ this.group.get_name() }};
+            var selected = {{ this.selected|tojson }};
+            var version = {{ this.version|tojson }};
+            var popups = {};
+            var lastKey = null;
+""" + VIEWPORT_TILES_JS + """
+
+            function countIcon(count) {
+                var size = count < 10 ? 'small' : count < 100 ? 'medium' : 'large';
+                return L.divIcon({
+                    html: '<div><span>' + count + '</span></div>',
+                    className: 'marker-cluster marker-cluster-' + size,
+                    iconSize: L.point(40, 40)
+                });
+            }
+
+            group.options.iconCreateFunction = function(cluster) {
+                var count = 0;
+                cluster.getAllChildMarkers().forEach(function(marker) {
+                    count += marker.options.count || 1;
+                });
+                return countIcon(count);
+            };
+
+            function clusterMarker(item) {
+                var marker = L.marker(item.coords, {icon: countIcon(item.count), count: item.count});
+                marker.bindTooltip(item.count + ' точек, в среднем ' + item.insolation + ' кВтч/м²/день');
+                marker.on('click', function() {
+                    map.fitBounds([[item.bounds[0], item.bounds[1]], [item.bounds[2], item.bounds[3]]],
+                                  {maxZoom: map.getZoom() + 2});
+                });
+                return marker;
+            }
+
+            function pointMarker(item, dataVersion) {
+                // Номер города действителен только в версии данных, с которой он получен
+                var popupKey = dataVersion + '/' + item.id;
+                var marker = L.circleMarker(item.coords, {
+                    radius: 10 + item.insolation * 2,
+                    color: item.marker_color,
+                    fill: true,
+                    fillColor: item.marker_color,
+                    fillOpacity: 0.7,
+                    weight: 2
+                });
+                marker.bindTooltip(item.city + ': ' + item.insolation + ' кВтч/м²/день');
+                // Содержимое окна запрашивается только при открытии и запоминается
+                marker.bindPopup(popups[popupKey] || 'Загрузка...', {maxWidth: 350});
+                marker.on('popupopen', function() {
+                    if (popups[popupKey]) {
+                        marker.setPopupContent(popups[popupKey]);
+                        return;
+                    }
+                    fetch({{ this.popup_url|tojson }} + item.id + '?v=' + encodeURIComponent(dataVersion))
+                        .then(function(response) {
+                            if (!response.ok) {
+                                return response.json().then(function(data) {
+                                    marker.setPopupContent(data.error);
+                                });
+                            }
+                            return response.text().then(function(html) {
+                                popups[popupKey] = html;
+                                marker.setPopupContent(html);
+                            });
+                        });
+                });
+                return marker;
+            }
+
+            function loadClusters() {
+                var key = viewportTiles(map);
+                if (key === lastKey) {
+                    return;
+                }
+                lastKey = key;
+                fetch({{ this.url|tojson }} + '?' + key + '&v=' + version)
+                    .then(function(response) { return response.json(); })
+                    .then(function(data) {
+                        if (key !== lastKey) {
+                            return;
+                        }
+                        var markers = data.clusters.map(clusterMarker);
+                        data.points.forEach(function(item) {
+                            // Выбранный город нарисован в документе отдельным маркером
+                            if (item.city !== selected) {
+                                markers.push(pointMarker(item, data.version));
+                            }
+                        });
+                        group.clearLayers();
+                        group.addLayers(markers);
+                    });
+            }
+
+            map.on('moveend', loadClusters);
+            loadClusters();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, group, url, popup_url, version, selected=None):
+        super().__init__()
+        self._name = 'ViewportClusterLoader'
+        self.group = group
+        self.url = url
+        self.popup_url = popup_url
+        self.version = version
+        self.selected = selected
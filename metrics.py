@@ -0,0 +1,121 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+# Границы корзин гистограмм: секунды и байты
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, суммой и числом наблюдений"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Счетчики и гистограммы процесса в текстовом формате Prometheus.
+
+    Метрики живут в памяти процесса: при нескольких воркерах gunicorn
+    каждый опрос видит только тот воркер, который на него ответил.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=(), buckets=DURATION_BUCKETS):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, labels=()):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    def add_collector(self, collect):
+        """collect() возвращает строки (имя, тип, справка, метки, значение), снятые в момент опроса"""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        described = set()
+
+        def header(name, kind, text):
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()
+            )
+        for (name, labels), value in counters:
+            header(name, *self._help.get(name, ('counter', name)))
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        for (name, labels), counts, total, count, buckets in histograms:
+            header(name, *self._help.get(name, ('histogram', name)))
+            cumulative = 0
+            for bound, bucket_count in zip((*buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else format_value(bound)
+                lines.append(f'{name}_bucket{format_labels((*labels, ("le", le)))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        # Формат требует, чтобы ряды одной метрики шли подряд, поэтому сначала группируем
+        families = {}
+        for collect in self._collectors:
+            for name, kind, text, labels, value in collect():
+                families.setdefault(name, (kind, text, []))[2].append(
+                    f'{name}{format_labels(labels)} {format_value(value)}'
+                )
+        for name, (kind, text, samples) in families.items():
+            header(name, kind, text)
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,88 @@
+import threading
+
+import numpy as np
+
+from pv_simulation import PVSystem, SolarResource
+from work_pool import process_pool_size, spawn_pool
+
+# Грубая сетка поиска: наклон 0..90°, азимут от востока до запада через юг
+COARSE_TILTS = np.arange(0.0, 91.0, 10.0)
+COARSE_AZIMUTHS = np.arange(90.0, 271.0, 15.0)
+# Уточнение идет, пока шаг не станет меньше этой величины, градусы
+REFINE_MIN_STEP = 0.25
+# С этого числа точек расчет раскладывается по процессам
+PARALLEL_MIN_LOCATIONS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def yearly_energy(resource, row, tilts, azimuths, system):
+    """Годовая выработка одной точки для массивов ориентаций"""
+    return resource.simulate(np.asarray(tilts)[None, :], np.asarray(azimuths)[None, :], system, rows=[row])['yearly'][0]
+
+
+def optimize_row(resource, row, system):
+    """Лучшие наклон и азимут для одной точки: грубая сетка, затем уточнение вокруг лучшего"""
+    tilts, azimuths = np.meshgrid(COARSE_TILTS, COARSE_AZIMUTHS, indexing='ij')
+    energy = yearly_energy(resource, row, tilts.ravel(), azimuths.ravel(), system)
+    best = int(np.argmax(energy))
+    tilt, azimuth, best_energy = tilts.ravel()[best], azimuths.ravel()[best], energy[best]
+
+    # Поиск по шаблону 3x3 с уменьшением шага вдвое, пока нет улучшения
+    tilt_step = (COARSE_TILTS[1] - COARSE_TILTS[0]) / 2
+    azimuth_step = (COARSE_AZIMUTHS[1] - COARSE_AZIMUTHS[0]) / 2
+    while max(tilt_step, azimuth_step) >= REFINE_MIN_STEP:
+        offsets = np.array([-1.0, 0.0, 1.0])
+        candidate_tilts, candidate_azimuths = np.meshgrid(
+            np.clip(tilt + offsets * tilt_step, 0.0, 90.0),
+            np.clip(azimuth + offsets * azimuth_step, 0.0, 360.0),
+            indexing='ij',
+        )
+        energy = yearly_energy(resource, row, candidate_tilts.ravel(), candidate_azimuths.ravel(), system)
+        best = int(np.argmax(energy))
+        if energy[best] > best_energy:
+            tilt, azimuth, best_energy = candidate_tilts.ravel()[best], candidate_azimuths.ravel()[best], energy[best]
+        else:
+            tilt_step /= 2
+            azimuth_step /= 2
+
+    horizontal = yearly_energy(resource, row, [0.0], [180.0], system)[0]
+    return {
+        'tilt': round(float(tilt), 1),
+        'azimuth': round(float(azimuth), 1),
+        'yearly': float(best_energy),
+        'horizontal_yearly': float(horizontal),
+    }
+
+
+def optimize_chunk(lat, lon, monthly_ghi, system):
+    """Оптимизирует ориентацию для группы точек; выполняется и в дочерних процессах"""
+    resource = SolarResource(lat, lon, monthly_ghi)
+    return [optimize_row(resource, row, system) for row in range(len(resource))]
+
+
+def get_executor():
+    """Общий пул процессов, создается при первом параллельном расчете"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = spawn_pool(process_pool_size())
+        return _executor
+
+
+def optimize_locations(lat, lon, monthly_ghi, system=PVSystem()):
+    """Оптимальная ориентация для каждой точки; много точек считаются в пуле процессов"""
+    lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+    lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+    monthly_ghi = np.asarray(monthly_ghi, dtype=np.float64).reshape(12, -1)
+    workers = process_pool_size()
+    if len(lat) < PARALLEL_MIN_LOCATIONS or workers < 2:
+        return optimize_chunk(lat, lon, monthly_ghi, system)
+
+    chunks = np.array_split(np.arange(len(lat)), min(workers, len(lat)))
+    futures = [
+        get_executor().submit(optimize_chunk, lat[rows], lon[rows], monthly_ghi[:, rows], system)
+        for rows in chunks
+    ]
+    return [result for future in futures for result in future.result()]
@@ -0,0 +1,413 @@
+from concurrent.futures import BrokenExecutor
+import csv
+from functools import partial
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from insolation_grid import InsolationGrid
+from solar_calc import DEFAULT_EFFICIENCY, DEFAULT_PANEL_AREA, calculate_solar_potential_batch
+from work_pool import process_pool_size, spawn_pool
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow необязателен, без него принимаются только CSV
+    pq = None
+
+# Строк в одном векторном проходе
+JOB_CHUNK_ROWS = 50000
+# Через сколько секунд удаляются каталоги завершенных задач
+JOB_TTL = 24 * 3600
+# Как часто процесс расчета отмечается в status.json и через сколько секунд
+# без отметки задача считается брошенной
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_HEARTBEAT_TIMEOUT = 60
+# Брошенная задача возвращается в очередь, пока число попыток меньше этого
+JOB_MAX_ATTEMPTS = 3
+# Как часто воркер проверяет очередь, когда у него есть свободное место, секунды
+JOB_POLL_INTERVAL = 1.0
+# Подкаталог с метками задач, ожидающих расчета
+QUEUE_DIR = 'queue'
+INPUT_FORMATS = ('csv', 'parquet')
+RESULT_COLUMNS = ['id', 'lat', 'lon', 'panel_area', 'efficiency', 'insolation',
+                  'daily', 'monthly', 'yearly', 'savings', 'co2_reduction']
+
+
+_status_lock = threading.Lock()
+
+
+def write_status(job_dir, **status):
+    """Атомарно обновляет status.json задачи: читатели не увидят половину файла"""
+    path = os.path.join(job_dir, 'status.json')
+    # Расчет и его heartbeat пишут из разных потоков одного процесса
+    with _status_lock:
+        try:
+            with open(path, encoding='utf-8') as f:
+                current = json.load(f)
+        except FileNotFoundError:
+            current = {}
+        current.update(status)
+        fd, tmp_path = tempfile.mkstemp(dir=job_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def process_alive(pid):
+    """Жив ли процесс с этим pid на текущей машине"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_orphaned(status, now=None):
+    """Задача не завершена, но процесс, который должен ее довести, уже умер.
+
+    Задачу из очереди забирает воркер веб-сервера (owner_pid), начатую
+    считает дочерний процесс (runner_pid), который обновляет heartbeat.
+    Задача, которую еще никто не забрал, не брошена. Pid проверяются
+    только на той же машине, heartbeat - везде.
+    """
+    local = status.get('host') == socket.gethostname()
+    if status.get('state') == 'queued':
+        return local and status.get('owner_pid') is not None and not process_alive(status['owner_pid'])
+    if status.get('state') == 'running':
+        if local and status.get('runner_pid') is not None and not process_alive(status['runner_pid']):
+            return True
+        heartbeat = status.get('heartbeat')
+        return heartbeat is not None and (now or time.time()) - heartbeat > JOB_HEARTBEAT_TIMEOUT
+    return False
+
+
+def beat(job_dir, stop):
+    """Отмечает в status.json, что процесс расчета жив, пока не выставлен stop"""
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        write_status(job_dir, heartbeat=time.time())
+
+
+def to_floats(values, default=np.nan):
+    """Столбец строк в массив float; пустые и некорректные значения заменяются default"""
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        result = np.full(len(values), default, dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                result[i] = float(value)
+            except (TypeError, ValueError):
+                if value not in ('', None):
+                    result[i] = np.nan
+        return result
+
+
+def column_arrays(columns, rows):
+    """Массивы lat, lon, площади, КПД и идентификаторов из строк одного блока"""
+    def column(*names):
+        for name in names:
+            if name in columns:
+                index = columns[name]
+                return [row[index] if index < len(row) else '' for row in rows]
+        return None
+
+    area = column('panel_area', 'area')
+    efficiency = column('efficiency')
+    ids = column('id')
+    return (
+        to_floats(column('lat')),
+        to_floats(column('lon')),
+        np.full(len(rows), float(DEFAULT_PANEL_AREA)) if area is None else to_floats(area, DEFAULT_PANEL_AREA),
+        np.full(len(rows), DEFAULT_EFFICIENCY) if efficiency is None else to_floats(efficiency, DEFAULT_EFFICIENCY),
+        ids if ids is not None else [''] * len(rows),
+    )
+
+
+def read_csv_chunks(path, chunk_rows=JOB_CHUNK_ROWS):
+    """Читает CSV блоками строк; вместе с блоком отдает долю прочитанного файла"""
+    size = os.path.getsize(path) or 1
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = {name.strip().lower(): i for i, name in enumerate(header)}
+        if 'lat' not in columns or 'lon' not in columns:
+            raise ValueError('В файле нет столбцов lat и lon')
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            rows.append(row)
+            if len(rows) >= chunk_rows:
+                # Позиция в байтах опережает разбор на размер буфера, для прогресса этого достаточно
+                yield column_arrays(columns, rows), min(f.buffer.tell() / size, 1.0)
+                rows = []
+        if rows:
+            yield column_arrays(columns, rows), 1.0
+
+
+def read_parquet_chunks(path, chunk_rows=JOB_CHUNK_ROWS):
+    """Читает Parquet пакетами строк через pyarrow"""
+    parquet = pq.ParquetFile(path)
+    names = [name.lower() for name in parquet.schema_arrow.names]
+    if 'lat' not in names or 'lon' not in names:
+        raise ValueError('В файле нет столбцов lat и lon')
+    total = parquet.metadata.num_rows or 1
+    done = 0
+    for batch in parquet.iter_batches(batch_size=chunk_rows):
+        data = {name.lower(): batch.column(i) for i, name in enumerate(batch.schema.names)}
+        count = batch.num_rows
+        done += count
+
+        def numbers(name, default):
+            if name not in data:
+                return np.full(count, float(default))
+            return np.asarray(data[name].to_numpy(zero_copy_only=False), dtype=np.float64)
+
+        area_name = 'panel_area' if 'panel_area' in data else 'area'
+        yield (
+            numbers('lat', np.nan),
+            numbers('lon', np.nan),
+            numbers(area_name, DEFAULT_PANEL_AREA),
+            numbers('efficiency', DEFAULT_EFFICIENCY),
+            [str(value) for value in data['id'].to_pylist()] if 'id' in data else [''] * count,
+        ), done / total
+
+
+def format_value(value):
+    return '' if value != value else value  # NaN пишем пустой ячейкой
+
+
+def drop_partials(job_dir):
+    """Удаляет недописанные результаты прошлых попыток, чьи процессы уже умерли"""
+    for name in os.listdir(job_dir):
+        parts = name.split('.')
+        if len(parts) == 4 and parts[3] == 'part' and parts[2].isdigit() and not process_alive(int(parts[2])):
+            os.remove(os.path.join(job_dir, name))
+
+
+def run_portfolio_job(job_dir, input_format, grid_source):
+    """Считает потенциал для всех строк файла задачи и пишет result.csv.
+
+    Выполняется в дочернем процессе. grid_source - путь к файлу сетки
+    или сама сетка, если она построена в памяти.
+    """
+    stop = threading.Event()
+    try:
+        write_status(job_dir, state='running', started=time.time(), runner_pid=os.getpid(), heartbeat=time.time())
+        threading.Thread(target=beat, args=(job_dir, stop), daemon=True).start()
+        drop_partials(job_dir)
+        grid = InsolationGrid.open(grid_source) if isinstance(grid_source, str) else grid_source
+        input_path = os.path.join(job_dir, f'input.{input_format}')
+        chunks = read_parquet_chunks(input_path) if input_format == 'parquet' else read_csv_chunks(input_path)
+
+        rows_done = 0
+        # Свой временный файл у каждой попытки: повтор брошенной задачи не испортит чужой
+        partial_path = os.path.join(job_dir, f'result.csv.{os.getpid()}.part')
+        with open(partial_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(RESULT_COLUMNS)
+            for (lat, lon, area, efficiency, ids), progress in chunks:
+                insolation = grid.annual_at(lat, lon)
+                # Некорректные параметры панелей дают пустой результат, а не ошибку всей задачи
+                valid = (area > 0) & (efficiency > 0) & (efficiency <= 1)
+                insolation = np.where(valid, insolation, np.nan)
+                potential = calculate_solar_potential_batch(np.round(insolation, 2), area, efficiency)
+                columns = [lat, lon, area, efficiency, np.round(insolation, 2),
+                           *(potential[name] for name in RESULT_COLUMNS[6:])]
+                writer.writerows(
+                    [row_id, *map(format_value, values)]
+                    for row_id, values in zip(ids, zip(*(column.tolist() for column in columns)))
+                )
+                rows_done += len(lat)
+                write_status(job_dir, rows_done=rows_done, progress=round(progress, 4))
+        os.replace(partial_path, os.path.join(job_dir, 'result.csv'))
+        write_status(job_dir, state='done', progress=1.0, rows_done=rows_done, finished=time.time())
+    except Exception as error:
+        write_status(job_dir, state='failed', error=str(error), finished=time.time())
+    finally:
+        stop.set()
+
+
+class PortfolioJobs:
+    """Очередь задач расчета портфеля площадок в общем каталоге.
+
+    Состояние задачи хранится в ее каталоге (status.json), а ожидание - в
+    метке queue/<id>, поэтому опрос и расчет может взять любой процесс
+    веб-сервера. Каждый воркер забирает метку, только когда в его пуле
+    дочерних процессов есть свободное место: задачи не копятся в памяти
+    воркера и не теряются, когда gunicorn его перезапускает. Задача, чей
+    воркер или дочерний процесс умер, возвращается в очередь, пока не
+    исчерпает JOB_MAX_ATTEMPTS попыток.
+    """
+
+    def __init__(self, directory, grid_source, max_workers=None):
+        self.directory = directory
+        self.grid_source = grid_source
+        self.max_workers = max_workers or max(1, process_pool_size() - 1)
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self._consumer = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = spawn_pool(self.max_workers)
+            return self._executor
+
+    def job_dir(self, job_id):
+        # Имя задачи - только hex uuid, поэтому выйти за пределы каталога нельзя
+        if len(job_id) != 32 or any(c not in '0123456789abcdef' for c in job_id):
+            return None
+        path = os.path.join(self.directory, job_id)
+        return path if os.path.isdir(path) else None
+
+    def submit(self, save_input, input_format):
+        """Сохраняет входной файл через save_input(путь) и ставит задачу; возвращает id или None для пустого файла"""
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.directory, job_id)
+        os.makedirs(job_dir)
+        input_path = os.path.join(job_dir, f'input.{input_format}')
+        save_input(input_path)
+        if not os.path.getsize(input_path):
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return None
+        write_status(job_dir, job_id=job_id, state='queued', format=input_format,
+                     rows_done=0, progress=0.0, created=time.time(), attempts=0)
+        self._enqueue(job_id)
+        self._start_consumer()
+        return job_id
+
+    def _enqueue(self, job_id):
+        queue_dir = os.path.join(self.directory, QUEUE_DIR)
+        os.makedirs(queue_dir, exist_ok=True)
+        open(os.path.join(queue_dir, job_id), 'w').close()
+
+    def _claim(self):
+        """Забирает самую старую метку очереди; None, если очередь пуста"""
+        queue_dir = os.path.join(self.directory, QUEUE_DIR)
+        try:
+            names = os.listdir(queue_dir)
+        except FileNotFoundError:
+            return None
+        marks = []
+        for name in names:
+            try:
+                marks.append((os.stat(os.path.join(queue_dir, name)).st_mtime, name))
+            except FileNotFoundError:
+                pass
+        for _, job_id in sorted(marks):
+            # Удаление метки атомарно: задачу получает ровно один процесс
+            try:
+                os.remove(os.path.join(queue_dir, job_id))
+            except FileNotFoundError:
+                continue
+            job_dir = self.job_dir(job_id)
+            if job_dir is not None:
+                return job_dir
+        return None
+
+    def _start_consumer(self):
+        # Поток запускается в воркере при первой задаче или опросе: после fork потоки мастера не живут
+        with self._lock:
+            if self._consumer is None:
+                self._consumer = threading.Thread(target=self._consume, name='portfolio-jobs', daemon=True)
+                self._consumer.start()
+
+    def _consume(self):
+        while True:
+            self._slots.acquire()
+            try:
+                job_dir = self._claim()
+            except OSError:
+                job_dir = None
+            if job_dir is None:
+                self._slots.release()
+                time.sleep(JOB_POLL_INTERVAL)
+                continue
+            try:
+                self._run(job_dir)
+            except Exception as error:
+                self._slots.release()
+                write_status(job_dir, state='failed', error=str(error), finished=time.time())
+
+    def _run(self, job_dir):
+        with open(os.path.join(job_dir, 'status.json'), encoding='utf-8') as f:
+            status = json.load(f)
+        write_status(job_dir, host=socket.gethostname(), owner_pid=os.getpid())
+        executor = self._get_executor()
+        future = executor.submit(run_portfolio_job, job_dir, status['format'], self.grid_source())
+        future.add_done_callback(partial(self._job_finished, job_dir, executor))
+
+    def _job_finished(self, job_dir, executor, future):
+        self._slots.release()
+        # run_portfolio_job сам записывает свои ошибки; исключение здесь значит,
+        # что дочерний процесс умер (например, убит по памяти) и итог не записан
+        error = future.exception()
+        if error is None:
+            return
+        if not isinstance(error, BrokenExecutor):
+            write_status(job_dir, state='failed', error=str(error), finished=time.time())
+            return
+        with self._lock:
+            # Сломанный пул не принимает новые задачи, следующая создаст новый
+            if self._executor is executor:
+                self._executor = None
+        with open(os.path.join(job_dir, 'status.json'), encoding='utf-8') as f:
+            self._retry(job_dir, json.load(f), 'Процесс расчета завершился аварийно')
+
+    def _retry(self, job_dir, status, error):
+        """Возвращает брошенную задачу в очередь или, если попытки кончились, отмечает сбойной"""
+        attempt = status.get('attempts', 0) + 1
+        # Файл попытки создается атомарно: повтор ставит только один из опросивших процессов
+        try:
+            os.close(os.open(os.path.join(job_dir, f'attempt.{attempt}'), os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            return
+        if attempt >= JOB_MAX_ATTEMPTS:
+            write_status(job_dir, state='failed', error=error, attempts=attempt, finished=time.time())
+            return
+        write_status(job_dir, state='queued', attempts=attempt, owner_pid=None, runner_pid=None,
+                     heartbeat=None, rows_done=0, progress=0.0)
+        self._enqueue(os.path.basename(job_dir))
+
+    def status(self, job_id):
+        """Состояние задачи; брошенная задача при опросе возвращается в очередь"""
+        job_dir = self.job_dir(job_id)
+        if job_dir is None:
+            return None
+        self._start_consumer()
+        with open(os.path.join(job_dir, 'status.json'), encoding='utf-8') as f:
+            status = json.load(f)
+        if is_orphaned(status):
+            self._retry(job_dir, status, 'Процесс, выполнявший задачу, завершился')
+            with open(os.path.join(job_dir, 'status.json'), encoding='utf-8') as f:
+                status = json.load(f)
+        return status
+
+    def result_path(self, job_id):
+        job_dir = self.job_dir(job_id)
+        path = job_dir and os.path.join(job_dir, 'result.csv')
+        return path if path and os.path.exists(path) else None
+
+    def cleanup(self):
+        """Удаляет каталоги задач старше JOB_TTL"""
+        if not os.path.isdir(self.directory):
+            return
+        deadline = time.time() - JOB_TTL
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name != QUEUE_DIR and os.path.isdir(path) and os.path.getmtime(path) < deadline:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,63 @@
+from collections import Counter
+import os
+import sys
+import threading
+import time
+
+# Интервал выборки стека, секунды
+SAMPLE_INTERVAL = 0.001
+
+
+def frame_stack(frame):
+    """Стек вызовов от корня к листу в виде 'модуль:функция:строка'"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """Выборочный профайлер одного потока.
+
+    Отдельный поток раз в interval секунд снимает стек профилируемого
+    потока через sys._current_frames(); сам поток запроса не замедляется
+    трассировкой. Результат - свернутые стеки ('a;b;c 12' на строку),
+    которые принимают flamegraph.pl, speedscope и inferno.
+    """
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self.started = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='solar-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[frame_stack(frame)] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.folded())
+        return path
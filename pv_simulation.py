@@ -0,0 +1,244 @@
+from collections import namedtuple
+
+import numpy as np
+
+from data_store import location_columns
+from insolation_grid import DAYS_IN_MONTH, monthly_profile
+from solar_calc import DEFAULT_EFFICIENCY, DEFAULT_PANEL_AREA
+
+HOURS_IN_YEAR = 8760
+SOLAR_CONSTANT = 1367.0
+# Первый час каждого месяца в невисокосном году
+MONTH_START_HOURS = np.concatenate([[0], np.cumsum(DAYS_IN_MONTH[:-1] * 24)]).astype(np.int64)
+# Ниже этой высоты Солнца прямое излучение считаем рассеянным
+MIN_COS_ZENITH = 0.065
+
+# Параметры системы: потери (инвертор, кабели, загрязнение), температурный
+# коэффициент мощности в долях на °C, NOCT в °C и альбедо земли
+PVSystem = namedtuple(
+    'PVSystem',
+    ['panel_area', 'efficiency', 'losses', 'temp_coefficient', 'noct', 'albedo'],
+    defaults=(DEFAULT_PANEL_AREA, DEFAULT_EFFICIENCY, 0.14, -0.004, 45.0, 0.2),
+)
+
+
+def solar_position(lat, lon):
+    """Положение Солнца по часам года: косинус зенитного угла, азимут (от севера по часовой),
+    истинное солнечное время, форма (n, 8760), и склонение, форма (8760,)"""
+    lat = np.radians(np.atleast_1d(np.asarray(lat, dtype=np.float64)))[:, None]
+    lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))[:, None]
+    hours = np.arange(HOURS_IN_YEAR)
+    day_of_year = hours // 24 + 1
+    # Склонение и уравнение времени по Спенсеру
+    b = 2 * np.pi * (day_of_year - 1) / 365
+    declination = (0.006918 - 0.399912 * np.cos(b) + 0.070257 * np.sin(b) - 0.006758 * np.cos(2 * b)
+                   + 0.000907 * np.sin(2 * b) - 0.002697 * np.cos(3 * b) + 0.00148 * np.sin(3 * b))
+    equation_of_time = 229.18 * (0.000075 + 0.001868 * np.cos(b) - 0.032077 * np.sin(b)
+                                 - 0.014615 * np.cos(2 * b) - 0.040849 * np.sin(2 * b))
+    # Время UTC середины часа переводим в истинное солнечное время точки
+    solar_time = hours % 24 + 0.5 + lon / 15 + equation_of_time / 60
+    hour_angle = np.radians(15 * (solar_time - 12))
+
+    cos_zenith = np.sin(lat) * np.sin(declination) + np.cos(lat) * np.cos(declination) * np.cos(hour_angle)
+    azimuth = np.arctan2(np.sin(hour_angle),
+                         np.cos(hour_angle) * np.sin(lat) - np.tan(declination) * np.cos(lat)) + np.pi
+    return cos_zenith, azimuth, solar_time, declination
+
+
+def daily_diffuse_fraction(clearness, sunset_angle):
+    """Доля рассеянного излучения в дневной сумме (корреляция Эрбса для средних за месяц).
+
+    clearness - среднемесячный дневной индекс ясности, sunset_angle - часовой
+    угол заката в радианах. Часовая корреляция Эрбса здесь не подходит: при
+    постоянном за день индексе ясности она считает пасмурным каждый час.
+    """
+    kt = np.clip(clearness, 0.3, 0.8)
+    short_day = 1.391 - 3.560 * kt + 4.189 * kt ** 2 - 2.137 * kt ** 3
+    long_day = 1.311 - 3.022 * kt + 3.427 * kt ** 2 - 1.821 * kt ** 3
+    return np.clip(np.where(sunset_angle <= np.radians(81.4), short_day, long_day), 0.0, 1.0)
+
+
+def hourly_global_weight(hour_angle, sunset_angle):
+    """Множитель Коллареса-Перейры и Рабла к внеатмосферному ходу суммарного излучения за день"""
+    shift = np.sin(sunset_angle - np.radians(60))
+    return (0.409 + 0.5016 * shift) + (0.6609 - 0.4767 * shift) * np.cos(hour_angle)
+
+
+def estimate_monthly_temperature(lat):
+    """Грубая зональная климатология среднемесячной температуры воздуха, форма (12, n).
+
+    Используется только для температурных потерь панелей, когда нет
+    станционных данных о температуре.
+    """
+    lat = np.abs(np.atleast_1d(np.asarray(lat, dtype=np.float64)))
+    mean = 30 - 0.5 * lat
+    amplitude = np.maximum(0.4 * lat - 6, 0)
+    month_days = np.concatenate([[0], np.cumsum(DAYS_IN_MONTH)[:-1]]) + DAYS_IN_MONTH / 2
+    # Самый теплый месяц - июль, около 200-го дня года
+    return mean + amplitude * np.cos(2 * np.pi * (month_days[:, None] - 200) / 365)
+
+
+def local_hours(lon):
+    """Номер часа года по местному солнечному времени для каждого часа UTC, форма (n, 8760).
+
+    Сдвиг - долгота / 15, округленная до часа; последние сутки года
+    замыкаются на первые.
+    """
+    shift = np.rint(np.atleast_1d(np.asarray(lon, dtype=np.float64)) / 15).astype(np.int64)
+    return (np.arange(HOURS_IN_YEAR) + shift[:, None]) % HOURS_IN_YEAR
+
+
+def day_sums(hourly, hours):
+    """Суммы за местные солнечные сутки, повторенные для каждого часа UTC этих суток.
+
+    hours - номера местных часов из local_hours. Сутки UTC на дальних
+    долготах режут световой день пополам, и дневные суммы смешивали бы
+    вечер одного дня с утром следующего.
+    """
+    local = np.empty_like(hourly)
+    np.put_along_axis(local, hours, hourly, axis=1)
+    sums = np.repeat(local.reshape(len(local), -1, 24).sum(axis=2), 24, axis=1)
+    return np.take_along_axis(sums, hours, axis=1)
+
+
+def location_inputs(locations):
+    """Широты, долготы и среднемесячная инсоляция (12, n) для словаря точек"""
+    _, lat, lon, annual = location_columns(locations)
+    return lat, lon, annual * monthly_profile(lat)
+
+
+# Массивы ресурса, первая ось которых - точки
+RESOURCE_FIELDS = ('lat', 'lon', 'beam_up', 'beam_north', 'beam_east', 'dhi', 'ghi', 'temperature')
+
+
+class SolarResource:
+    """Почасовой солнечный ресурс года для набора точек.
+
+    Среднемесячная инсоляция горизонтальной площадки делится на рассеянную
+    и прямую по среднемесячной корреляции Эрбса и раскладывается по часам
+    профилями Лю-Джордана и Коллареса-Перейры-Рабла.
+    Облучение наклонной панели - линейная комбинация заранее посчитанных
+    массивов, поэтому перебор ориентаций не пересчитывает геометрию Солнца.
+    """
+
+    def __init__(self, lat, lon, monthly_ghi, monthly_temperature=None):
+        self.lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        self.lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        monthly_ghi = np.asarray(monthly_ghi, dtype=np.float64).reshape(12, -1)
+        if monthly_temperature is None:
+            monthly_temperature = estimate_monthly_temperature(self.lat)
+        monthly_temperature = np.broadcast_to(np.asarray(monthly_temperature, dtype=np.float64),
+                                              (12, len(self.lat)))
+
+        cos_zenith, azimuth, solar_time, declination = solar_position(self.lat, self.lon)
+        hours = local_hours(self.lon)
+        day_of_year = np.arange(HOURS_IN_YEAR) // 24 + 1
+        extraterrestrial = SOLAR_CONSTANT * (1 + 0.033 * np.cos(2 * np.pi * day_of_year / 365)) \
+            * np.maximum(cos_zenith, 0.0)
+
+        # Дневная сумма инсоляции берется из месяца местных суток, индекс ясности сохраняет ее точно
+        month_of_hour = np.repeat(np.arange(12), (DAYS_IN_MONTH * 24).astype(np.int64))[hours]
+        daily_ghi = np.take_along_axis(monthly_ghi.T, month_of_hour, axis=1) * 1000
+        daily_extraterrestrial = day_sums(extraterrestrial, hours)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            clearness = np.where(daily_extraterrestrial > 0, daily_ghi / daily_extraterrestrial, 0.0)
+        # Рассеянное идет по ходу внеатмосферного (Лю-Джордан), суммарное - по
+        # Колларесу-Перейре и Раблу: в ясные часы около полудня прямого больше
+        sunset_angle = np.arccos(np.clip(-np.tan(np.radians(self.lat))[:, None] * np.tan(declination), -1.0, 1.0))
+        weighted = hourly_global_weight(np.radians(15 * (solar_time - 12)), sunset_angle) * extraterrestrial
+        daily_weighted = day_sums(weighted, hours)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ghi = np.where(daily_weighted > 0, daily_ghi * weighted / daily_weighted, 0.0)
+        dhi = np.minimum(daily_diffuse_fraction(clearness, sunset_angle) * clearness * extraterrestrial, ghi)
+        beam = ghi - dhi
+        # У горизонта прямое излучение численно неустойчиво, относим его к рассеянному
+        low_sun = cos_zenith < MIN_COS_ZENITH
+        dhi = np.where(low_sun, ghi, dhi)
+        beam = np.where(low_sun, 0.0, beam)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dni = np.where(low_sun, 0.0, beam / cos_zenith)
+
+        sin_zenith = np.sqrt(np.maximum(1 - cos_zenith ** 2, 0.0))
+        # Составляющие вектора прямого излучения: вертикаль, север и восток
+        self.beam_up = beam
+        self.beam_north = dni * sin_zenith * np.cos(azimuth)
+        self.beam_east = dni * sin_zenith * np.sin(azimuth)
+        self.dhi = dhi
+        self.ghi = ghi
+        # Суточный ход температуры с максимумом в 15 часов солнечного времени
+        self.temperature = np.take_along_axis(monthly_temperature.T, month_of_hour, axis=1) + 4 * np.cos(2 * np.pi * (solar_time - 15) / 24)
+
+    @classmethod
+    def from_locations(cls, locations):
+        """Ресурс для словаря вида {имя: {'coords': [lat, lon], 'insolation': ...}}"""
+        return cls(*location_inputs(locations))
+
+    def select(self, rows):
+        """Ресурс только для строк rows; массивы копируются, исходный можно освободить"""
+        subset = object.__new__(type(self))
+        for field in RESOURCE_FIELDS:
+            setattr(subset, field, getattr(self, field)[rows])
+        return subset
+
+    def split(self):
+        """Отдельный ресурс для каждой точки"""
+        return [self.select([row]) for row in range(len(self))]
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _rows(self, array, rows, ndim):
+        # Строки точек с осями ориентаций между точкой и часом
+        selected = array if rows is None else array[rows]
+        return selected.reshape(selected.shape[:1] + (1,) * (ndim - 1) + selected.shape[1:])
+
+    def plane_of_array(self, tilt, azimuth, albedo=0.2, rows=None):
+        """Облучение панели, Вт/м², форма (точки, *ориентации, 8760).
+
+        tilt и azimuth в градусах (азимут от севера по часовой, 180 - юг)
+        приводятся к общей форме, первая ось которой - точки.
+        """
+        tilt, azimuth = np.broadcast_arrays(np.radians(np.asarray(tilt, dtype=np.float64)),
+                                            np.radians(np.asarray(azimuth, dtype=np.float64)))
+        ndim = max(tilt.ndim, 1)
+        tilt = tilt.reshape(tilt.shape or (1,))[..., None]
+        azimuth = azimuth.reshape(azimuth.shape or (1,))[..., None]
+        cos_tilt, sin_tilt = np.cos(tilt), np.sin(tilt)
+
+        beam = self._rows(self.beam_up, rows, ndim) * cos_tilt + sin_tilt * (
+            self._rows(self.beam_north, rows, ndim) * np.cos(azimuth)
+            + self._rows(self.beam_east, rows, ndim) * np.sin(azimuth)
+        )
+        # Изотропная модель неба Лю-Джордана и отражение от земли
+        return (np.maximum(beam, 0.0)
+                + self._rows(self.dhi, rows, ndim) * (1 + cos_tilt) / 2
+                + self._rows(self.ghi, rows, ndim) * albedo * (1 - cos_tilt) / 2)
+
+    def simulate(self, tilt, azimuth, system=PVSystem(), rows=None):
+        """Почасовая выработка за год и итоги по месяцам, кВтч.
+
+        Возвращает словарь массивов: hourly (..., 8760, часы года по UTC), monthly (..., 12),
+        yearly, poa_yearly (кВтч/м² на панель), specific_yield (кВтч/кВтп)
+        и performance_ratio.
+        """
+        poa = self.plane_of_array(tilt, azimuth, system.albedo, rows)
+        ndim = poa.ndim - 1
+        # Температура элемента по NOCT и снижение мощности от нагрева
+        cell_temperature = self._rows(self.temperature, rows, ndim) + poa * (system.noct - 20) / 800
+        derate = 1 + system.temp_coefficient * (cell_temperature - 25)
+        hourly = poa / 1000 * system.panel_area * system.efficiency * derate * (1 - system.losses)
+
+        monthly = np.add.reduceat(hourly, MONTH_START_HOURS, axis=-1)
+        yearly = monthly.sum(axis=-1)
+        poa_yearly = poa.sum(axis=-1) / 1000
+        peak_power = system.panel_area * system.efficiency
+        with np.errstate(divide='ignore', invalid='ignore'):
+            performance_ratio = np.where(poa_yearly > 0, yearly / (poa_yearly * peak_power), 0.0)
+        return {
+            'hourly': hourly,
+            'monthly': monthly,
+            'yearly': yearly,
+            'poa_yearly': poa_yearly,
+            'specific_yield': yearly / peak_power,
+            'performance_ratio': performance_ratio,
+        }
@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него отдаем только gzip
+    brotli = None
+
+
+def is_stale(version, current):
+    """Версия старше той, что уже в кэше: запрос еще работает с прежним снимком данных.
+
+    Порядок знают только версии с номером снимка (generation); для
+    простых строк любая другая версия считается новой.
+    """
+    if current is None or version == current:
+        return False
+    generation = getattr(version, 'generation', None)
+    current_generation = getattr(current, 'generation', None)
+    return generation is not None and current_generation is not None and generation < current_generation
+
+
+class VersionedValue:
+    """Производное от данных значение, которое пересобирается при смене версии"""
+
+    def __init__(self, build, version_getter):
+        self._build = build
+        self._version_getter = version_getter
+        self._version = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = self._version_getter()
+        if self._version == version:
+            return self._value
+        if is_stale(version, self._version):
+            # Значение для прежней версии строится без сохранения, кэш не откатывается
+            return self._build()
+        # Сборка под блокировкой, чтобы тяжелое значение не строилось дважды
+        with self._lock:
+            if self._version == version:
+                return self._value
+            if not is_stale(version, self._version):
+                self._value = self._build()
+                self._version = version
+                return self._value
+        # Пока ждали блокировку, кэш перешел на более новую версию
+        return self._build()
+
+
+class CompressedAsset:
+    """Готовое тело ответа с ETag и заранее сжатыми вариантами"""
+
+    def __init__(self, body, content_type, compress=True, brotli_quality=11):
+        self.content_type = content_type
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {'identity': body}
+        # Уже сжатые форматы (PNG) повторно не сжимаем
+        if compress:
+            self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body, quality=brotli_quality)
+
+    def choose_encoding(self, accept_encodings):
+        """Выбирает самый компактный вариант, который принимает клиент"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding] > 0:
+                return encoding
+        return 'identity'
+
+    def size(self, encoding='identity'):
+        return len(self.variants[encoding])
+
+
+class BoundedCache:
+    """Ограниченный LRU-кэш результатов расчета по ключу и версии данных.
+
+    get_many() досчитывает все промахи одним вызовом compute(), чтобы
+    векторные расчеты не дробились на отдельные ключи. get() для дорогих
+    одиночных значений (карт, страниц) считает ключ один раз, даже если
+    промахов по нему пришло несколько сразу: остальные запросы ждут
+    результата первого, не занимая места в пуле тяжелых расчетов.
+    """
+
+    def __init__(self, version_getter, maxsize=1024):
+        self._version_getter = version_getter
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def _sync_version(self, version):
+        """Переходит на новую версию; False, если версия старше текущей"""
+        if is_stale(version, self._version):
+            return False
+        if version != self._version:
+            self.expired += len(self._entries)
+            self._entries = OrderedDict()
+            self._version = version
+        return True
+
+    def get_many(self, keys, compute):
+        """Значения для ключей; compute(список промахов) возвращает значения в том же порядке"""
+        version = self._version_getter()
+        found = {}
+        with self._lock:
+            # Для прежней версии все считается заново и не сохраняется
+            current = self._sync_version(version)
+            for key in keys if current else ():
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+            self.hits += len(found)
+            missing = list(dict.fromkeys(key for key in keys if key not in found))
+            self.misses += len(missing)
+
+        if missing:
+            # Считаем вне блокировки, чтобы не задерживать попадания в кэш
+            computed = dict(zip(missing, compute(missing)))
+            found.update(computed)
+            with self._lock:
+                self._store(version, computed)
+        return [found[key] for key in keys]
+
+    def get(self, key, compute):
+        """Значение для ключа; compute(ключ) вызывается только при промахе"""
+        version = self._version_getter()
+        with self._lock:
+            current = self._sync_version(version)
+            if current and key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            # Значение для прежней версии не сохраняется, поэтому и не разделяется
+            flight = self._in_flight.get((version, key)) if current else None
+            if flight is not None:
+                self.coalesced += 1
+            elif current:
+                self._in_flight[version, key] = leader = Future()
+
+        if flight is not None:
+            return flight.result()
+        if not current:
+            return compute(key)
+
+        # Считаем вне блокировки, чтобы не задерживать попадания в кэш
+        try:
+            value = compute(key)
+        except BaseException as error:
+            with self._lock:
+                self._in_flight.pop((version, key), None)
+            # Ожидавшие получают ту же ошибку (например, 503 при перегрузке)
+            leader.set_exception(error)
+            raise
+        with self._lock:
+            self._in_flight.pop((version, key), None)
+            self._store(version, {key: value})
+        leader.set_result(value)
+        return value
+
+    def _store(self, version, computed):
+        """Сохраняет посчитанные значения, если кэш еще на той же версии; вызывается под блокировкой"""
+        if self._version != version:
+            return
+        self._entries.update(computed)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'version': self._version,
+                'entries': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evicted': self.evicted,
+                'expired': self.expired,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            }
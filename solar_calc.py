@@ -0,0 +1,75 @@
+import numpy as np
+
+# Параметры панелей по умолчанию: площадь в м² и КПД
+DEFAULT_PANEL_AREA = 10
+DEFAULT_EFFICIENCY = 0.18
+# Тариф на электроэнергию, руб за кВтч
+ELECTRICITY_TARIFF = 5.5
+# Выбросы CO2, кг на кВтч
+CO2_FACTOR = 0.4
+# Потери системы (инвертор, кабели, загрязнение), доля; по умолчанию не учитываются
+DEFAULT_LOSSES = 0.0
+
+
+def calculate_solar_potential(city_data, panel_area=DEFAULT_PANEL_AREA, efficiency=DEFAULT_EFFICIENCY,
+                              tariff=ELECTRICITY_TARIFF, co2_factor=CO2_FACTOR, losses=DEFAULT_LOSSES):
+    """Рассчитывает потенциал солнечной энергии"""
+    daily_kwh = city_data['insolation'] * panel_area * efficiency * (1 - losses)
+    monthly_kwh = daily_kwh * 30
+    yearly_kwh = daily_kwh * 365
+
+    return {
+        'daily': round(daily_kwh, 2),
+        'monthly': round(monthly_kwh, 2),
+        'yearly': round(yearly_kwh, 2),
+        'savings': round(yearly_kwh * tariff / 1000, 2),  # тыс. руб в год
+        'co2_reduction': round(yearly_kwh * co2_factor / 1000, 2),  # тонн CO2 в год
+    }
+
+
+def round_like_python(values, ndigits=2):
+    """Округляет массив так же, как встроенный round() для float"""
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    result = np.rint(scaled) / scale
+
+    # Умножение на scale неточно: значения рядом с серединой между соседями
+    # (и слишком большие для rint) досчитываем через round() поэлементно
+    with np.errstate(invalid='ignore'):
+        distance = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5)
+        tolerance = np.maximum(np.abs(scaled) * 1e-15, 1e-9)
+        suspicious = (distance <= tolerance) | ~(np.abs(scaled) < 2.0 ** 52)
+    if suspicious.any():
+        fallback = np.array([round(float(v), ndigits) for v in values[suspicious]], dtype=np.float64)
+        result = np.array(result, copy=True)
+        result[suspicious] = fallback
+    return result
+
+
+def calculate_solar_potential_batch(insolation, panel_area=DEFAULT_PANEL_AREA, efficiency=DEFAULT_EFFICIENCY,
+                                    tariff=ELECTRICITY_TARIFF, co2_factor=CO2_FACTOR, losses=DEFAULT_LOSSES):
+    """Векторный расчет потенциала для массивов параметров.
+
+    Аргументы приводятся к общей форме по правилам broadcasting, поэтому
+    перебор сочетаний делается через оси, например insolation[:, None].
+    Возвращает словарь столбцов с теми же ключами и округлением, что и
+    calculate_solar_potential().
+    """
+    insolation, panel_area, efficiency, tariff, co2_factor, losses = np.broadcast_arrays(
+        *(np.asarray(value, dtype=np.float64)
+          for value in (insolation, panel_area, efficiency, tariff, co2_factor, losses))
+    )
+
+    # Порядок операций повторяет скалярную функцию, чтобы совпадали биты
+    daily_kwh = insolation * panel_area * efficiency * (1 - losses)
+    monthly_kwh = daily_kwh * 30
+    yearly_kwh = daily_kwh * 365
+
+    return {
+        'daily': round_like_python(daily_kwh),
+        'monthly': round_like_python(monthly_kwh),
+        'yearly': round_like_python(yearly_kwh),
+        'savings': round_like_python(yearly_kwh * tariff / 1000),
+        'co2_reduction': round_like_python(yearly_kwh * co2_factor / 1000),
+    }
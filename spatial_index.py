@@ -0,0 +1,253 @@
+import heapq
+
+import numpy as np
+
+from data_store import location_columns
+
+# Средний радиус Земли, км
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_unit_vectors(lat, lon):
+    """Переводит широту и долготу в точки на единичной сфере"""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord):
+    """Переводит длину хорды на единичной сфере в расстояние по дуге"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+
+class SpatialIndex:
+    """Индекс точек: KD-дерево для поиска ближайших и сетка ячеек для bbox.
+
+    KD-дерево строится по точкам на единичной сфере, поэтому поиск честно
+    учитывает расстояние по дуге и переход через 180-й меридиан. Для bbox
+    точки отсортированы по номеру ячейки сетки, и каждая строка ячеек
+    запроса превращается в один-два бинарных поиска.
+    """
+
+    def __init__(self, names, lat, lon, leaf_size=32, cell_size=1.0):
+        self.names = list(names)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = (np.asarray(lon, dtype=np.float64) + 180.0) % 360.0 - 180.0
+        self._points = to_unit_vectors(self.lat, self.lon).reshape(-1, 3)
+        self._build_tree(leaf_size)
+        self._build_grid(cell_size)
+
+    @classmethod
+    def from_locations(cls, locations, **kwargs):
+        """Строит индекс по словарю вида {имя: {'coords': [lat, lon], ...}}"""
+        names, lat, lon, _ = location_columns(locations)
+        return cls(names, lat, lon, **kwargs)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _build_tree(self, leaf_size):
+        # Дерево хранится в плоских списках: узел - это отрезок массива order
+        self._order = np.arange(len(self._points))
+        self._node_start = []
+        self._node_end = []
+        self._node_children = []
+        self._node_min = []
+        self._node_max = []
+        if not len(self._points):
+            return
+
+        self._add_node(0, len(self._points))
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            start, end = self._node_start[node], self._node_end[node]
+            if end - start <= leaf_size:
+                continue
+            # Делим по оси с наибольшим разбросом, медиана через argpartition
+            spread = self._node_max[node] - self._node_min[node]
+            axis = int(np.argmax(spread))
+            middle = (start + end) // 2
+            segment = self._order[start:end]
+            partition = np.argpartition(self._points[segment, axis], middle - start)
+            self._order[start:end] = segment[partition]
+            left = self._add_node(start, middle)
+            right = self._add_node(middle, end)
+            self._node_children[node] = (left, right)
+            stack.extend((left, right))
+
+        self._node_min = np.array(self._node_min)
+        self._node_max = np.array(self._node_max)
+        self._tree_points = self._points[self._order]
+
+    def _add_node(self, start, end):
+        points = self._points[self._order[start:end]]
+        self._node_start.append(start)
+        self._node_end.append(end)
+        self._node_children.append(None)
+        self._node_min.append(points.min(axis=0))
+        self._node_max.append(points.max(axis=0))
+        return len(self._node_start) - 1
+
+    def _build_grid(self, cell_size):
+        self._cell_size = float(cell_size)
+        self._grid_cols = int(np.ceil(360.0 / self._cell_size))
+        self._grid_rows = int(np.ceil(180.0 / self._cell_size))
+        cells = self._cell_ids(self.lat, self.lon)
+        self._grid_order = np.argsort(cells, kind='stable')
+        self._grid_cells = cells[self._grid_order]
+
+    def _cell_row(self, lat):
+        return np.clip(((np.asarray(lat) + 90.0) // self._cell_size).astype(np.int64), 0, self._grid_rows - 1)
+
+    def _cell_col(self, lon):
+        return np.clip(((np.asarray(lon) + 180.0) // self._cell_size).astype(np.int64), 0, self._grid_cols - 1)
+
+    def _cell_ids(self, lat, lon):
+        return self._cell_row(lat) * self._grid_cols + self._cell_col(lon)
+
+    def nearest(self, lat, lon, k=1):
+        """Возвращает до k ближайших точек как список (индекс, расстояние в км)"""
+        if not len(self) or k < 1:
+            return []
+        target = to_unit_vectors(lat, lon)
+        node_min, node_max = self._node_min, self._node_max
+
+        # Лучшие найденные точки: куча с отрицательными квадратами расстояний
+        best = []
+        queue = [(0.0, 0)]
+        while queue:
+            bound, node = heapq.heappop(queue)
+            if len(best) == k and bound > -best[0][0]:
+                break
+            children = self._node_children[node]
+            if children is None:
+                start, end = self._node_start[node], self._node_end[node]
+                distances = np.sum((self._tree_points[start:end] - target) ** 2, axis=1)
+                for position in np.argsort(distances)[:k]:
+                    item = (-float(distances[position]), int(self._order[start + position]))
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item[0] > best[0][0]:
+                        heapq.heapreplace(best, item)
+                    else:
+                        break
+                continue
+            for child in children:
+                # Квадрат расстояния от цели до параллелепипеда узла
+                gap = np.maximum(node_min[child] - target, 0) + np.maximum(target - node_max[child], 0)
+                heapq.heappush(queue, (float(gap @ gap), child))
+
+        best.sort(reverse=True)
+        return [(index, float(chord_to_km(np.sqrt(-distance)))) for distance, index in best]
+
+    def nearest_many(self, lat, lon, k=1, block_size=4.0, max_pairs=2 ** 22):
+        """k ближайших точек для массива запросов: индексы и хорды, обе формы (n, k).
+
+        Запросы группируются в квадраты block_size градусов. Кандидаты для
+        группы берутся через bbox вокруг сферических шапок, радиус которых
+        не меньше расстояния до k-го соседа, поэтому ответ точный. Матрица
+        расстояний считается кусками не больше max_pairs элементов.
+        """
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        lon = (np.asarray(lon, dtype=np.float64).ravel() + 180.0) % 360.0 - 180.0
+        k = min(k, len(self))
+        indices = np.empty((lat.size, k), dtype=np.int64)
+        chords = np.empty((lat.size, k))
+        if not lat.size or not k:
+            return indices, chords
+
+        if lat.size * len(self) <= max_pairs:
+            # Мало точек: полный перебор дешевле группировки
+            return self._nearest_among(to_unit_vectors(lat, lon), np.arange(len(self)), k, max_pairs)
+
+        block_cols = int(np.ceil(360.0 / block_size))
+        blocks = np.floor((lat + 90.0) / block_size) * block_cols + np.floor((lon + 180.0) / block_size)
+        order = np.argsort(blocks, kind='stable')
+        for group in np.split(order, np.flatnonzero(np.diff(blocks[order])) + 1):
+            group_lat, group_lon = lat[group], lon[group]
+            points = to_unit_vectors(group_lat, group_lon)
+            # Расширяем шапки, пока в них не наберется k кандидатов
+            radius = block_size
+            candidates = self._cap_candidates(group_lat, group_lon, radius)
+            while len(candidates) < k:
+                radius *= 2
+                candidates = self._cap_candidates(group_lat, group_lon, radius)
+            found, found_chords = self._nearest_among(points, candidates, k, max_pairs)
+            # Самый дальний k-й сосед может лежать за шапкой; тогда ищем еще раз по его расстоянию
+            needed = float(np.degrees(2 * np.arcsin(min(found_chords[:, -1].max() / 2, 1.0))))
+            if needed > radius:
+                candidates = self._cap_candidates(group_lat, group_lon, needed + 1e-9)
+                found, found_chords = self._nearest_among(points, candidates, k, max_pairs)
+            indices[group] = found
+            chords[group] = found_chords
+        return indices, chords
+
+    def _cap_candidates(self, lat, lon, radius):
+        """Точки в bbox, который покрывает шапки радиуса radius градусов вокруг запросов"""
+        if radius >= 180.0:
+            return np.arange(len(self))
+        south = max(float(lat.min()) - radius, -90.0)
+        north = min(float(lat.max()) + radius, 90.0)
+        max_abs_lat = float(np.abs(lat).max())
+        if max_abs_lat + radius >= 90.0:
+            # Шапка накрывает полюс: подходят все долготы
+            return self.bbox(south, -180.0, north, 180.0)
+        half = float(np.degrees(np.arcsin(np.sin(np.radians(radius)) / np.cos(np.radians(max_abs_lat)))))
+        west, east = float(lon.min()) - half, float(lon.max()) + half
+        if east - west >= 360.0:
+            return self.bbox(south, -180.0, north, 180.0)
+        return self.bbox(south, west, north, east)
+
+    def _nearest_among(self, points, candidates, k, max_pairs):
+        """k ближайших из candidates для каждой точки, отсортированные по расстоянию"""
+        candidate_points = self._points[candidates]
+        indices = np.empty((len(points), k), dtype=np.int64)
+        chords = np.empty((len(points), k))
+        rows = max(1, max_pairs // len(candidates))
+        for start in range(0, len(points), rows):
+            distance_sq = np.maximum(2 - 2 * points[start:start + rows] @ candidate_points.T, 0)
+            if len(candidates) > k:
+                nearest = np.argpartition(distance_sq, k - 1, axis=1)[:, :k]
+            else:
+                nearest = np.broadcast_to(np.arange(k), (len(distance_sq), k))
+            nearest_sq = np.take_along_axis(distance_sq, nearest, axis=1)
+            ranked = np.argsort(nearest_sq, axis=1)
+            indices[start:start + rows] = candidates[np.take_along_axis(nearest, ranked, axis=1)]
+            chords[start:start + rows] = np.sqrt(np.take_along_axis(nearest_sq, ranked, axis=1))
+        return indices, chords
+
+    def bbox(self, south, west, north, east):
+        """Индексы точек внутри прямоугольника; west > east означает переход через 180°"""
+        if not len(self) or south > north:
+            return np.empty(0, dtype=np.int64)
+        west = (west + 180.0) % 360.0 - 180.0 if west != 180.0 else west
+        east = (east + 180.0) % 360.0 - 180.0 if east != 180.0 else east
+        if west <= east:
+            col_ranges = [(self._cell_col(west), self._cell_col(east))]
+        else:
+            # Если east попадает в столбец не левее west, вторая полоса не должна
+            # повторять столбцы первой, иначе точки из них вернутся дважды
+            first_col = self._cell_col(west)
+            col_ranges = [(first_col, self._grid_cols - 1), (0, min(self._cell_col(east), first_col - 1))]
+
+        chunks = []
+        for row in range(int(self._cell_row(south)), int(self._cell_row(north)) + 1):
+            base = row * self._grid_cols
+            for first, last in col_ranges:
+                lo, hi = np.searchsorted(self._grid_cells, [base + first, base + last + 1])
+                if hi > lo:
+                    chunks.append(self._grid_order[lo:hi])
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+
+        # Крайние ячейки покрывают прямоугольник с запасом, уточняем точно
+        candidates = np.concatenate(chunks)
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        inside = (lat >= south) & (lat <= north)
+        if west <= east:
+            inside &= (lon >= west) & (lon <= east)
+        else:
+            inside &= (lon >= west) | (lon <= east)
+        return np.sort(candidates[inside])
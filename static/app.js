@@ -0,0 +1,105 @@
+// Основные функции
+function searchCity() {
+    const input = document.getElementById('city-input');
+    const city = input.value.trim();
+
+    if (city) {
+        window.location.href = '/?city=' + encodeURIComponent(city);
+    }
+}
+
+function searchCityByName(cityName) {
+    document.getElementById('city-input').value = cityName;
+    searchCity();
+}
+
+function zoomIn() {
+    const iframe = document.querySelector('#map iframe');
+    if (iframe && iframe.contentWindow && iframe.contentWindow.map) {
+        iframe.contentWindow.map.zoomIn();
+    }
+}
+
+function resetMap() {
+    window.location.href = '/';
+}
+
+function showBestRegions() {
+    // Показать регионы с лучшей инсоляцией
+    alert('Лучшие регионы для солнечных панелей: Сочи, Махачкала, Астрахань, Краснодар');
+}
+
+// Калькулятор солнечной энергии: формулы и тарифы считаются только на сервере
+function calculateSolar() {
+    const panelArea = parseFloat(document.getElementById('panel-area').value);
+    const efficiency = parseFloat(document.getElementById('efficiency').value) / 100;
+    const params = 'panel_area=' + encodeURIComponent(panelArea) + '&efficiency=' + encodeURIComponent(efficiency);
+
+    // Данные выбранного города или точки приходят из атрибутов панели
+    const panel = document.querySelector('.solar-panel');
+    let url;
+    if (panel.dataset.lat) {
+        url = '/api/solar-point?lat=' + panel.dataset.lat + '&lon=' + panel.dataset.lon + '&' + params;
+    } else if (panel.dataset.insolation) {
+        url = '/api/solar-data?city=' + encodeURIComponent(panel.dataset.city) + '&' + params;
+    } else {
+        alert('Сначала выберите город для расчета');
+        return;
+    }
+
+    fetch(url)
+        .then(function(response) { return response.json(); })
+        .then(function(data) {
+            if (!data.success) {
+                alert(data.error);
+                return;
+            }
+            const potential = data.results ? data.results[0].potential : data.potential;
+
+            // Обновление данных
+            const cards = document.querySelectorAll('.stat-card');
+            cards[0].querySelector('.stat-value').textContent = potential.daily + ' кВтч';
+            cards[1].querySelector('.stat-value').textContent = potential.yearly + ' кВтч';
+            cards[2].querySelector('.stat-value').textContent = potential.savings + ' тыс.руб';
+            cards[3].querySelector('.stat-value').textContent = potential.co2_reduction + ' тонн';
+
+            alert('Расчет обновлен для новых параметров!');
+        });
+}
+
+// Автоматический фокус на поле ввода
+window.addEventListener('load', function() {
+    if (!document.querySelector('.solar-panel').dataset.city) {
+        document.getElementById('city-input').focus();
+    }
+});
+
+// Подсказки городов с сервера по мере ввода
+let suggestTimer = null;
+document.getElementById('city-input').addEventListener('input', function() {
+    const query = this.value.trim();
+    clearTimeout(suggestTimer);
+    if (!query) {
+        return;
+    }
+    suggestTimer = setTimeout(function() {
+        fetch('/api/autocomplete?q=' + encodeURIComponent(query) + '&limit=8')
+            .then(function(response) { return response.json(); })
+            .then(function(data) {
+                const list = document.getElementById('city-suggestions');
+                list.innerHTML = '';
+                data.results.forEach(function(item) {
+                    const option = document.createElement('option');
+                    option.value = item.city;
+                    list.appendChild(option);
+                });
+            });
+    }, 150);
+});
+
+// Поиск по Enter
+document.getElementById('city-input').addEventListener('keypress', function(e) {
+    if (e.key === 'Enter') {
+        searchCity();
+    }
+});
@@ -0,0 +1,63 @@
+import pytest
+
+from city_search import CitySearchIndex, normalize
+
+NAMES = ['Москва', 'Мурманск', 'Махачкала', 'Нижний Новгород', 'Великий Новгород', 'Хабаровск',
+         'Екатеринбург', 'Новосибирск', 'Новороссийск', 'Орёл', 'Санкт-Петербург']
+# Население в тысячах: по нему ранжируются совпадения одного вида
+WEIGHTS = [13000, 270, 620, 1200, 220, 610, 1500, 1600, 270, 300, 5600]
+
+
+@pytest.fixture(scope='module')
+def index():
+    return CitySearchIndex(NAMES, WEIGHTS)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('Хабаровск', 'khabarovsk'),
+    ('Habarovsk', 'khabarovsk'),
+    ('Yekaterinburg', 'ekaterinburg'),
+    ('Екатеринбург', 'ekaterinburg'),
+    ('орел', 'orel'),
+    ('ОРЁЛ', 'orel'),
+    ('Санкт-Петербург', 'sankt peterburg'),
+])
+def test_normalize_merges_alphabets_and_spellings(query, expected):
+    assert normalize(query) == normalize(expected)
+
+
+def test_prefix_ranks_by_weight(index):
+    assert [NAMES[i] for i in index.prefix('м')] == ['Москва', 'Махачкала', 'Мурманск']
+
+
+def test_full_name_prefix_beats_word_prefix(index):
+    # "Новгород" - начало слова в двух названиях, но начало полного у Новосибирска и Новороссийска
+    assert [NAMES[i] for i in index.prefix('нов')] == ['Новосибирск', 'Новороссийск', 'Нижний Новгород',
+                                                        'Великий Новгород']
+
+
+def test_exact_match_comes_first(index):
+    assert NAMES[index.prefix('Орел')[0]] == 'Орёл'
+
+
+def test_prefix_honours_limit(index):
+    assert len(index.prefix('м', limit=2)) == 2
+    assert len(index.prefix('новго', limit=1)) == 1
+
+
+def test_fuzzy_finds_typos(index):
+    assert NAMES[index.fuzzy('Новасибирск')[0]] == 'Новосибирск'
+    assert NAMES[index.fuzzy('Мурмнск')[0]] == 'Мурманск'
+    assert index.fuzzy('qqqq') == []
+
+
+def test_complete_adds_fuzzy_after_prefix(index):
+    results = index.complete('Мурмнск', limit=5)
+    assert results[0] == ('Мурманск', 'fuzzy')
+    assert index.complete('Мос', limit=5)[0] == ('Москва', 'prefix')
+    assert index.complete('   ') == []
+
+
+def test_resolve(index):
+    assert index.resolve('sankt-peterburg') == 'Санкт-Петербург'
+    assert index.resolve('Санкт') is None
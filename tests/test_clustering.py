@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from clustering import CLUSTER_MAX_ZOOM, CLUSTER_MIN_ZOOM, ClusterIndex
+
+
+@pytest.fixture(scope='module')
+def index():
+    rng = np.random.default_rng(5)
+    lat = np.concatenate([rng.uniform(41, 70, 2000), rng.uniform(60, 70, 50)])
+    lon = np.concatenate([rng.uniform(20, 180, 2000), rng.uniform(-180, -170, 50)])
+    return ClusterIndex(lat, lon, rng.uniform(1, 5, len(lat)))
+
+
+@pytest.mark.parametrize('zoom', range(CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM + 1))
+def test_levels_keep_every_point_once(index, zoom):
+    level = index.levels[zoom]
+    assert level.count.sum() == len(index)
+    # Взвешенное среднее кластеров совпадает со средним по всем точкам
+    np.testing.assert_allclose((level.value * level.count).sum() / len(index), index.values.mean())
+    single = level.point >= 0
+    assert np.all(level.count[single] == 1) and np.all(level.count[~single] > 1)
+    np.testing.assert_array_equal(index.lat[level.point[single]], level.lat[single])
+
+
+@pytest.mark.parametrize('zoom', range(CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM))
+def test_clusters_split_on_zoom_in(index, zoom):
+    # Ячейки вложены, поэтому при приближении кластеров не становится меньше
+    assert len(index.levels[zoom + 1]) >= len(index.levels[zoom])
+
+
+def test_cluster_bounds_contain_center(index):
+    level = index.levels[5]
+    south, west, north, east = level.bounds.T
+    assert np.all((south <= level.lat) & (level.lat <= north))
+    assert np.all((west <= level.lon) & (level.lon <= east))
+
+
+def test_query_covers_all_points_in_world_view(index):
+    clusters, points = index.query(4, -85.0, -180.0, 85.0, 180.0)
+    assert sum(cluster['count'] for cluster in clusters) + len(points) == len(index)
+
+
+def test_query_across_antimeridian(index):
+    clusters, points = index.query(CLUSTER_MAX_ZOOM + 1, 60.0, 175.0, 70.0, 190.0)
+    lon = index.lon[points]
+    expected = np.flatnonzero((index.lat >= 60) & (index.lat <= 70)
+                              & ((index.lon >= 175) | (index.lon <= -170)))
+    assert clusters == []
+    assert sorted(points) == expected.tolist()
+    assert np.all((lon >= 175) | (lon <= -170))
+
+
+def test_empty_index():
+    index = ClusterIndex([], [], [])
+    assert index.query(5, -85.0, -180.0, 85.0, 180.0) == ([], [])
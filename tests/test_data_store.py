@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from data_store import DataStore, JsonFileSource, LocationTable, SnapshotView, SqliteSource
+
+ZONES = [{'name': 'Низкая', 'color': 'gray', 'min': 0.0, 'max': 2.5},
+         {'name': 'Высокая', 'color': 'red', 'min': 2.5, 'max': 10.0}]
+MOSCOW = {'Москва': {'coords': [55.7558, 37.6173], 'insolation': 2.75, 'color': 'orange'}}
+WITH_SOCHI = {**MOSCOW, 'Сочи': {'coords': [43.6028, 39.7342], 'insolation': 3.6, 'color': 'red'}}
+
+
+def touch_later(path):
+    # Отпечаток включает время изменения; сдвигаем его, чтобы не зависеть от точности часов ФС
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_location_table_round_trip():
+    table = LocationTable.from_mapping(WITH_SOCHI)
+    assert list(table) == ['Москва', 'Сочи']
+    assert table['Сочи']['coords'] == [43.6028, 39.7342]
+    assert table.get('Казань') is None
+    assert table.to_dict() == WITH_SOCHI
+
+
+@pytest.mark.parametrize('source_class, name', [(JsonFileSource, 'data.json'), (SqliteSource, 'data.sqlite')])
+def test_hot_reload_replaces_snapshot(tmp_path, source_class, name):
+    source = source_class(str(tmp_path / name))
+    source.save(MOSCOW, ZONES)
+    store = DataStore(source, check_interval=0)
+    first = store.current()
+    assert list(first.locations) == ['Москва']
+    assert store.current() is first
+
+    source.save(WITH_SOCHI, ZONES)
+    touch_later(source.path)
+    second = store.current()
+    assert list(second.locations) == ['Москва', 'Сочи']
+    assert second.version != first.version and second.version.generation > first.version.generation
+    # Запросы, получившие старый снимок, дорабатывают с ним
+    assert list(first.locations) == ['Москва']
+    assert store.reloads == 1
+
+
+def test_broken_file_keeps_previous_snapshot(tmp_path):
+    source = JsonFileSource(str(tmp_path / 'data.json'))
+    source.save(MOSCOW, ZONES)
+    store = DataStore(source, check_interval=0)
+    first = store.current()
+
+    with open(source.path, 'w', encoding='utf-8') as f:
+        f.write('{"locations": {"Москва"')
+    assert store.current() is first
+    assert store.failures == 1
+    # Тот же недописанный файл не перечитывается на каждом запросе
+    assert store.current() is first
+    assert store.failures == 1
+
+    source.save(WITH_SOCHI, ZONES)
+    touch_later(source.path)
+    assert list(store.current().locations) == ['Москва', 'Сочи']
+
+
+def test_missing_file_keeps_previous_snapshot(tmp_path):
+    source = JsonFileSource(str(tmp_path / 'data.json'))
+    source.save(MOSCOW, ZONES)
+    store = DataStore(source, check_interval=0)
+    first = store.current()
+    os.remove(source.path)
+    assert store.current() is first
+    assert store.failures == 1
+
+
+def test_first_load_error_is_raised(tmp_path):
+    store = DataStore(JsonFileSource(str(tmp_path / 'missing.json')))
+    with pytest.raises(FileNotFoundError):
+        store.current()
+
+
+def test_snapshot_view_follows_reload(tmp_path):
+    source = JsonFileSource(str(tmp_path / 'data.json'))
+    source.save(MOSCOW, ZONES)
+    store = DataStore(source, check_interval=0)
+    locations = SnapshotView(store.current, 'locations')
+    assert len(locations) == 1 and 'Сочи' not in locations
+
+    source.save(WITH_SOCHI, ZONES)
+    touch_later(source.path)
+    assert len(locations) == 2 and locations['Сочи']['insolation'] == 3.6
@@ -0,0 +1,77 @@
+import os
+
+from data_store import DataVersion
+from heat_tiles import TileDiskCache
+
+OLD = DataVersion('aaaa', 1)
+NEW = DataVersion('bbbb', 2)
+
+
+def tile_bytes(directory, version):
+    total = 0
+    for root, _, files in os.walk(os.path.join(directory, version)):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files if name.endswith('.png'))
+    return total
+
+
+def test_get_after_put(tmp_path):
+    cache = TileDiskCache(str(tmp_path), max_bytes=10_000)
+    assert cache.get(OLD, (3, 1, 2)) is None
+    cache.put(OLD, (3, 1, 2), b'png')
+    assert cache.get(OLD, (3, 1, 2)) == b'png'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = TileDiskCache(str(tmp_path), max_bytes=300)
+    cache.get(OLD, (5, 0, 0))
+    for y in range(3):
+        cache.put(OLD, (5, 0, y), bytes(100))
+    # Чтение делает тайл свежим, поэтому вытесняется следующий за ним
+    assert cache.get(OLD, (5, 0, 0)) is not None
+    cache.put(OLD, (5, 0, 3), bytes(100))
+    assert cache.get(OLD, (5, 0, 1)) is None
+    assert all(cache.get(OLD, (5, 0, y)) is not None for y in (0, 2, 3))
+    assert cache.evicted == 1
+    assert cache.disk_bytes() == tile_bytes(str(tmp_path), OLD) == 300
+
+
+def test_overwrite_does_not_count_twice(tmp_path):
+    cache = TileDiskCache(str(tmp_path), max_bytes=1000)
+    cache.get(OLD, (5, 0, 0))
+    cache.put(OLD, (5, 0, 0), bytes(400))
+    cache.put(OLD, (5, 0, 0), bytes(300))
+    assert cache.disk_bytes() == 300 and cache.evicted == 0
+
+
+def test_instances_share_tiles_and_cap(tmp_path):
+    first = TileDiskCache(str(tmp_path), max_bytes=500)
+    second = TileDiskCache(str(tmp_path), max_bytes=500)
+    first.get(OLD, (5, 0, 0))
+    second.get(OLD, (5, 0, 0))
+    first.put(OLD, (5, 0, 0), bytes(200))
+    # Тайл, записанный другим процессом, читается с диска
+    assert second.get(OLD, (5, 0, 0)) == bytes(200)
+    for y in range(1, 6):
+        (first if y % 2 else second).put(OLD, (5, 0, y), bytes(200))
+        assert tile_bytes(str(tmp_path), OLD) <= 500
+        assert first.disk_bytes() == second.disk_bytes() == tile_bytes(str(tmp_path), OLD)
+
+
+def test_switches_only_to_newer_version(tmp_path):
+    cache = TileDiskCache(str(tmp_path), max_bytes=1000, stale_after=0)
+    cache.get(OLD, (5, 0, 0))
+    cache.put(OLD, (5, 0, 0), b'old')
+    assert cache.get(NEW, (5, 0, 0)) is None
+    assert cache.version == NEW
+    # Запрос на прежнем снимке получает промах и не пишет тайл
+    cache.put(OLD, (5, 0, 1), b'old')
+    assert cache.get(OLD, (5, 0, 0)) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), OLD))
+
+
+def test_picks_up_tiles_left_on_disk(tmp_path):
+    TileDiskCache(str(tmp_path), max_bytes=1000).put(OLD, (5, 0, 0), b'kept')
+    cache = TileDiskCache(str(tmp_path), max_bytes=1000)
+    assert cache.get(OLD, (5, 0, 0)) == b'kept'
+    assert cache.disk_bytes() == 4
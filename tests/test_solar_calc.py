@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from solar_calc import calculate_solar_potential, calculate_solar_potential_batch, round_like_python
+
+FIELDS = ('daily', 'monthly', 'yearly', 'savings', 'co2_reduction')
+
+
+def assert_matches_scalar(insolation, panel_area, efficiency, tariff, co2_factor, losses):
+    batch = calculate_solar_potential_batch(insolation, panel_area, efficiency, tariff, co2_factor, losses)
+    params = np.broadcast_arrays(*(np.asarray(value, dtype=np.float64)
+                                   for value in (insolation, panel_area, efficiency, tariff, co2_factor, losses)))
+    for index in np.ndindex(params[0].shape):
+        values = [float(param[index]) for param in params]
+        expected = calculate_solar_potential({'insolation': values[0]}, *values[1:])
+        for field in FIELDS:
+            assert batch[field][index] == expected[field], (field, values)
+
+
+def test_batch_matches_scalar_on_random_inputs():
+    rng = np.random.default_rng(2)
+    count = 5000
+    assert_matches_scalar(
+        np.round(rng.uniform(0.5, 7.0, count), 2),
+        rng.uniform(1, 500, count),
+        rng.uniform(0.05, 0.3, count),
+        rng.uniform(2, 10, count),
+        rng.uniform(0.2, 0.9, count),
+        rng.uniform(0, 0.3, count),
+    )
+
+
+@pytest.mark.parametrize('insolation', [0.125, 0.285, 1.005, 1.115, 2.675, 3.465])
+def test_batch_matches_scalar_on_half_way_values(insolation):
+    # С площадью 1 и КПД 1 суточная выработка равна инсоляции, то есть точно
+    # попадает на середину между соседними сотыми
+    assert_matches_scalar(insolation, 1.0, 1.0, 5.5, 0.4, 0.0)
+
+
+def test_batch_broadcasts_parameter_combinations():
+    insolation = np.array([2.5, 3.1, 4.27])
+    areas = np.array([5.0, 10.0, 12.5, 20.0])
+    batch = calculate_solar_potential_batch(insolation[:, None], areas[None, :], 0.18)
+    assert batch['yearly'].shape == (3, 4)
+    assert_matches_scalar(insolation[:, None], areas[None, :], 0.18, 5.5, 0.4, 0.0)
+
+
+def test_round_like_python_on_half_way_grid():
+    # Все тысячные от 0 до 1000: половина значений ровно посередине после умножения на 100
+    values = np.arange(0, 1000000) / 1000
+    expected = np.array([round(float(value), 2) for value in values])
+    np.testing.assert_array_equal(round_like_python(values), expected)
+
+
+def test_round_like_python_on_large_and_negative_values():
+    values = np.array([-2.675, -0.005, 1e17 + 0.5, 2.0 ** 53, -1e20])
+    expected = np.array([round(float(value), 2) for value in values])
+    np.testing.assert_array_equal(round_like_python(values), expected)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from spatial_index import SpatialIndex, chord_to_km, to_unit_vectors
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(7)
+    lat = np.concatenate([rng.uniform(-90, 90, 3000), rng.uniform(84, 90, 100), rng.uniform(40, 70, 400)])
+    lon = np.concatenate([rng.uniform(-180, 180, 3100), rng.uniform(175, 185, 400)])
+    return lat, (lon + 180.0) % 360.0 - 180.0
+
+
+@pytest.fixture(scope='module')
+def index(points):
+    lat, lon = points
+    return SpatialIndex([f'p{i}' for i in range(len(lat))], lat, lon)
+
+
+def brute_nearest(points, lat, lon, k):
+    chords = np.linalg.norm(to_unit_vectors(*points) - to_unit_vectors(lat, lon), axis=1)
+    order = np.argsort(chords)[:k]
+    return order, chords[order]
+
+
+def brute_bbox(points, south, west, north, east):
+    lat, lon = points
+    inside = (lat >= south) & (lat <= north)
+    if west <= east:
+        inside &= (lon >= west) & (lon <= east)
+    else:
+        inside &= (lon >= west) | (lon <= east)
+    return np.flatnonzero(inside)
+
+
+QUERIES = [(55.75, 37.62), (0.0, 179.99), (0.0, -179.99), (89.9, 10.0), (-89.9, -120.0), (64.5, -177.0)]
+
+
+@pytest.mark.parametrize('lat, lon', QUERIES)
+def test_nearest_matches_brute_force(index, points, lat, lon):
+    expected, chords = brute_nearest(points, lat, lon, 10)
+    found = index.nearest(lat, lon, k=10)
+    assert [i for i, _ in found] == expected.tolist()
+    np.testing.assert_allclose([d for _, d in found], chord_to_km(chords), rtol=1e-9, atol=1e-6)
+
+
+def test_nearest_on_empty_index():
+    assert SpatialIndex([], [], []).nearest(55.0, 37.0, k=3) == []
+
+
+@pytest.mark.parametrize('max_pairs', [2 ** 22, 5000])
+def test_nearest_many_matches_brute_force(index, points, max_pairs):
+    # Малый max_pairs заставляет идти через группы запросов и bbox шапок
+    rng = np.random.default_rng(11)
+    lat = np.concatenate([rng.uniform(-90, 90, 300), [q[0] for q in QUERIES]])
+    lon = np.concatenate([rng.uniform(-180, 180, 300), [q[1] for q in QUERIES]])
+    indices, chords = index.nearest_many(lat, lon, k=8, max_pairs=max_pairs)
+    for row in range(len(lat)):
+        expected, expected_chords = brute_nearest(points, lat[row], lon[row], 8)
+        assert indices[row].tolist() == expected.tolist()
+        np.testing.assert_allclose(chords[row], expected_chords, rtol=1e-9, atol=1e-12)
+
+
+BOXES = [
+    (50.0, 30.0, 60.0, 40.0),
+    (-10.0, 170.0, 10.0, -170.0),
+    (-4.04, 22.49, 6.13, 22.40),
+    (60.0, 179.5, 70.0, 179.0),
+    (80.0, -180.0, 90.0, 180.0),
+    (-90.0, 0.0, 90.0, 0.0),
+    (10.0, 40.0, 5.0, 50.0),
+]
+
+
+@pytest.mark.parametrize('south, west, north, east', BOXES)
+def test_bbox_matches_brute_force(index, points, south, west, north, east):
+    found = index.bbox(south, west, north, east)
+    assert len(np.unique(found)) == len(found)
+    np.testing.assert_array_equal(found, brute_bbox(points, south, west, north, east))
+
+
+def test_bbox_matches_brute_force_on_random_boxes(index, points):
+    rng = np.random.default_rng(3)
+    for _ in range(300):
+        south, north = np.sort(rng.uniform(-90, 90, 2))
+        west, east = rng.uniform(-180, 180, 2)
+        found = index.bbox(south, west, north, east)
+        assert len(np.unique(found)) == len(found)
+        np.testing.assert_array_equal(found, brute_bbox(points, south, west, north, east))
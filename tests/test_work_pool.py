@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from work_pool import Overloaded, WorkPool
+
+
+def occupy(pool, count):
+    """Занимает count мест пула задачами, которые ждут события"""
+    release = threading.Event()
+    started = threading.Barrier(count + 1)
+
+    def task():
+        started.wait()
+        release.wait()
+
+    threads = [threading.Thread(target=pool.run, args=(task,)) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    return release, threads
+
+
+def test_rejects_when_queue_is_full():
+    pool = WorkPool(max_workers=1, max_pending=0, queue_timeout=5)
+    release, threads = occupy(pool, 1)
+    start = time.monotonic()
+    with pytest.raises(Overloaded):
+        pool.run(lambda: None)
+    assert time.monotonic() - start < 1
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert pool.run(lambda: 42) == 42
+    assert pool.stats()['rejected'] == 1 and pool.stats()['active'] == 0
+
+
+def test_waiting_task_times_out():
+    pool = WorkPool(max_workers=1, max_pending=1, queue_timeout=0.2)
+    release, threads = occupy(pool, 1)
+    with pytest.raises(Overloaded):
+        pool.run(lambda: None)
+    release.set()
+    for thread in threads:
+        thread.join()
+    stats = pool.stats()
+    assert stats['timed_out'] == 1 and stats['waiting'] == 0
+
+
+def test_rejects_at_once_when_expected_wait_exceeds_timeout():
+    pool = WorkPool(max_workers=1, max_pending=10, queue_timeout=2)
+    pool.run(time.sleep, 0.3)
+    release, threads = occupy(pool, 1)
+    queued = [threading.Thread(target=pool.run, args=(lambda: None,)) for _ in range(6)]
+    for thread in queued:
+        thread.start()
+    while pool.stats()['waiting'] < 6:
+        time.sleep(0.01)
+    # Среднее время задачи 0.3 с: седьмая в очереди ждала бы 2.1 с
+    start = time.monotonic()
+    with pytest.raises(Overloaded) as error:
+        pool.run(lambda: None)
+    assert time.monotonic() - start < 1
+    assert error.value.retry_after == 3
+    release.set()
+    for thread in threads + queued:
+        thread.join()
+    assert pool.stats()['rejected'] == 1 and pool.stats()['timed_out'] == 0
+
+
+def test_average_follows_task_time():
+    pool = WorkPool(max_workers=2, max_pending=0)
+    assert pool.expected_wait() == 0.0
+    pool.run(time.sleep, 0.05)
+    assert 0.05 <= pool.average_seconds < 0.5
+    assert pool.stats()['average_ms'] >= 50
+
+
+def test_failed_task_frees_its_place():
+    pool = WorkPool(max_workers=1, max_pending=0)
+
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        pool.run(fail)
+    assert pool.run(lambda: 'ok') == 'ok'
+    assert pool.stats()['completed'] == 2
+
+
+def test_stream_holds_place_until_closed():
+    pool = WorkPool(max_workers=1, max_pending=0)
+    stream = pool.stream(iter([b'a', b'b']))
+    with pytest.raises(Overloaded):
+        pool.stream(iter([]))
+    assert next(stream) == b'a'
+    stream.close()
+    stream.close()
+    assert pool.stats()['active'] == 0
+    # Закрытие без итерации (обрыв соединения) тоже освобождает место
+    pool.stream(iter([b'c'])).close()
+    assert pool.run(lambda: 1) == 1
@@ -0,0 +1,86 @@
+import numpy as np
+
+from zones import (ZoneGeometries, band_polygons, clip_ring, drop_collinear, point_in_ring, signed_area,
+                   simplify_ring, trace_rings)
+
+
+def test_rings_of_solid_block_and_hole():
+    mask = np.ones((5, 6), dtype=bool)
+    mask[2, 2:4] = False
+    rings = trace_rings(mask)
+    areas = sorted(signed_area(ring) for ring in rings)
+    # Внешнее кольцо против часовой стрелки, дыра - по часовой
+    assert areas == [-2.0, 30.0]
+    for ring in rings:
+        np.testing.assert_array_equal(ring[0], ring[-1])
+    assert sum(areas) == mask.sum()
+
+
+def test_cells_touching_by_corner_give_separate_rings():
+    mask = np.array([[1, 0], [0, 1]], dtype=bool)
+    rings = trace_rings(mask)
+    assert len(rings) == 2
+    assert [signed_area(ring) for ring in rings] == [1.0, 1.0]
+
+
+def test_drop_collinear_keeps_only_corners():
+    ring = np.array([(0, 0), (1, 0), (2, 0), (2, 1), (2, 2), (1, 2), (0, 2), (0, 1), (0, 0)], dtype=np.float64)
+    simplified = drop_collinear(ring)
+    assert len(simplified) == 5
+    assert signed_area(simplified) == signed_area(ring) == 4.0
+
+
+def test_simplify_ring_stays_within_tolerance():
+    angles = np.linspace(0, 2 * np.pi, 201)
+    ring = np.column_stack([np.cos(angles), np.sin(angles)])
+    ring[-1] = ring[0]
+    tolerance = 0.01
+    simplified = simplify_ring(ring, tolerance)
+    assert 4 < len(simplified) < len(ring)
+    np.testing.assert_array_equal(simplified[0], simplified[-1])
+    # Каждая исходная точка не дальше допуска от упрощенной ломаной
+    starts, ends = simplified[:-1], simplified[1:]
+    for point in ring:
+        segment = ends - starts
+        t = np.clip(np.einsum('ij,ij->i', point - starts, segment) / np.einsum('ij,ij->i', segment, segment), 0, 1)
+        distance = np.hypot(*(starts + t[:, None] * segment - point).T).min()
+        assert distance <= tolerance + 1e-12
+
+
+def test_band_polygons_attach_holes_and_drop_specks():
+    mask = np.zeros((40, 40), dtype=bool)
+    mask[5:35, 5:35] = True
+    mask[15:25, 15:25] = False
+    mask[38, 38] = True
+    polygons = band_polygons(mask, south=50.0, west=30.0, step=0.1, tolerance=0.15)
+    assert len(polygons) == 1
+    outer, hole = polygons[0]
+    assert abs(signed_area(outer) - 9.0) < 1e-9
+    assert abs(signed_area(hole) + 1.0) < 1e-9
+    assert point_in_ring(31.0, 51.0, outer) and not point_in_ring(31.0, 51.0, hole)
+    assert point_in_ring(32.0, 52.0, hole)
+
+
+def test_clip_ring_to_box():
+    square = np.array([(0, 0), (4, 0), (4, 4), (0, 4), (0, 0)], dtype=np.float64)
+    clipped = clip_ring(square, 1.0, 2.0, 3.0, 10.0)
+    assert abs(signed_area(clipped) - 4.0) < 1e-12
+    assert clip_ring(square, 5.0, 5.0, 6.0, 6.0) is None
+
+
+def test_features_by_view_clip_and_cross_antimeridian():
+    ring = [[170.0, 60.0], [190.0, 60.0], [190.0, 70.0], [170.0, 70.0], [170.0, 60.0]]
+    geometries = ZoneGeometries({5: [{
+        'type': 'Feature',
+        'properties': {'zone': 0, 'name': 'z'},
+        'geometry': {'type': 'MultiPolygon', 'coordinates': [[ring]]},
+    }]})
+    assert geometries.level_for(9) == 5 and geometries.level_for(1) == 5
+    assert len(geometries.features(5)) == 1
+    assert geometries.features(5, (0.0, 0.0, 10.0, 10.0)) == []
+
+    # Восточнее 180° геометрия возвращается в долготах -180..-170
+    west_side = geometries.features(5, (62.0, -175.0, 68.0, -172.0))
+    clipped = np.asarray(west_side[0]['geometry']['coordinates'][0][0])
+    assert clipped[:, 0].min() == -175.0 and clipped[:, 0].max() == -172.0
+    assert clipped[:, 1].min() == 62.0 and clipped[:, 1].max() == 68.0
@@ -0,0 +1,32 @@
+import math
+
+# Предел широты проекции Web Mercator
+MAX_MERCATOR_LAT = 85.0511287798
+TILE_SIZE = 256
+
+
+def tile_bounds(z, x, y):
+    """Границы тайла z/x/y как (south, west, north, east) в градусах"""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def is_valid_tile(z, x, y, max_zoom=18):
+    return 0 <= z <= max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def degrees_per_pixel(z):
+    """Ширина пикселя по долготе на уровне зума z"""
+    return 360.0 / (TILE_SIZE * 2 ** z)
+
+
+def tile_range_bounds(z, x0, y0, x1, y1):
+    """Границы прямоугольника тайлов x0..x1, y0..y1 как (south, west, north, east)"""
+    south = tile_bounds(z, x0, y1)[0]
+    west, north = tile_bounds(z, x0, y0)[1:3]
+    east = tile_bounds(z, x1, y0)[3]
+    return south, west, north, east
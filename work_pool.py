@@ -0,0 +1,160 @@
+import math
+import os
+import threading
+import time
+
+
+def process_pool_size():
+    """Сколько дочерних процессов может держать один процесс приложения.
+
+    gunicorn.conf.py делит ядра между своими воркерами и передает долю
+    через SOLAR_POOL_WORKERS; без него (dev-сервер, скрипты) доступны все ядра.
+    """
+    return int(os.environ.get('SOLAR_POOL_WORKERS', 0)) or os.cpu_count() or 1
+
+
+def spawn_pool(max_workers):
+    """Пул дочерних процессов для расчетов, которым мало одного потока запроса"""
+    # Пул процессов нужен не каждому воркеру, поэтому импортируется здесь
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    # spawn: дочерние процессы не наследуют потоки и блокировки веб-сервера
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class Overloaded(Exception):
+    """Тяжелые расчеты заняты, а очередь к ним заполнена"""
+
+    def __init__(self, retry_after=1):
+        super().__init__('Сервер перегружен, повторите запрос позже')
+        self.retry_after = retry_after
+
+
+class WorkPool:
+    """Ограничение одновременных тяжелых расчетов с обратным давлением.
+
+    Считается не больше max_workers задач сразу, остальные ждут места в
+    очереди. Длина очереди задается временем, а не числом: пул помнит
+    среднее время своих задач и сразу отвечает Overloaded (503 с
+    Retry-After), только если ожидаемое ожидание больше queue_timeout.
+    max_pending - лишь жесткий предел очереди. Через пул идут только
+    промахи кэшей, поэтому готовые ответы никогда не ждут за расчетами.
+    """
+
+    # Вес последней задачи в скользящем среднем времени
+    AVERAGE_WEIGHT = 0.2
+
+    def __init__(self, max_workers, max_pending, queue_timeout=10.0):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._running = threading.BoundedSemaphore(max_workers)
+        self._admitted = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.average_seconds = None
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def expected_wait(self):
+        """Оценка ожидания места для новой задачи, секунды; вызывается под блокировкой"""
+        if self.average_seconds is None or self.active < self.max_workers:
+            return 0.0
+        return (self.waiting + 1) / self.max_workers * self.average_seconds
+
+    def _reject(self, retry_after=1):
+        with self._lock:
+            self.rejected += 1
+        raise Overloaded(retry_after)
+
+    def _admit(self):
+        if not self._admitted.acquire(blocking=False):
+            self._reject()
+        with self._lock:
+            wait = self.expected_wait()
+            if wait <= self.queue_timeout:
+                self.waiting += 1
+        if wait > self.queue_timeout:
+            # Очередь уже длиннее, чем стоит ждать: отказ сразу, а не через queue_timeout
+            self._admitted.release()
+            self._reject(math.ceil(wait))
+        acquired = self._running.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.active += 1
+            else:
+                self.timed_out += 1
+        if not acquired:
+            self._admitted.release()
+            raise Overloaded()
+
+    def _release(self, seconds=None):
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+            if seconds is not None:
+                self.average_seconds = seconds if self.average_seconds is None else (
+                    self.average_seconds + self.AVERAGE_WEIGHT * (seconds - self.average_seconds)
+                )
+        self._running.release()
+        self._admitted.release()
+
+    def run(self, fn, *args, **kwargs):
+        """Выполняет fn в потоке запроса, когда для нее найдется место"""
+        self._admit()
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._release(time.perf_counter() - start)
+
+    def stream(self, parts):
+        """Занимает место на все время отдачи потокового ответа"""
+        self._admit()
+        return HeldStream(parts, self._release)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'active': self.active,
+                'waiting': self.waiting,
+                'average_ms': round(self.average_seconds * 1000, 3) if self.average_seconds is not None else 0.0,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+
+class HeldStream:
+    """Итератор ответа, который освобождает место в пуле при закрытии.
+
+    WSGI-сервер вызывает close() и после полной отдачи, и при обрыве
+    соединения, даже если итерация так и не началась.
+    """
+
+    def __init__(self, parts, release):
+        self._parts = iter(parts)
+        self._release = release
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._parts)
+
+    def close(self):
+        release, self._release = self._release, None
+        if release is None:
+            return
+        try:
+            close = getattr(self._parts, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            release()
@@ -0,0 +1,20 @@
+"""Точка входа production-сервера: gunicorn -c gunicorn.conf.py wsgi:app
+
+С preload_app модуль импортируется в мастере один раз: folium, таблица
+станций, индексы и отрендеренные карты готовы до fork, и воркеры делят
+эти страницы памяти с мастером по copy-on-write.
+
+SOLAR_WARM_UP_MAPS=0 - для воркеров только под API: карты не
+рендерятся заранее, а folium импортируется лишь при первом запросе /map.
+"""
+import gc
+import os
+
+from app import app, warm_up_caches
+
+warm_up_caches(maps=os.environ.get('SOLAR_WARM_UP_MAPS', '1') != '0')
+# Прогретые объекты больше не меняются: убираем их из поколений сборщика,
+# иначе его обход трогает заголовки объектов и копирует страницы в каждом воркере
+gc.freeze()
+
+__all__ = ['app']
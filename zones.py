@@ -0,0 +1,283 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from insolation_grid import annual_mean
+from tile_math import degrees_per_pixel
+
+# Уровни зума, для которых геометрия упрощается заранее
+ZOOM_LEVELS = (3, 5, 7, 9)
+# Допуск упрощения в пикселях экрана
+SIMPLIFY_PIXELS = 1.0
+
+# Направления ребер против часовой стрелки: вправо, вверх, влево, вниз
+DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+
+def trace_rings(mask):
+    """Обходит границы области маски, возвращает кольца в индексах углов ячеек.
+
+    Ячейка (r, c) занимает квадрат [c, c+1] x [r, r+1]. Ребра направлены так,
+    что область остается слева: внешние кольца идут против часовой стрелки,
+    дыры - по часовой.
+    """
+    padded = np.pad(np.asarray(mask, dtype=bool), 1)
+    inner = padded[1:-1, 1:-1]
+    rows, cols = inner.shape
+    edges = []
+    # Для каждой стороны ячейки: сосед, начало ребра и направление
+    for (dr, dc), start, direction in (
+        ((-1, 0), (0, 0), 0),   # низ: (c, r) -> (c+1, r)
+        ((0, 1), (1, 0), 1),    # право: (c+1, r) -> (c+1, r+1)
+        ((1, 0), (1, 1), 2),    # верх: (c+1, r+1) -> (c, r+1)
+        ((0, -1), (0, 1), 3),   # лево: (c, r+1) -> (c, r)
+    ):
+        neighbour = padded[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols]
+        r, c = np.nonzero(inner & ~neighbour)
+        edges.append(np.stack([c + start[0], r + start[1], np.full(len(r), direction)], axis=1))
+    edges = np.concatenate(edges)
+
+    width = cols + 1
+    outgoing = {}
+    for x, y, direction in edges.tolist():
+        outgoing.setdefault(y * width + x, []).append(direction)
+
+    rings = []
+    while outgoing:
+        start, directions = next(iter(outgoing.items()))
+        vertex, direction = start, directions[0]
+        x, y = vertex % width, vertex // width
+        ring = [(x, y)]
+        while True:
+            options = outgoing[vertex]
+            # В вершине, где ячейки касаются углами, сворачиваем налево,
+            # чтобы такие ячейки давали отдельные кольца
+            for turn in (1, 0, 3):
+                candidate = (direction + turn) % 4
+                if candidate in options:
+                    direction = candidate
+                    break
+            else:
+                direction = options[0]
+            options.remove(direction)
+            if not options:
+                del outgoing[vertex]
+            dx, dy = DIRECTIONS[direction]
+            x, y = x + dx, y + dy
+            vertex = y * width + x
+            ring.append((x, y))
+            if vertex == start:
+                break
+        rings.append(np.array(ring, dtype=np.float64))
+    return rings
+
+
+def signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+
+def drop_collinear(ring):
+    """Убирает промежуточные точки прямых участков ступенчатой границы"""
+    points = ring[:-1]
+    previous = np.roll(points, 1, axis=0)
+    following = np.roll(points, -1, axis=0)
+    cross = (points[:, 0] - previous[:, 0]) * (following[:, 1] - points[:, 1]) \
+        - (points[:, 1] - previous[:, 1]) * (following[:, 0] - points[:, 0])
+    points = points[cross != 0]
+    return np.vstack([points, points[:1]])
+
+
+def simplify_ring(ring, tolerance):
+    """Упрощение замкнутого кольца алгоритмом Дугласа-Пекера"""
+    if len(ring) <= 4 or tolerance <= 0:
+        return ring
+    keep = np.zeros(len(ring), dtype=bool)
+    # Замкнутое кольцо делим на две половины, чтобы у отрезков были разные концы
+    middle = len(ring) // 2
+    keep[[0, middle, len(ring) - 1]] = True
+    stack = [(0, middle), (middle, len(ring) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        segment = ring[last] - ring[first]
+        points = ring[first + 1:last] - ring[first]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(points[:, 0], points[:, 1])
+        else:
+            distances = np.abs(segment[0] * points[:, 1] - segment[1] * points[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.extend(((first, index), (index, last)))
+    return ring[keep]
+
+
+def point_in_ring(x, y, ring):
+    """Проверка попадания точки в кольцо методом лучей"""
+    x0, y0 = ring[:-1, 0], ring[:-1, 1]
+    x1, y1 = ring[1:, 0], ring[1:, 1]
+    crosses = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intersection = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return bool(np.count_nonzero(crosses & (x < intersection)) % 2)
+
+
+def band_polygons(mask, south, west, step, tolerance):
+    """Полигоны области маски в градусах: список [внешнее кольцо, *дыры]"""
+    outers, holes = [], []
+    for ring in trace_rings(mask):
+        # Узлы сетки - центры ячеек, поэтому углы сдвинуты на полшага
+        ring = np.column_stack([west + (ring[:, 0] - 0.5) * step, south + (ring[:, 1] - 0.5) * step])
+        ring = simplify_ring(drop_collinear(ring), tolerance)
+        area = signed_area(ring)
+        # Кольца меньше нескольких пикселей на этом зуме не видны
+        if len(ring) < 4 or abs(area) < (2 * tolerance) ** 2:
+            continue
+        (outers if area > 0 else holes).append(ring)
+
+    polygons = [[outer] for outer in outers]
+    for hole in holes:
+        for polygon in polygons:
+            if point_in_ring(hole[0, 0], hole[0, 1], polygon[0]):
+                polygon.append(hole)
+                break
+    return polygons
+
+
+def build_zone_features(grid, zones, zoom):
+    """GeoJSON-объекты зон эффективности, упрощенные для уровня зума"""
+    annual = annual_mean(np.asarray(grid.monthly, dtype=np.float64))
+    tolerance = degrees_per_pixel(zoom) * SIMPLIFY_PIXELS
+    features = []
+    for index, zone in enumerate(zones):
+        mask = (annual >= zone['min']) & (annual < zone['max'])
+        polygons = band_polygons(mask, grid.south, grid.west, grid.step, tolerance)
+        if not polygons:
+            continue
+        features.append({
+            'type': 'Feature',
+            'properties': {'zone': index, 'name': zone['name'], 'color': zone['color'],
+                           'min': zone['min'], 'max': zone['max']},
+            'geometry': {
+                'type': 'MultiPolygon',
+                'coordinates': [[np.round(ring, 4).tolist() for ring in polygon] for polygon in polygons],
+            },
+        })
+    return features
+
+
+def clip_ring(ring, south, west, north, east):
+    """Отсечение кольца прямоугольником (алгоритм Сазерленда-Ходжмана)"""
+    points = ring[:-1]
+    for axis, limit, keep_greater in ((0, west, True), (0, east, False), (1, south, True), (1, north, False)):
+        if not len(points):
+            break
+        following = np.roll(points, -1, axis=0)
+        inside = points[:, axis] >= limit if keep_greater else points[:, axis] <= limit
+        inside_next = np.roll(inside, -1)
+        clipped = []
+        for point, nxt, point_in, next_in in zip(points, following, inside, inside_next):
+            if point_in:
+                clipped.append(point)
+            if point_in != next_in:
+                t = (limit - point[axis]) / (nxt[axis] - point[axis])
+                clipped.append(point + t * (nxt - point))
+        points = np.array(clipped).reshape(-1, 2)
+    if len(points) < 3:
+        return None
+    return np.vstack([points, points[:1]])
+
+
+class ZoneGeometries:
+    """Готовые геометрии зон по уровням зума с выборкой по области просмотра"""
+
+    def __init__(self, features_by_zoom):
+        self.levels = sorted(features_by_zoom)
+        self._polygons = {}
+        for zoom, features in features_by_zoom.items():
+            polygons = []
+            for feature in features:
+                for polygon in feature['geometry']['coordinates']:
+                    rings = [np.asarray(ring, dtype=np.float64) for ring in polygon]
+                    bbox = (rings[0][:, 1].min(), rings[0][:, 0].min(), rings[0][:, 1].max(), rings[0][:, 0].max())
+                    polygons.append((feature['properties'], bbox, rings))
+            self._polygons[zoom] = polygons
+
+    @classmethod
+    def load(cls, directory):
+        """Читает заранее посчитанные файлы z<зум>.geojson"""
+        features_by_zoom = {}
+        for zoom in ZOOM_LEVELS:
+            path = os.path.join(directory, f'z{zoom}.geojson')
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    features_by_zoom[zoom] = json.load(f)['features']
+        return cls(features_by_zoom)
+
+    @classmethod
+    def build(cls, grid, zones):
+        return cls({zoom: build_zone_features(grid, zones, zoom) for zoom in ZOOM_LEVELS})
+
+    def level_for(self, zoom):
+        """Самый подробный уровень, не превышающий запрошенный зум"""
+        suitable = [level for level in self.levels if level <= zoom]
+        return suitable[-1] if suitable else self.levels[0]
+
+    def features(self, zoom, bounds=None):
+        """Объекты зон для зума, обрезанные по границам (south, west, north, east)"""
+        if not self.levels:
+            return []
+        merged = {}
+        for properties, bbox, rings in self._polygons[self.level_for(zoom)]:
+            if bounds is None:
+                merged.setdefault(properties['zone'], (properties, []))[1].append(rings)
+                continue
+            # Геометрия за 180-м меридианом хранится с долготами больше 180
+            for shift in (0.0, 360.0):
+                south, west, north, east = bounds[0], bounds[1] + shift, bounds[2], bounds[3] + shift
+                if bbox[0] > north or bbox[2] < south or bbox[1] > east or bbox[3] < west:
+                    continue
+                clipped = [clip_ring(ring, south, west, north, east) for ring in rings]
+                if clipped[0] is None:
+                    continue
+                clipped = [ring - [shift, 0.0] for ring in clipped if ring is not None]
+                merged.setdefault(properties['zone'], (properties, []))[1].append(clipped)
+
+        return [
+            {
+                'type': 'Feature',
+                'properties': properties,
+                'geometry': {
+                    'type': 'MultiPolygon',
+                    'coordinates': [[np.round(ring, 4).tolist() for ring in polygon] for polygon in polygons],
+                },
+            }
+            for _, (properties, polygons) in sorted(merged.items())
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Предрасчет геометрий зон эффективности по уровням зума')
+    parser.add_argument('output', help='каталог для файлов z<зум>.geojson')
+    args = parser.parse_args()
+
+    from app import INSOLATION_GRID, SOLAR_ZONES
+
+    grid = INSOLATION_GRID.get()
+    os.makedirs(args.output, exist_ok=True)
+    for zoom in ZOOM_LEVELS:
+        features = build_zone_features(grid, SOLAR_ZONES, zoom)
+        path = os.path.join(args.output, f'z{zoom}.geojson')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f, ensure_ascii=False)
+        print(f'{path}: {os.path.getsize(path)} байт')
+
+
+if __name__ == '__main__':
+    main()